@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
+from telegram_agent.app.queue import Macro, StepRecord, Task, TaskQueue, TaskSummary
+
+T = TypeVar("T")
+
+DEFAULT_MAX_PENDING = 64
+
+
+class AsyncTaskQueue:
+    # Runs every TaskQueue call on one dedicated DB thread so a statement waiting on a SQLite lock
+    # never blocks the event loop. At most max_pending calls are in flight; further callers wait
+    # asynchronously for a slot instead of piling up work on the thread.
+    def __init__(self, queue: TaskQueue, max_pending: int = DEFAULT_MAX_PENDING) -> None:
+        self.queue = queue
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="task-queue-db")
+        self._slots: asyncio.Semaphore | None = None
+
+    async def _call(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    async def create_task(
+        self,
+        chat_id: int,
+        user_id: int,
+        command: str,
+        plan_json: str,
+        timeout_seconds: int,
+        task_id: str | None = None,
+        lane: str = "gui",
+    ) -> str:
+        return await self._call(
+            self.queue.create_task,
+            chat_id,
+            user_id,
+            command,
+            plan_json,
+            timeout_seconds,
+            task_id=task_id,
+            lane=lane,
+        )
+
+    async def approve_task(self, task_id: str) -> bool:
+        return await self._call(self.queue.approve_task, task_id)
+
+    async def update_plan(self, task_id: str, plan_json: str, lane: str | None = None) -> bool:
+        return await self._call(self.queue.update_plan, task_id, plan_json, lane=lane)
+
+    async def cancel_task(self, task_id: str) -> bool:
+        return await self._call(self.queue.cancel_task, task_id)
+
+    async def claim_next(
+        self,
+        worker_id: str,
+        lease_seconds: float,
+        lane_limits: dict[str, int] | None = None,
+    ) -> Task | None:
+        return await self._call(self.queue.claim_next, worker_id, lease_seconds, lane_limits)
+
+    async def renew_lease(self, task_id: str, worker_id: str, lease_seconds: float) -> bool:
+        return await self._call(self.queue.renew_lease, task_id, worker_id, lease_seconds)
+
+    async def reap_expired(self, policy: str = "fail", max_attempts: int = 1) -> list[tuple[str, str]]:
+        return await self._call(self.queue.reap_expired, policy, max_attempts)
+
+    async def mark_done(self, task_id: str, result: dict[str, Any]) -> None:
+        await self._call(self.queue.mark_done, task_id, result)
+
+    async def mark_failed(self, task_id: str, message: str) -> None:
+        await self._call(self.queue.mark_failed, task_id, message)
+
+    async def get_task(self, task_id: str) -> Task | None:
+        return await self._call(self.queue.get_task, task_id)
+
+    async def get_status(self, task_id: str) -> str | None:
+        return await self._call(self.queue.get_status, task_id)
+
+    async def list_recent(self, limit: int = 5) -> list[TaskSummary]:
+        return await self._call(self.queue.list_recent, limit)
+
+    async def list_steps(self, task_id: str) -> list[StepRecord]:
+        return await self._call(self.queue.list_steps, task_id)
+
+    async def save_macro(self, name: str, task_id: str, user_id: int) -> Macro | None:
+        return await self._call(self.queue.save_macro, name, task_id, user_id)
+
+    async def get_macro(self, name: str) -> Macro | None:
+        return await self._call(self.queue.get_macro, name)
+
+    async def list_macros(self) -> list[str]:
+        return await self._call(self.queue.list_macros)
+
+    async def delete_macro(self, name: str) -> bool:
+        return await self._call(self.queue.delete_macro, name)
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import json
+import queue
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, Any, Iterator
+
+from loguru import logger
+
+AUDIT_FILENAME = "audit.jsonl"
+
+_BATCH_SIZE = 512
+_MAX_OPEN_FILES = 32
+
+
+@dataclass(frozen=True)
+class _Record:
+    task_id: str
+    line: str
+
+
+@dataclass(frozen=True)
+class _Close:
+    task_id: str
+
+
+class AuditWriter:
+    # Appends structured records to <audit_dir>/<task_id>/audit.jsonl. record() only serialises
+    # and enqueues; a background thread writes whatever piled up, flushing each touched file once
+    # per batch. Each task gets its own file, so concurrent tasks never interleave.
+    _STOP = object()
+
+    def __init__(self, audit_dir: str) -> None:
+        self.audit_dir = audit_dir
+        self._pending: queue.Queue[object] = queue.Queue()
+        self._files: OrderedDict[str, IO[str]] = OrderedDict()
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def path(self, task_id: str) -> Path:
+        return Path(self.audit_dir) / task_id / AUDIT_FILENAME
+
+    def record(self, task_id: str, event: str, **fields: Any) -> None:
+        payload = {"ts": round(time.time(), 6), "task_id": task_id, "event": event, **fields}
+        self._pending.put(_Record(task_id, json.dumps(payload, ensure_ascii=False, default=str) + "\n"))
+
+    def close_task(self, task_id: str) -> None:
+        # Releases the task's file handle once everything queued before it is written.
+        self._pending.put(_Close(task_id))
+
+    def flush(self) -> None:
+        self._pending.join()
+
+    def close(self, timeout: float = 5.0) -> None:
+        self._pending.put(self._STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning("Audit writer did not stop within {}s; pending records may be lost", timeout)
+
+    def _file(self, task_id: str) -> IO[str]:
+        handle = self._files.get(task_id)
+        if handle is not None:
+            self._files.move_to_end(task_id)
+            return handle
+        path = self.path(task_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        handle = path.open("a", encoding="utf-8")
+        self._files[task_id] = handle
+        while len(self._files) > _MAX_OPEN_FILES:
+            self._close_file(next(iter(self._files)))
+        return handle
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            items = [self._pending.get()]
+            while len(items) < _BATCH_SIZE:
+                try:
+                    items.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            touched: dict[str, IO[str]] = {}
+            # Errors are handled per item: a task whose file cannot be written must not cost other
+            # tasks their records, nor swallow a close or the stop sentinel.
+            for item in items:
+                try:
+                    if isinstance(item, _Record):
+                        handle = self._file(item.task_id)
+                        handle.write(item.line)
+                        touched[item.task_id] = handle
+                    elif isinstance(item, _Close):
+                        touched.pop(item.task_id, None)
+                        self._close_file(item.task_id)
+                    else:
+                        stopping = True
+                except Exception:  # noqa: BLE001
+                    logger.exception("Failed to write audit record for task {}", getattr(item, "task_id", "?"))
+            for task_id, handle in touched.items():
+                try:
+                    if not handle.closed:
+                        handle.flush()
+                except Exception:  # noqa: BLE001
+                    logger.exception("Failed to flush audit file for task {}", task_id)
+            for _ in items:
+                self._pending.task_done()
+        for task_id in list(self._files):
+            self._close_file(task_id)
+
+    def _close_file(self, task_id: str) -> None:
+        handle = self._files.pop(task_id, None)
+        if handle is None:
+            return
+        try:
+            handle.close()
+        except Exception:  # noqa: BLE001
+            logger.exception("Failed to close audit file for task {}", task_id)
+
+
+_current: ContextVar[tuple[AuditWriter, str] | None] = ContextVar("audit_task", default=None)
+
+
+@contextmanager
+def use_task(writer: AuditWriter, task_id: str) -> Iterator[None]:
+    reset = _current.set((writer, task_id))
+    try:
+        yield
+    finally:
+        _current.reset(reset)
+
+
+def note(message: str, **fields: Any) -> None:
+    # Lets tools add to the audit trail of whichever task is running them.
+    current = _current.get()
+    if current is not None:
+        writer, task_id = current
+        writer.record(task_id, "note", message=message, **fields)
@@ -1,21 +1,46 @@
 from __future__ import annotations
 
+import argparse
 import asyncio
+import functools
 import json
+import os
+import socket
+import threading
 from pathlib import Path
 
 from loguru import logger
 from telegram import Update
-from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes
+from telegram.ext import Application, ApplicationBuilder, CommandHandler, ContextTypes
 
+from telegram_agent.app.async_queue import AsyncTaskQueue
+from telegram_agent.app.audit import AuditWriter
 from telegram_agent.app.auth import is_authorized
-from telegram_agent.app.executor import TaskExecutor, default_tool_registry
-from telegram_agent.app.planner import create_plan
-from telegram_agent.app.tools import screen as screen_tools
-from telegram_agent.app.tools import system as system_tools
-from telegram_agent.app.tools import uia as uia_tools
-from telegram_agent.app.queue import TaskQueue
+from telegram_agent.app.cancellation import CancellationRegistry, TaskCancelled
+from telegram_agent.app.dispatcher import TaskDispatcher
+from telegram_agent.app.executor import TaskExecutor, default_tool_registry, validate_plan
+from telegram_agent.app.lanes import classify_steps, tool_lane
+from telegram_agent.app.observation import (
+    ObservationCache,
+    collect_observation,
+    context_of,
+    probe_window_context,
+    summarize_observation,
+    write_observation,
+)
+from telegram_agent.app.outbox import Outbox
+from telegram_agent.app.planner import (
+    PlanCache,
+    PlanError,
+    create_plan,
+    parse_command,
+    relabel_observation_note,
+    reused_plan_json,
+)
+from telegram_agent.app.queue import Task, TaskQueue
+from telegram_agent.app.retention import MANUAL_TASK_ID, RetentionPolicy, run_retention
 from telegram_agent.app.settings import Settings
+from telegram_agent.app.tools import shots, windows
 
 
 async def _reject(update: Update, reason: str) -> None:
@@ -27,56 +52,8 @@ def _ensure_audit_dir(settings: Settings) -> None:
     Path(settings.audit_dir).mkdir(parents=True, exist_ok=True)
 
 
-def _write_observation(audit_dir: str, task_id: str, payload: dict[str, object]) -> str:
-    observation_dir = Path(audit_dir) / task_id
-    observation_dir.mkdir(parents=True, exist_ok=True)
-    path = observation_dir / "observation.json"
-    path.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
-    return str(path)
-
-
-def _collect_observation(audit_dir: str, task_id: str) -> dict[str, object]:
-    observation: dict[str, object] = {}
-    try:
-        observation["screenshot_path"] = screen_tools.capture_screen(
-            audit_dir,
-            task_id,
-            label="before_plan",
-        )
-    except Exception as exc:  # noqa: BLE001
-        observation["screenshot_error"] = str(exc)
-    try:
-        observation["active_window"] = system_tools.active_window()
-    except Exception as exc:  # noqa: BLE001
-        observation["active_window_error"] = str(exc)
-    try:
-        observation["display_info"] = system_tools.display_info()
-    except Exception as exc:  # noqa: BLE001
-        observation["display_info_error"] = str(exc)
-    try:
-        observation["uia_dump"] = uia_tools.dump(max_items=200)
-    except Exception as exc:  # noqa: BLE001
-        observation["uia_dump"] = []
-        observation["uia_dump_error"] = str(exc)
-    return observation
-
-
-def _summarize_observation(observation: dict[str, object]) -> dict[str, object]:
-    active_window = observation.get("active_window", {})
-    display_info = observation.get("display_info", {})
-    uia_dump = observation.get("uia_dump", [])
-    if not isinstance(active_window, dict):
-        active_window = {}
-    if not isinstance(display_info, dict):
-        display_info = {}
-    if not isinstance(uia_dump, list):
-        uia_dump = []
-    return {
-        "active_window_title": active_window.get("title", ""),
-        "active_window_process": active_window.get("process", {}).get("name", ""),
-        "monitor_count": len(display_info.get("monitors", [])),
-        "uia_dump_count": len(uia_dump),
-    }
+def _worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
 
 
 def _format_plan(plan_json: str) -> str:
@@ -96,15 +73,30 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
     message = (
         "/help - show this message\n"
-        "/status - list recent tasks\n"
+        "/status [task_id] - list recent tasks or show step progress\n"
         "/shot - capture a screenshot\n"
         "/do <task> - plan a task\n"
+        "/run <name> - plan a task from a saved macro\n"
+        "/macro save <task_id> <name> | list | delete <name> - manage macros\n"
         "/approve <task_id> - approve a planned task\n"
         "/cancel <task_id> - cancel a task"
     )
     await update.effective_chat.send_message(text=message)
 
 
+async def _send_task_progress(update: Update, queue: AsyncTaskQueue, task_id: str) -> None:
+    status = await queue.get_status(task_id)
+    if status is None:
+        await update.effective_chat.send_message(text=f"Task {task_id} not found.")
+        return
+
+    lines = [f"{task_id} - {status}"]
+    for step in await queue.list_steps(task_id):
+        outcome = "ok" if step.ok else "failed"
+        lines.append(f"{step.step_id}. {step.action} - {outcome} ({step.duration_ms:.0f} ms)")
+    await update.effective_chat.send_message(text="\n".join(lines))
+
+
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     settings: Settings = context.bot_data["settings"]
     auth = is_authorized(update, settings)
@@ -112,8 +104,12 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await _reject(update, auth.reason)
         return
 
-    queue: TaskQueue = context.bot_data["queue"]
-    tasks = queue.list_recent()
+    queue: AsyncTaskQueue = context.bot_data["queue"]
+    if context.args:
+        await _send_task_progress(update, queue, context.args[0])
+        return
+
+    tasks = await queue.list_recent()
     if not tasks:
         await update.effective_chat.send_message(text="No tasks yet.")
         return
@@ -130,7 +126,9 @@ async def shot_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         return
 
     executor: TaskExecutor = context.bot_data["executor"]
-    path = executor.tool_registry.get("screen.capture")(settings.audit_dir, "manual", "shot")
+    # Grabbing and encoding a frame blocks; keep it off the event loop.
+    capture = executor.tool_registry.get("screen.capture")
+    path = await asyncio.to_thread(capture, settings.audit_dir, MANUAL_TASK_ID, "shot")
     with open(path, "rb") as photo:
         await update.effective_chat.send_photo(photo=photo, caption="Screenshot")
 
@@ -147,29 +145,153 @@ async def do_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         return
 
     task_text = " ".join(context.args)
-    queue: TaskQueue = context.bot_data["queue"]
+    try:
+        actions = parse_command(task_text)
+    except PlanError as exc:
+        await update.effective_chat.send_message(text=f"Could not plan task: {exc}")
+        return
+    queue: AsyncTaskQueue = context.bot_data["queue"]
+    plan_cache: PlanCache = context.bot_data["plan_cache"]
+    # Only a command that is already cached is worth probing the active window for; a miss takes
+    # the window from the observation it collects anyway.
+    window_context = await probe_window_context() if plan_cache.has_command(task_text) else None
+    cached = plan_cache.get(task_text, window_context) if window_context is not None else None
+    if cached is not None:
+        plan_json = reused_plan_json(cached)
+        task_id = await queue.create_task(
+            chat_id=update.effective_chat.id,
+            user_id=update.effective_user.id,
+            command=task_text,
+            plan_json=plan_json,
+            timeout_seconds=settings.task_timeout_seconds,
+            lane=cached.lane,
+        )
+        logger.info("Plan for task {} reused from task {}", task_id, cached.task_id)
+        # No observation is collected; the audit records what the reuse was based on instead.
+        await asyncio.to_thread(
+            write_observation,
+            settings.audit_dir,
+            task_id,
+            {"window_context": window_context, "plan_reused_from": cached.task_id},
+        )
+        await update.effective_chat.send_message(
+            text=f"Plan created for task_id={task_id} (same as task {cached.task_id}). "
+            f"Use /approve {task_id} to execute.\n{_format_plan(plan_json)}"
+        )
+        return
+
     placeholder_plan_json = json.dumps({"task": task_text, "steps": []}, ensure_ascii=False)
-    task_id = queue.create_task(
+    task_id = await queue.create_task(
         chat_id=update.effective_chat.id,
         user_id=update.effective_user.id,
         command=task_text,
         plan_json=placeholder_plan_json,
         timeout_seconds=settings.task_timeout_seconds,
     )
-    observation = _collect_observation(settings.audit_dir, task_id)
-    _write_observation(settings.audit_dir, task_id, observation)
-    plan = create_plan(task_text, observation)
-    if not queue.update_plan(task_id, plan.to_json()):
+    observation = await collect_observation(
+        settings.audit_dir, task_id, cache=context.bot_data["observation_cache"]
+    )
+    if "cached_from" in observation:
+        logger.info("Observation for task {} reused from task {}", task_id, observation["cached_from"])
+    else:
+        logger.info("Observation for task {} collected in {}", task_id, observation["probe_timings_ms"])
+    active_window = observation.get("active_window")
+    if isinstance(active_window, dict):
+        window_context = context_of(active_window)
+        observation["window_context"] = window_context
+    await asyncio.to_thread(write_observation, settings.audit_dir, task_id, observation)
+    # The full dump stays in observation.json; the plan note only carries the summary.
+    plan = create_plan(task_text, summarize_observation(observation), actions)
+    plan_json = plan.to_json()
+    lane = classify_steps(plan.steps)
+    if not await queue.update_plan(task_id, plan_json, lane=lane):
         await update.effective_chat.send_message(
             text=f"Failed to update plan for task_id={task_id}. Please try again."
         )
         return
 
+    if window_context is not None:
+        plan_cache.put(task_text, window_context, task_id, plan_json, lane)
+    await update.effective_chat.send_message(
+        text=f"Plan created for task_id={task_id}. Use /approve {task_id} to execute.\n{_format_plan(plan_json)}"
+    )
+
+
+async def run_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    settings: Settings = context.bot_data["settings"]
+    auth = is_authorized(update, settings)
+    if not auth.ok:
+        await _reject(update, auth.reason)
+        return
+
+    if not context.args:
+        await update.effective_chat.send_message(text="Usage: /run <name>")
+        return
+
+    name = context.args[0]
+    queue: AsyncTaskQueue = context.bot_data["queue"]
+    macro = await queue.get_macro(name)
+    if macro is None:
+        await update.effective_chat.send_message(text=f"Macro {name} not found.")
+        return
+    # Tools may have been renamed or removed since the macro was saved.
+    executor: TaskExecutor = context.bot_data["executor"]
+    try:
+        validate_plan(macro.plan_json, executor.tool_registry)
+    except RuntimeError as exc:
+        await update.effective_chat.send_message(text=f"Macro {name} can no longer run: {exc}")
+        return
+
+    plan_json = relabel_observation_note(macro.plan_json, f"from macro {name}, saved from task {macro.source_task_id}")
+    task_id = await queue.create_task(
+        chat_id=update.effective_chat.id,
+        user_id=update.effective_user.id,
+        command=macro.command,
+        plan_json=plan_json,
+        timeout_seconds=settings.task_timeout_seconds,
+        lane=classify_steps(json.loads(plan_json)["steps"]),
+    )
+    # Nothing is observed for a replay; the audit records where the plan came from instead.
+    await asyncio.to_thread(
+        write_observation,
+        settings.audit_dir,
+        task_id,
+        {"plan_from_macro": name, "macro_source_task_id": macro.source_task_id},
+    )
     await update.effective_chat.send_message(
-        text=f"Plan created for task_id={task_id}. Use /approve {task_id} to execute.\n{_format_plan(plan.to_json())}"
+        text=f"Plan created for task_id={task_id} from macro {name}. Use /approve {task_id} to execute.\n"
+        f"{_format_plan(plan_json)}"
     )
 
 
+async def macro_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    settings: Settings = context.bot_data["settings"]
+    auth = is_authorized(update, settings)
+    if not auth.ok:
+        await _reject(update, auth.reason)
+        return
+
+    usage = "Usage: /macro save <task_id> <name> | /macro list | /macro delete <name>"
+    args = context.args or []
+    queue: AsyncTaskQueue = context.bot_data["queue"]
+    if args[:1] == ["save"] and len(args) == 3:
+        _, task_id, name = args
+        if await queue.save_macro(name, task_id, update.effective_user.id) is None:
+            await update.effective_chat.send_message(text=f"Task {task_id} not found or not completed.")
+        else:
+            await update.effective_chat.send_message(text=f"Saved macro {name}. Use /run {name} to plan it again.")
+    elif args[:1] == ["list"] and len(args) == 1:
+        names = await queue.list_macros()
+        await update.effective_chat.send_message(text="\n".join(names) if names else "No macros yet.")
+    elif args[:1] == ["delete"] and len(args) == 2:
+        if await queue.delete_macro(args[1]):
+            await update.effective_chat.send_message(text=f"Deleted macro {args[1]}.")
+        else:
+            await update.effective_chat.send_message(text=f"Macro {args[1]} not found.")
+    else:
+        await update.effective_chat.send_message(text=usage)
+
+
 async def approve_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     settings: Settings = context.bot_data["settings"]
     auth = is_authorized(update, settings)
@@ -182,8 +304,10 @@ async def approve_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
 
     task_id = context.args[0]
-    queue: TaskQueue = context.bot_data["queue"]
-    if queue.approve_task(task_id):
+    queue: AsyncTaskQueue = context.bot_data["queue"]
+    if await queue.approve_task(task_id):
+        dispatcher: TaskDispatcher = context.bot_data["dispatcher"]
+        dispatcher.notify()
         await update.effective_chat.send_message(text=f"Task {task_id} approved and queued.")
     else:
         await update.effective_chat.send_message(text=f"Task {task_id} not found or not pending approval.")
@@ -201,79 +325,197 @@ async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
 
     task_id = context.args[0]
-    queue: TaskQueue = context.bot_data["queue"]
-    if queue.cancel_task(task_id):
+    queue: AsyncTaskQueue = context.bot_data["queue"]
+    if await queue.cancel_task(task_id):
+        cancellations: CancellationRegistry = context.bot_data["cancellations"]
+        cancellations.cancel(task_id)
         await update.effective_chat.send_message(text=f"Task {task_id} cancelled.")
     else:
         await update.effective_chat.send_message(text=f"Task {task_id} not found.")
 
 
-async def _run_next_task(context: ContextTypes.DEFAULT_TYPE) -> None:
-    settings: Settings = context.bot_data["settings"]
-    queue: TaskQueue = context.bot_data["queue"]
-    executor: TaskExecutor = context.bot_data["executor"]
-
-    task = queue.next_queued()
-    if task is None:
-        return
-
-    if not queue.mark_running(task.task_id):
-        return
-
-    bot = context.bot
-    def cancel_check() -> bool:
-        current = queue.get_task(task.task_id)
-        return current is not None and current.status == "cancelled"
+async def _run_task(application: Application, task: Task) -> None:
+    queue: AsyncTaskQueue = application.bot_data["queue"]
+    executor: TaskExecutor = application.bot_data["executor"]
+    cancellations: CancellationRegistry = application.bot_data["cancellations"]
+    outbox: Outbox = application.bot_data["outbox"]
+    sent_frames: shots.SentFrames = application.bot_data["sent_frames"]
+    shot_store = shots.store(application.bot_data["settings"].audit_dir)
+    cancel_token = cancellations.token(task.task_id)
+    # Covers a /cancel that landed between the claim and the token being registered.
+    if await queue.get_status(task.task_id) == "cancelled":
+        cancel_token.cancel()
 
     def send_update(message: str) -> None:
-        asyncio.run_coroutine_threadsafe(bot.send_message(chat_id=task.chat_id, text=message), context.application.loop)
+        outbox.progress(task.chat_id, task.task_id, message)
 
     def send_photo(path: str) -> None:
-        with open(path, "rb") as photo:
-            asyncio.run_coroutine_threadsafe(bot.send_photo(chat_id=task.chat_id, photo=photo), context.application.loop)
+        phash = shot_store.hash_for(path)
+        if phash is not None and sent_frames.is_repeat(task.chat_id, phash):
+            outbox.progress(task.chat_id, task.task_id, "Screen unchanged.")
+            return
+        outbox.photo(task.chat_id, Path(path).read_bytes())
 
     try:
-        result = await asyncio.to_thread(
-            executor.execute_plan,
+        result = await executor.execute_plan(
             task.task_id,
             task.plan_json,
             send_update,
             send_photo,
-            cancel_check,
+            cancel_token,
             task.timeout_seconds,
         )
-        queue.mark_done(task.task_id, result)
-        await bot.send_message(chat_id=task.chat_id, text=f"Task {task.task_id} completed.")
+        await queue.mark_done(task.task_id, result)
+        outbox.final(task.chat_id, f"Task {task.task_id} completed.", key=task.task_id)
+    except TaskCancelled:
+        outbox.final(task.chat_id, f"Task {task.task_id} cancelled.", key=task.task_id)
     except Exception as exc:  # noqa: BLE001
         logger.exception("Task failed")
-        queue.mark_failed(task.task_id, str(exc))
-        await bot.send_message(chat_id=task.chat_id, text=f"Task {task.task_id} failed: {exc}")
+        await queue.mark_failed(task.task_id, str(exc))
+        outbox.final(task.chat_id, f"Task {task.task_id} failed: {exc}", key=task.task_id)
+    finally:
+        cancellations.discard(task.task_id)
+
+
+async def _run_retention(application: Application, stop: threading.Event) -> None:
+    settings: Settings = application.bot_data["settings"]
+    queue: AsyncTaskQueue = application.bot_data["queue"]
+    policy = RetentionPolicy(
+        archive_dir=settings.archive_dir,
+        max_age_days=settings.retention_days,
+        max_audit_bytes=settings.audit_max_bytes,
+    )
+    while not stop.is_set():
+        # Retention works in its own thread with its own connection and paces itself in small batches.
+        # Cancelling this task does not stop that thread, so shutdown waits on the run itself.
+        run = asyncio.ensure_future(asyncio.to_thread(run_retention, queue.queue, settings.audit_dir, policy, stop))
+        application.bot_data["retention_run"] = run
+        try:
+            await asyncio.shield(run)
+        except Exception:  # noqa: BLE001
+            logger.exception("Retention run failed")
+        await asyncio.sleep(settings.retention_interval_seconds)
+
+
+def _list_tools() -> None:
+    # Reads the registry only; no tool module (and so no GUI backend) is imported.
+    registry = default_tool_registry()
+    for name in registry.names():
+        target = registry.lazy.get(name, "built-in")
+        print(f"{name}\t{tool_lane(name)}\t{target}")
+
+
+def _on_gui_action(observation_cache: ObservationCache, action: str) -> None:
+    observation_cache.invalidate(action)
+    windows.focus_changed(action)
 
 
-async def main() -> None:
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m telegram_agent.app.bot")
+    parser.add_argument("--list-tools", action="store_true", help="print the registered tools and exit")
+    args = parser.parse_args()
+    if args.list_tools:
+        _list_tools()
+        return
+
+    from telegram_agent.app.tools import screen as screen_tools
+
     settings = Settings()
     _ensure_audit_dir(settings)
+    screen_tools.configure(
+        screen_tools.EncodeOptions(
+            format=settings.screenshot_format,
+            quality=settings.screenshot_quality,
+            max_edge=settings.screenshot_max_edge,
+            grayscale=settings.screenshot_grayscale,
+            crop_active_window=settings.screenshot_crop_active_window,
+            max_bytes=settings.screenshot_max_bytes,
+            keep_lossless=settings.audit_keep_lossless,
+            dedup_distance=settings.screenshot_dedup_distance,
+        )
+    )
 
-    queue = TaskQueue(settings.sqlite_path)
+    task_queue = TaskQueue(settings.sqlite_path)
+    queue = AsyncTaskQueue(task_queue)
     registry = default_tool_registry()
-    executor = TaskExecutor(settings.audit_dir, registry)
+    if settings.tool_warmup:
+        registry.warmup()
+    observation_cache = ObservationCache(settings.observation_cache_ttl_seconds)
+    audit_writer = AuditWriter(settings.audit_dir)
+    executor = TaskExecutor(
+        settings.audit_dir,
+        registry,
+        step_sink=task_queue.append_step,
+        on_gui_action=functools.partial(_on_gui_action, observation_cache),
+        audit_writer=audit_writer,
+    )
 
-    application = ApplicationBuilder().token(settings.bot_token).build()
+    async def _post_init(application: Application) -> None:
+        await application.bot_data["outbox"].start()
+        await application.bot_data["dispatcher"].start()
+        application.bot_data["retention"] = asyncio.create_task(_run_retention(application, retention_stop))
+
+    cancellations = CancellationRegistry()
+    retention_stop = threading.Event()
+
+    async def _shutdown(application: Application) -> None:
+        retention_stop.set()
+        application.bot_data["retention"].cancel()
+        run = application.bot_data.get("retention_run")
+        if run is not None:
+            # Let a run in progress finish its batch before its queue connections are closed.
+            await asyncio.gather(run, return_exceptions=True)
+        await application.bot_data["dispatcher"].stop()
+        await application.bot_data["outbox"].stop()
+        executor.close()
+        audit_writer.close()
+        screen_tools.grabber().close()
+        queue.close()
+        task_queue.close()
+
+    application = (
+        ApplicationBuilder()
+        .token(settings.bot_token)
+        .post_init(_post_init)
+        .post_shutdown(_shutdown)
+        .build()
+    )
     application.bot_data["settings"] = settings
     application.bot_data["queue"] = queue
     application.bot_data["executor"] = executor
+    application.bot_data["observation_cache"] = observation_cache
+    application.bot_data["plan_cache"] = PlanCache(settings.plan_cache_ttl_seconds)
+    application.bot_data["sent_frames"] = shots.SentFrames(settings.screenshot_dedup_distance)
+    application.bot_data["outbox"] = Outbox(
+        application.bot,
+        chat_rate=settings.outbox_chat_rate,
+        global_rate=settings.outbox_global_rate,
+    )
+    application.bot_data["cancellations"] = cancellations
+    application.bot_data["dispatcher"] = TaskDispatcher(
+        queue,
+        _worker_id(),
+        functools.partial(_run_task, application),
+        lease_seconds=settings.task_lease_seconds,
+        sweep_interval_seconds=settings.poll_interval_seconds,
+        max_workers=settings.max_concurrent_tasks,
+        lane_limits=settings.lane_limits(),
+        expired_lease_policy=settings.expired_lease_policy,
+        max_attempts=settings.max_task_attempts,
+        on_lease_lost=cancellations.cancel,
+    )
 
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("status", status_command))
     application.add_handler(CommandHandler("shot", shot_command))
     application.add_handler(CommandHandler("do", do_command))
+    application.add_handler(CommandHandler("run", run_command))
+    application.add_handler(CommandHandler("macro", macro_command))
     application.add_handler(CommandHandler("approve", approve_command))
     application.add_handler(CommandHandler("cancel", cancel_command))
 
-    application.job_queue.run_repeating(_run_next_task, interval=settings.poll_interval_seconds, first=2)
-
-    await application.run_polling()
+    application.run_polling()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    main()
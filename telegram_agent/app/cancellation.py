@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterator
+
+
+class TaskCancelled(RuntimeError):
+    def __init__(self) -> None:
+        super().__init__("Task cancelled")
+
+
+class CancellationToken:
+    def __init__(self) -> None:
+        self._event = threading.Event()
+        self._callbacks: list[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def cancel(self) -> None:
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def add_callback(self, callback: Callable[[], None]) -> None:
+        # Runs on the thread that calls cancel(), or right away if the token is already cancelled.
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def raise_if_cancelled(self) -> None:
+        if self._event.is_set():
+            raise TaskCancelled()
+
+    def sleep(self, seconds: float) -> None:
+        # Returns early (by raising) as soon as the token is cancelled.
+        if self._event.wait(seconds):
+            raise TaskCancelled()
+
+
+class CancellationRegistry:
+    def __init__(self) -> None:
+        self._tokens: dict[str, CancellationToken] = {}
+        self._lock = threading.Lock()
+
+    def token(self, task_id: str) -> CancellationToken:
+        with self._lock:
+            token = self._tokens.get(task_id)
+            if token is None:
+                token = CancellationToken()
+                self._tokens[task_id] = token
+            return token
+
+    def cancel(self, task_id: str) -> bool:
+        with self._lock:
+            token = self._tokens.get(task_id)
+        if token is None:
+            return False
+        token.cancel()
+        return True
+
+    def discard(self, task_id: str) -> None:
+        with self._lock:
+            self._tokens.pop(task_id, None)
+
+
+_current_token: ContextVar[CancellationToken | None] = ContextVar("cancellation_token", default=None)
+
+
+@contextmanager
+def use_token(token: CancellationToken) -> Iterator[CancellationToken]:
+    reset = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(reset)
+
+
+def check() -> None:
+    token = _current_token.get()
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+def sleep(seconds: float) -> None:
+    # Tools call this instead of time.sleep so a /cancel interrupts long waits immediately.
+    token = _current_token.get()
+    if token is None:
+        time.sleep(seconds)
+        return
+    token.sleep(seconds)
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+from typing import Awaitable, Callable
+
+from loguru import logger
+
+from telegram_agent.app.async_queue import AsyncTaskQueue
+from telegram_agent.app.queue import Task
+
+RunTask = Callable[[Task], Awaitable[None]]
+LeaseLost = Callable[[str], None]
+
+
+class TaskDispatcher:
+    def __init__(
+        self,
+        queue: AsyncTaskQueue,
+        worker_id: str,
+        run_task: RunTask,
+        lease_seconds: float,
+        sweep_interval_seconds: float,
+        max_workers: int = 1,
+        lane_limits: dict[str, int] | None = None,
+        expired_lease_policy: str = "fail",
+        max_attempts: int = 1,
+        on_lease_lost: LeaseLost | None = None,
+    ) -> None:
+        self.queue = queue
+        self.worker_id = worker_id
+        self.run_task = run_task
+        self.lease_seconds = lease_seconds
+        self.sweep_interval_seconds = sweep_interval_seconds
+        self.max_workers = max_workers
+        self.lane_limits = lane_limits
+        self.expired_lease_policy = expired_lease_policy
+        self.max_attempts = max_attempts
+        self.on_lease_lost = on_lease_lost
+        self._wakeup: asyncio.Event | None = None
+        self._runner: asyncio.Task[None] | None = None
+        self._heartbeat: asyncio.Task[None] | None = None
+        self._stopping = False
+        self._running: dict[str, asyncio.Task[None]] = {}
+
+    @property
+    def running_count(self) -> int:
+        return len(self._running)
+
+    @property
+    def heartbeat_interval_seconds(self) -> float:
+        # Renew well before expiry so one slow heartbeat does not lose the lease.
+        return self.lease_seconds / 3
+
+    def notify(self) -> None:
+        # Must be called from the event loop thread, e.g. from a command handler.
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def start(self) -> None:
+        if self._runner is not None:
+            return
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        await self._reap()
+        self._runner = asyncio.create_task(self._run(), name="task-dispatcher")
+        self._heartbeat = asyncio.create_task(self._run_heartbeat(), name="task-heartbeat")
+
+    async def stop(self) -> None:
+        runner, self._runner = self._runner, None
+        if runner is None:
+            return
+        # wait_for() can swallow a cancellation that races with the wakeup event, so the loop
+        # also checks an explicit flag.
+        self._stopping = True
+        jobs = [runner, *self._running.values()]
+        if self._heartbeat is not None:
+            jobs.append(self._heartbeat)
+            self._heartbeat = None
+        for job in jobs:
+            job.cancel()
+        await asyncio.gather(*jobs, return_exceptions=True)
+
+    async def _run(self) -> None:
+        assert self._wakeup is not None
+        while not self._stopping:
+            # Clear before claiming so a notify() that races with a claim is never lost.
+            self._wakeup.clear()
+            await self._fill()
+            try:
+                # The timeout is only a fallback sweep for tasks queued by other processes.
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.sweep_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fill(self) -> None:
+        while len(self._running) < self.max_workers:
+            try:
+                task = await self.queue.claim_next(self.worker_id, self.lease_seconds, self.lane_limits)
+            except Exception:  # noqa: BLE001
+                logger.exception("Failed to claim next task")
+                return
+            if task is None:
+                return
+            job = asyncio.create_task(self._execute(task), name=f"task-{task.task_id}")
+            self._running[task.task_id] = job
+            job.add_done_callback(functools.partial(self._on_done, task.task_id))
+
+    async def _execute(self, task: Task) -> None:
+        try:
+            await self.run_task(task)
+        except asyncio.CancelledError:
+            raise
+        except Exception:  # noqa: BLE001
+            logger.exception("Task {} crashed the dispatcher callback", task.task_id)
+
+    def _on_done(self, task_id: str, _: asyncio.Task[None]) -> None:
+        self._running.pop(task_id, None)
+        # A finished task frees a worker and possibly a lane slot.
+        self.notify()
+
+    async def _run_heartbeat(self) -> None:
+        while not self._stopping:
+            await asyncio.sleep(self.heartbeat_interval_seconds)
+            await self._renew_leases()
+            await self._reap()
+
+    async def _renew_leases(self) -> None:
+        for task_id in list(self._running):
+            try:
+                renewed = await self.queue.renew_lease(task_id, self.worker_id, self.lease_seconds)
+            except Exception:  # noqa: BLE001
+                logger.exception("Failed to renew lease for task {}", task_id)
+                continue
+            if not renewed and self.on_lease_lost is not None:
+                # The task was cancelled (possibly from another process), finished or reaped.
+                self.on_lease_lost(task_id)
+
+    async def _reap(self) -> None:
+        try:
+            reaped = await self.queue.reap_expired(self.expired_lease_policy, self.max_attempts)
+        except Exception:  # noqa: BLE001
+            logger.exception("Failed to reap expired task leases")
+            return
+        for task_id, status in reaped:
+            logger.warning("Task {} lease expired; marked {}", task_id, status)
+        if any(status == "queued" for _, status in reaped):
+            self.notify()
@@ -1,30 +1,103 @@
 from __future__ import annotations
 
+import asyncio
+import contextvars
+import functools
+import hashlib
+import importlib
+import inspect
 import json
+import threading
 import time
 import traceback
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import nullcontext
 from dataclasses import dataclass, field
-from typing import Any, Callable
+from typing import Any, Awaitable, Callable
 
 from loguru import logger
 
-from telegram_agent.app.tools import input as input_tools
-from telegram_agent.app.tools import screen as screen_tools
-from telegram_agent.app.tools import uia as uia_tools
+from telegram_agent.app import audit
+from telegram_agent.app.audit import AuditWriter
+from telegram_agent.app.cancellation import CancellationToken, TaskCancelled, use_token
+from telegram_agent.app.lanes import GUI_LANE, tool_lane
+from telegram_agent.app.queue import StepRecord
 
 
 ToolFunc = Callable[..., Any]
+AsyncToolFunc = Callable[..., Awaitable[Any]]
+StepSink = Callable[[StepRecord], None]
+GuiActionHook = Callable[[str], None]
+
+_OUTPUT_REF_MAX_CHARS = 200
+DEFAULT_MAX_PARALLEL_STEPS = 4
+
+
+async def run_sync(func: ToolFunc, executor: Executor | None, *args: Any, **kwargs: Any) -> Any:
+    # Runs a blocking tool on a thread, carrying over context variables such as the current
+    # cancellation token. A thread cannot be interrupted, so if the caller is cancelled this still
+    # waits for the tool to return before re-raising: a GUI step must not outlive its lock.
+    loop = asyncio.get_running_loop()
+    call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+    future = loop.run_in_executor(executor, call)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        await asyncio.wait([future])
+        raise
 
 
 @dataclass
 class ToolRegistry:
+    # Holds plain functions and coroutine functions alike; get_async() gives every tool the same
+    # awaitable interface. Lazy entries name their implementation as "module:attribute" and are
+    # imported on first use, so GUI backends are only loaded when a tool actually needs them.
     tools: dict[str, ToolFunc] = field(default_factory=dict)
+    lazy: dict[str, str] = field(default_factory=dict)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
 
     def register(self, name: str, func: ToolFunc) -> None:
         self.tools[name] = func
+        self.lazy.pop(name, None)
+
+    def register_lazy(self, name: str, target: str) -> None:
+        self.tools.pop(name, None)
+        self.lazy[name] = target
+
+    def names(self) -> list[str]:
+        return sorted({*self.tools, *self.lazy})
 
     def get(self, name: str) -> ToolFunc | None:
-        return self.tools.get(name)
+        func = self.tools.get(name)
+        if func is not None or name not in self.lazy:
+            return func
+        with self._lock:
+            if name in self.tools:
+                return self.tools[name]
+            module_name, _, attribute = self.lazy[name].partition(":")
+            func = getattr(importlib.import_module(module_name), attribute)
+            self.tools[name] = func
+            return func
+
+    def get_async(self, name: str, executor: Executor | None = None) -> AsyncToolFunc | None:
+        func = self.get(name)
+        if func is None or inspect.iscoroutinefunction(func):
+            return func
+        return functools.partial(run_sync, func, executor)
+
+    def warmup(self) -> threading.Thread:
+        # Imports every lazy tool in the background so the first task does not pay for it.
+        # A tool whose backend fails to import is logged and left to fail again on use.
+        def resolve_all() -> None:
+            for name in list(self.lazy):
+                try:
+                    self.get(name)
+                except Exception:  # noqa: BLE001
+                    logger.exception("Failed to load tool {}", name)
+
+        thread = threading.Thread(target=resolve_all, name="tool-warmup", daemon=True)
+        thread.start()
+        return thread
 
 
 @dataclass
@@ -32,82 +105,285 @@ class ExecutionStep:
     step_id: int
     action: str
     args: dict[str, Any]
+    depends_on: tuple[int, ...] = ()
+
+
+def _plan_steps(raw_steps: list[dict[str, Any]]) -> list[ExecutionStep]:
+    # A step without "depends_on" runs after the previous step, so plans written before the
+    # field existed keep executing strictly in order. Dependencies must name earlier steps,
+    # which also rules out cycles.
+    steps: list[ExecutionStep] = []
+    seen: set[int] = set()
+    for raw in raw_steps:
+        step_id = raw["id"]
+        if step_id in seen:
+            raise RuntimeError(f"Invalid plan: duplicate step id {step_id}")
+        if "depends_on" in raw:
+            depends_on = tuple(raw["depends_on"])
+        else:
+            depends_on = (steps[-1].step_id,) if steps else ()
+        for dependency in depends_on:
+            if dependency not in seen:
+                raise RuntimeError(f"Invalid plan: step {step_id} depends on unknown or later step {dependency}")
+        steps.append(ExecutionStep(step_id, raw["action"], raw.get("args", {}), depends_on))
+        seen.add(step_id)
+    return steps
+
+
+def validate_plan(plan_json: str, registry: ToolRegistry) -> list[ExecutionStep]:
+    # For stored plans (macros): the structural checks execute_plan makes, plus every action must
+    # still be a registered tool. Nothing is imported, so this is cheap enough to run on the loop.
+    try:
+        steps = _plan_steps(json.loads(plan_json)["steps"])
+    except (ValueError, KeyError, TypeError) as exc:
+        raise RuntimeError(f"Invalid plan: {exc}") from exc
+    unknown = sorted({step.action for step in steps} - set(registry.names()))
+    if unknown:
+        raise RuntimeError(f"Invalid plan: unknown tools {', '.join(unknown)}")
+    return steps
+
+
+def _args_hash(args: dict[str, Any]) -> str:
+    encoded = json.dumps(args, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    return hashlib.sha1(encoded).hexdigest()[:16]
+
+
+def _output_ref(result: dict[str, Any]) -> str | None:
+    if "error" in result:
+        ref = f"error: {result['error']['message']}"
+    elif "output" not in result:
+        return None
+    elif isinstance(result["output"], str):
+        ref = result["output"]
+    else:
+        ref = json.dumps(result["output"], ensure_ascii=False, default=str)
+    return ref[:_OUTPUT_REF_MAX_CHARS]
 
 
 class TaskExecutor:
-    def __init__(self, audit_dir: str, tool_registry: ToolRegistry) -> None:
+    def __init__(
+        self,
+        audit_dir: str,
+        tool_registry: ToolRegistry,
+        step_sink: StepSink | None = None,
+        on_gui_action: GuiActionHook | None = None,
+        max_parallel_steps: int = DEFAULT_MAX_PARALLEL_STEPS,
+        audit_writer: AuditWriter | None = None,
+    ) -> None:
         self.audit_dir = audit_dir
         self.tool_registry = tool_registry
+        self.step_sink = step_sink
+        self._owns_audit = audit_writer is None
+        self.audit = audit_writer if audit_writer is not None else AuditWriter(audit_dir)
+        # Called with the action name after every step that may have changed what is on screen.
+        self.on_gui_action = on_gui_action
+        # Only blocking tools use these threads; async tools and the plan itself stay on the loop.
+        self._step_pool = ThreadPoolExecutor(max_workers=max_parallel_steps, thread_name_prefix="plan-step")
+        # Steps that drive keyboard/mouse never overlap, whichever task they belong to. Created on
+        # first use so it binds to the running loop.
+        self._gui_lock: asyncio.Lock | None = None
+
+    def close(self) -> None:
+        self._step_pool.shutdown(wait=False, cancel_futures=True)
+        if self._owns_audit:
+            self.audit.close()
 
-    def execute_plan(
+    async def execute_plan(
         self,
         task_id: str,
         plan_json: str,
         send_update: Callable[[str], None],
         send_photo: Callable[[str], None],
-        cancel_check: Callable[[], bool],
-        timeout_seconds: int,
+        cancel_token: CancellationToken,
+        timeout_seconds: float,
     ) -> dict[str, Any]:
-        log_id = logger.add(f"{self.audit_dir}/{task_id}.log", rotation="1 MB")
-        payload = json.loads(plan_json)
-        steps = [ExecutionStep(step["id"], step["action"], step.get("args", {})) for step in payload["steps"]]
-        started_at = time.monotonic()
-        results: list[dict[str, Any]] = []
-
+        # send_update may be called on the loop, send_photo on a tool thread.
+        loop = asyncio.get_running_loop()
+        status, error = "failed", None
         try:
-            for step in steps:
-                if cancel_check():
-                    raise RuntimeError("Task cancelled")
-
-                if time.monotonic() - started_at > timeout_seconds:
-                    raise RuntimeError("Task timeout reached")
-
-                send_update(f"Executing step {step.step_id}: {step.action}")
-                logger.info("Executing step {} with args {}", step.action, step.args)
-
-                result: dict[str, Any] = {
-                    "step": step.step_id,
-                    "action": step.action,
-                    "args": step.args,
-                    "ok": False,
-                }
+            payload = json.loads(plan_json)
+            steps = _plan_steps(payload["steps"])
+            self.audit.record(task_id, "task_start", task=payload["task"], steps=len(steps))
+            run_step = functools.partial(self._run_step, task_id, send_update, send_photo)
+            with use_token(cancel_token), audit.use_task(self.audit, task_id):
+                runner = asyncio.create_task(self._run_steps(steps, run_step), name=f"plan-{task_id}")
+            cancel_token.add_callback(lambda: loop.call_soon_threadsafe(runner.cancel))
+            try:
+                done, _ = await asyncio.wait([runner], timeout=timeout_seconds)
+                timed_out = not done
+                if timed_out:
+                    # Also stops cooperative blocking tools, which watch the token.
+                    cancel_token.cancel()
                 try:
-                    tool = self.tool_registry.get(step.action)
-                    if tool is None:
-                        raise RuntimeError(f"Tool not allowed: {step.action}")
-
-                    if step.action == "screen.capture":
-                        label = step.args.get("label", "step")
-                        monitor_index = step.args.get("monitor_index", 0)
-                        path = screen_tools.capture_screen(
-                            self.audit_dir,
-                            task_id,
-                            label=label,
-                            monitor_index=monitor_index,
-                        )
-                        send_photo(path)
-                        result["output"] = path
-                    else:
-                        output = tool(**step.args)
-                        if output is not None:
-                            result["output"] = output
-                    result["ok"] = True
-                except Exception as exc:  # noqa: BLE001
-                    result["error"] = {
-                        "type": type(exc).__name__,
-                        "message": str(exc),
-                        "traceback": traceback.format_exc(),
-                    }
-                    self._capture_error_screenshot(task_id, step.step_id, send_photo)
-                    results.append(result)
-                    raise RuntimeError(f"{step.action} failed: {exc}") from exc
-
-                results.append(result)
+                    results = await runner
+                except (asyncio.CancelledError, TaskCancelled):
+                    if timed_out:
+                        raise RuntimeError("Task timeout reached") from None
+                    if cancel_token.cancelled:
+                        raise TaskCancelled() from None
+                    raise
+            finally:
+                if not runner.done():
+                    runner.cancel()
+                    await asyncio.gather(runner, return_exceptions=True)
+            status = "completed"
+        except (asyncio.CancelledError, TaskCancelled):
+            status = "cancelled"
+            raise
+        except Exception as exc:
+            error = str(exc)
+            raise
         finally:
-            logger.remove(log_id)
+            self.audit.record(task_id, "task_end", status=status, error=error)
+            self.audit.close_task(task_id)
 
         return {"task": payload["task"], "steps": results}
 
+    async def _run_steps(
+        self,
+        steps: list[ExecutionStep],
+        run_step: Callable[[ExecutionStep], Awaitable[dict[str, Any]]],
+    ) -> list[dict[str, Any]]:
+        # One asyncio task per step, each waiting for its dependencies first. The first failure
+        # cancels everything still pending or running.
+        results: dict[int, dict[str, Any]] = {}
+        jobs: dict[int, asyncio.Task[None]] = {}
+
+        async def run_when_ready(step: ExecutionStep) -> None:
+            if step.depends_on:
+                await asyncio.gather(*(jobs[dependency] for dependency in step.depends_on))
+            results[step.step_id] = await run_step(step)
+
+        for step in steps:
+            jobs[step.step_id] = asyncio.create_task(run_when_ready(step), name=f"step-{step.step_id}")
+        try:
+            await asyncio.gather(*jobs.values())
+        except BaseException:
+            for job in jobs.values():
+                job.cancel()
+            await asyncio.gather(*jobs.values(), return_exceptions=True)
+            raise
+        return [results[step.step_id] for step in steps]
+
+    def _lock_for(self, action: str) -> asyncio.Lock | nullcontext[None]:
+        if tool_lane(action) != GUI_LANE:
+            return nullcontext()
+        if self._gui_lock is None:
+            self._gui_lock = asyncio.Lock()
+        return self._gui_lock
+
+    def _capture_and_send(
+        self,
+        capture: ToolFunc,
+        task_id: str,
+        args: dict[str, Any],
+        send_photo: Callable[[str], None],
+    ) -> str:
+        path = capture(
+            self.audit_dir,
+            task_id,
+            label=args.get("label", "step"),
+            monitor_index=args.get("monitor_index", 0),
+        )
+        send_photo(path)
+        return path
+
+    async def _run_step(
+        self,
+        task_id: str,
+        send_update: Callable[[str], None],
+        send_photo: Callable[[str], None],
+        step: ExecutionStep,
+    ) -> dict[str, Any]:
+        send_update(f"Executing step {step.step_id}: {step.action}")
+        logger.info("Executing step {} with args {}", step.action, step.args)
+        self.audit.record(task_id, "step_start", step=step.step_id, action=step.action, args=step.args)
+
+        result: dict[str, Any] = {
+            "step": step.step_id,
+            "action": step.action,
+            "args": step.args,
+            "ok": False,
+        }
+        step_started_at = time.time()
+        try:
+            tool = self.tool_registry.get_async(step.action, self._step_pool)
+            if tool is None:
+                raise RuntimeError(f"Tool not allowed: {step.action}")
+
+            if step.action == "screen.capture":
+                capture = self.tool_registry.get(step.action)
+                result["output"] = await run_sync(
+                    self._capture_and_send, self._step_pool, capture, task_id, step.args, send_photo
+                )
+            else:
+                async with self._lock_for(step.action):
+                    output = await tool(**step.args)
+                if output is not None:
+                    result["output"] = output
+            result["ok"] = True
+        except (asyncio.CancelledError, TaskCancelled):
+            self._record_step(task_id, step, step_started_at, result)
+            raise
+        except Exception as exc:  # noqa: BLE001
+            result["error"] = {
+                "type": type(exc).__name__,
+                "message": str(exc),
+                "traceback": traceback.format_exc(),
+            }
+            self._record_step(task_id, step, step_started_at, result)
+            await run_sync(self._capture_error_screenshot, self._step_pool, task_id, step.step_id, send_photo)
+            raise RuntimeError(f"{step.action} failed: {exc}") from exc
+
+        self._record_step(task_id, step, step_started_at, result)
+        return result
+
+    def _notify_gui_action(self, action: str) -> None:
+        if self.on_gui_action is None or tool_lane(action) != GUI_LANE:
+            return
+        try:
+            self.on_gui_action(action)
+        except Exception:  # noqa: BLE001
+            logger.exception("GUI action hook failed for {}", action)
+
+    def _record_step(
+        self,
+        task_id: str,
+        step: ExecutionStep,
+        started_at: float,
+        result: dict[str, Any],
+    ) -> None:
+        # Every step ends here whatever its outcome, so this is where GUI side effects are reported.
+        self._notify_gui_action(step.action)
+        duration_ms = (time.time() - started_at) * 1000
+        output_ref = _output_ref(result)
+        self.audit.record(
+            task_id,
+            "step_end",
+            step=step.step_id,
+            action=step.action,
+            ok=result["ok"],
+            duration_ms=round(duration_ms, 1),
+            output_ref=output_ref,
+            error=result.get("error"),
+        )
+        if self.step_sink is None:
+            return
+        record = StepRecord(
+            task_id=task_id,
+            step_id=step.step_id,
+            action=step.action,
+            args_hash=_args_hash(step.args),
+            started_at=started_at,
+            duration_ms=duration_ms,
+            ok=result["ok"],
+            output_ref=output_ref,
+        )
+        try:
+            self.step_sink(record)
+        except Exception:  # noqa: BLE001
+            logger.exception("Failed to record step {} of task {}", step.step_id, task_id)
+
     def _capture_error_screenshot(
         self,
         task_id: str,
@@ -116,28 +392,32 @@ class TaskExecutor:
     ) -> None:
         label = f"error_step_{step_id}"
         try:
-            path = screen_tools.capture_screen(self.audit_dir, task_id, label=label)
+            capture = self.tool_registry.get("screen.capture")
+            if capture is None:
+                return
+            path = capture(self.audit_dir, task_id, label=label)
         except Exception:  # noqa: BLE001
             logger.exception("Failed to capture error screenshot for step {}", step_id)
             return
         send_photo(path)
 
 
-def log_note(message: str) -> None:
+async def log_note(message: str) -> None:
     logger.info("NOTE: {}", message)
+    audit.note(message)
 
 
 def default_tool_registry() -> ToolRegistry:
     registry = ToolRegistry()
-    registry.register("screen.capture", screen_tools.capture_screen)
-    registry.register("input.click", input_tools.click)
-    registry.register("input.type", input_tools.type_text)
-    registry.register("input.hotkey", input_tools.hotkey)
-    registry.register("wait.sleep", input_tools.sleep)
-    registry.register("uia.focus_window", uia_tools.focus_window)
-    registry.register("uia.dump", uia_tools.dump)
-    registry.register("uia.click_text", uia_tools.click_text)
-    registry.register("uia.click_automation_id", uia_tools.click_automation_id)
-    registry.register("uia.click_path", uia_tools.click_path)
+    registry.register_lazy("screen.capture", "telegram_agent.app.tools.screen:capture_screen")
+    registry.register_lazy("input.click", "telegram_agent.app.tools.input:click")
+    registry.register_lazy("input.type", "telegram_agent.app.tools.input:type_text")
+    registry.register_lazy("input.hotkey", "telegram_agent.app.tools.input:hotkey")
+    registry.register_lazy("wait.sleep", "telegram_agent.app.tools.wait:sleep")
+    registry.register_lazy("uia.focus_window", "telegram_agent.app.tools.uia:focus_window")
+    registry.register_lazy("uia.dump", "telegram_agent.app.tools.uia:dump")
+    registry.register_lazy("uia.click_text", "telegram_agent.app.tools.uia:click_text")
+    registry.register_lazy("uia.click_automation_id", "telegram_agent.app.tools.uia:click_automation_id")
+    registry.register_lazy("uia.click_path", "telegram_agent.app.tools.uia:click_path")
     registry.register("log.note", log_note)
     return registry
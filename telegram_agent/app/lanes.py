@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+from typing import Any, Iterable
+
+GUI_LANE = "gui"
+OBSERVE_LANE = "observe"
+
+# Tools that only observe the desktop and can safely overlap with each other and with GUI tasks.
+# Everything else is assumed to drive keyboard/mouse input and needs the exclusive GUI lane.
+READ_ONLY_TOOLS = frozenset(
+    {
+        "screen.capture",
+        "uia.dump",
+        "log.note",
+        "wait.sleep",
+    }
+)
+
+
+def tool_lane(action: str) -> str:
+    return OBSERVE_LANE if action in READ_ONLY_TOOLS else GUI_LANE
+
+
+def classify_steps(steps: Iterable[dict[str, Any]]) -> str:
+    for step in steps:
+        if tool_lane(step["action"]) == GUI_LANE:
+            return GUI_LANE
+    return OBSERVE_LANE
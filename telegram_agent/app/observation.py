@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+import asyncio
+import copy
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable
+
+OBSERVATION_DUMP_MAX_ITEMS = 200
+# enabled/visible are left out: two more UIA calls per node that planning never reads.
+OBSERVATION_DUMP_FIELDS = ["name", "control_type", "automation_id", "rect", "path"]
+FINGERPRINT_TIMEOUT_SECONDS = 1.0
+
+
+@dataclass(frozen=True)
+class Probe:
+    name: str
+    key: str
+    error_key: str
+    timeout_seconds: float
+    run: Callable[[str, str], Any]
+    # Stored under ``key`` when the probe fails, for consumers that expect the key to exist.
+    fallback: Any = None
+
+
+# The tool modules pull in GUI backends, so they are imported on the first probe rather than
+# with this module.
+def _screenshot(audit_dir: str, task_id: str) -> str:
+    from telegram_agent.app.tools import screen
+
+    return screen.capture_screen(audit_dir, task_id, label="before_plan")
+
+
+def _active_window(_: str, __: str) -> dict[str, Any]:
+    from telegram_agent.app.tools import system
+
+    return system.active_window()
+
+
+def _display_info(_: str, __: str) -> dict[str, Any]:
+    from telegram_agent.app.tools import system
+
+    return system.display_info()
+
+
+def _uia_dump(_: str, __: str) -> dict[str, object]:
+    from telegram_agent.app.tools import uia
+
+    return uia.dump(max_items=OBSERVATION_DUMP_MAX_ITEMS, fields=OBSERVATION_DUMP_FIELDS, compact=True)
+
+
+PROBES: tuple[Probe, ...] = (
+    Probe("screenshot", "screenshot_path", "screenshot_error", 5.0, _screenshot),
+    Probe("active_window", "active_window", "active_window_error", 2.0, _active_window),
+    Probe("display_info", "display_info", "display_info_error", 2.0, _display_info),
+    Probe("uia_dump", "uia_dump", "uia_dump_error", 5.0, _uia_dump, fallback=[]),
+)
+
+# Probes block in cross-process UIA calls and cannot be interrupted, so a timed-out probe keeps its
+# worker until it returns. The pool is sized so a few stuck probes do not starve the next /do.
+_probe_pool = ThreadPoolExecutor(max_workers=2 * len(PROBES), thread_name_prefix="observation")
+
+
+def _timed(run: Callable[[str, str], Any], audit_dir: str, task_id: str) -> tuple[Any, float]:
+    started = time.perf_counter()
+    return run(audit_dir, task_id), (time.perf_counter() - started) * 1000
+
+
+async def _run_probe(probe: Probe, audit_dir: str, task_id: str, timeout_seconds: float) -> dict[str, Any]:
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    try:
+        value, elapsed_ms = await asyncio.wait_for(
+            loop.run_in_executor(_probe_pool, _timed, probe.run, audit_dir, task_id),
+            timeout=timeout_seconds,
+        )
+    except asyncio.TimeoutError:
+        error = f"timed out after {timeout_seconds:g}s"
+    except Exception as exc:  # noqa: BLE001
+        error = str(exc)
+    else:
+        return {probe.key: value, "elapsed_ms": elapsed_ms}
+    result: dict[str, Any] = {probe.error_key: error, "elapsed_ms": (time.perf_counter() - started) * 1000}
+    if probe.fallback is not None:
+        result[probe.key] = copy.copy(probe.fallback)
+    return result
+
+
+def observation_fingerprint() -> str:
+    # Screen content alone misses focus changes between identical-looking windows, so the active
+    # window's handle and title are part of the key as well.
+    from telegram_agent.app.tools import screen, system
+
+    window = system.active_window()
+    return f"{window.get('handle')}|{window.get('title', '')}|{screen.screen_fingerprint()}"
+
+
+def context_of(window: dict[str, Any]) -> str:
+    # Process name and title of an active_window payload; what the plan cache is keyed on.
+    return f"{window.get('process', {}).get('name', '')}|{window.get('title', '')}"
+
+
+def window_context() -> str:
+    from telegram_agent.app.tools import system
+
+    return context_of(system.active_window())
+
+
+async def probe_window_context(timeout_seconds: float = FINGERPRINT_TIMEOUT_SECONDS) -> str | None:
+    # None when the active window cannot be read in time; callers then skip their caches.
+    loop = asyncio.get_running_loop()
+    try:
+        return await asyncio.wait_for(loop.run_in_executor(_probe_pool, window_context), timeout=timeout_seconds)
+    except Exception:  # noqa: BLE001
+        return None
+
+
+@dataclass
+class _CachedObservation:
+    fingerprint: str
+    task_id: str
+    observation: dict[str, object]
+    stored_at: float
+
+
+class ObservationCache:
+    # Remembers the last observation so back-to-back /do commands on an unchanged screen skip the
+    # UIA dump and screenshot. Entries expire after ttl_seconds and are dropped whenever the
+    # executor sends GUI input; invalidate() may be called from any thread.
+    def __init__(self, ttl_seconds: float = 30.0) -> None:
+        self.ttl_seconds = ttl_seconds
+        self._entry: _CachedObservation | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0
+
+    def get(self, fingerprint: str) -> tuple[str, dict[str, object]] | None:
+        with self._lock:
+            entry = self._entry
+            if entry is None:
+                return None
+            if time.monotonic() - entry.stored_at > self.ttl_seconds or entry.fingerprint != fingerprint:
+                self._entry = None
+                return None
+            return entry.task_id, copy.deepcopy(entry.observation)
+
+    def put(self, fingerprint: str, task_id: str, observation: dict[str, object]) -> None:
+        if not self.enabled:
+            return
+        # Partial observations are not worth reusing: the next /do may get the missing probes.
+        if any(probe.error_key in observation for probe in PROBES):
+            return
+        with self._lock:
+            self._entry = _CachedObservation(fingerprint, task_id, copy.deepcopy(observation), time.monotonic())
+
+    def invalidate(self, *_: object) -> None:
+        with self._lock:
+            self._entry = None
+
+
+async def collect_observation(
+    audit_dir: str,
+    task_id: str,
+    timeouts: dict[str, float] | None = None,
+    cache: ObservationCache | None = None,
+) -> dict[str, object]:
+    # All probes run in parallel off the event loop; one that misses its deadline leaves an error
+    # entry and a partial observation instead of holding up planning.
+    timeouts = timeouts or {}
+    fingerprint = None
+    if cache is not None and cache.enabled:
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            fingerprint = await asyncio.wait_for(
+                loop.run_in_executor(_probe_pool, observation_fingerprint),
+                timeout=timeouts.get("fingerprint", FINGERPRINT_TIMEOUT_SECONDS),
+            )
+        except Exception:  # noqa: BLE001
+            fingerprint = None
+        fingerprint_ms = round((time.perf_counter() - started) * 1000, 1)
+        hit = cache.get(fingerprint) if fingerprint is not None else None
+        if hit is not None:
+            cached_task_id, observation = hit
+            observation["cached_from"] = cached_task_id
+            observation["probe_timings_ms"] = {"fingerprint": fingerprint_ms}
+            return observation
+
+    results = await asyncio.gather(
+        *(_run_probe(probe, audit_dir, task_id, timeouts.get(probe.name, probe.timeout_seconds)) for probe in PROBES)
+    )
+    observation: dict[str, object] = {}
+    timings: dict[str, float] = {}
+    for probe, result in zip(PROBES, results):
+        timings[probe.name] = round(result.pop("elapsed_ms"), 1)
+        observation.update(result)
+    observation["probe_timings_ms"] = timings
+    if fingerprint is not None and cache is not None:
+        cache.put(fingerprint, task_id, observation)
+    return observation
+
+
+def write_observation(audit_dir: str, task_id: str, payload: dict[str, object]) -> str:
+    observation_dir = Path(audit_dir) / task_id
+    observation_dir.mkdir(parents=True, exist_ok=True)
+    path = observation_dir / "observation.json"
+    source_task_id = payload.get("cached_from")
+    if isinstance(source_task_id, str):
+        # A cache hit reuses the earlier task's file instead of serialising the same dump again.
+        source = Path(audit_dir) / source_task_id / "observation.json"
+        try:
+            try:
+                os.link(source, path)
+            except OSError:
+                shutil.copyfile(source, path)
+            return str(path)
+        except OSError:
+            pass
+    path.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+    return str(path)
+
+
+def summarize_observation(observation: dict[str, object]) -> dict[str, object]:
+    active_window = observation.get("active_window", {})
+    display_info = observation.get("display_info", {})
+    uia_dump = observation.get("uia_dump", [])
+    if not isinstance(active_window, dict):
+        active_window = {}
+    if not isinstance(display_info, dict):
+        display_info = {}
+    if isinstance(uia_dump, dict):
+        uia_dump_count = uia_dump.get("count", 0)
+    elif isinstance(uia_dump, list):
+        uia_dump_count = len(uia_dump)
+    else:
+        uia_dump_count = 0
+    return {
+        "active_window_title": active_window.get("title", ""),
+        "active_window_process": active_window.get("process", {}).get("name", ""),
+        "monitor_count": len(display_info.get("monitors", [])),
+        "uia_dump_count": uia_dump_count,
+    }
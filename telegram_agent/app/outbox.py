@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Any
+
+from loguru import logger
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+# Send order: a final result overtakes any photo or progress update still waiting for a token.
+FINAL = 0
+PHOTO = 1
+PROGRESS = 2
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def delay(self, now: float) -> float:
+        # Seconds until a token is available; 0 when one can be taken right away.
+        self._refill(now)
+        wait = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+        return max(wait, self._paused_until - now)
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self._tokens -= 1
+
+    def pause(self, seconds: float, now: float) -> None:
+        # Honours a server-side flood wait: nothing is sent before it is over, and the burst
+        # allowance starts again from empty.
+        self._paused_until = max(self._paused_until, now + seconds)
+        self._tokens = 0.0
+
+
+@dataclass
+class _Outgoing:
+    priority: int
+    seq: int
+    chat_id: int
+    text: str | None = None
+    photo: bytes | None = None
+    key: str | None = None
+
+
+def _retry_after_seconds(exc: RetryAfter) -> float:
+    retry_after: Any = exc.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class Outbox:
+    # Single sender for task output. Progress updates for the same key are coalesced into edits of
+    # one status message, and every send waits for both its chat's token bucket and the global one.
+    # progress(), photo() and final() are safe to call from executor threads.
+    def __init__(
+        self,
+        bot: Any,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3,
+        global_rate: float = 25.0,
+        global_burst: float = 25,
+    ) -> None:
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._global = TokenBucket(global_rate, global_burst)
+        self._chats: dict[int, TokenBucket] = {}
+        self._pending: list[_Outgoing] = []
+        self._progress: dict[tuple[int, str], _Outgoing] = {}
+        self._status_messages: dict[tuple[int, str], int] = {}
+        self._seq = itertools.count()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._sender: asyncio.Task[None] | None = None
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    async def start(self) -> None:
+        if self._sender is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._sender = asyncio.create_task(self._run(), name="outbox")
+
+    async def stop(self, drain_timeout: float = 5.0) -> None:
+        sender, self._sender = self._sender, None
+        if sender is None:
+            return
+        deadline = time.monotonic() + drain_timeout
+        while self._pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._pending:
+            logger.warning("Outbox stopped with {} unsent messages", len(self._pending))
+        sender.cancel()
+        await asyncio.gather(sender, return_exceptions=True)
+
+    def progress(self, chat_id: int, key: str, text: str) -> None:
+        self._submit(self._add_progress, chat_id, key, text)
+
+    def photo(self, chat_id: int, photo: bytes, caption: str | None = None) -> None:
+        self._submit(self._add, _Outgoing(PHOTO, next(self._seq), chat_id, text=caption, photo=photo))
+
+    def final(self, chat_id: int, text: str, key: str | None = None) -> None:
+        self._submit(self._add_final, chat_id, text, key)
+
+    def _submit(self, callback: Any, *args: Any) -> None:
+        if self._loop is None:
+            raise RuntimeError("Outbox is not started")
+        self._loop.call_soon_threadsafe(callback, *args)
+
+    def _add(self, item: _Outgoing) -> None:
+        self._pending.append(item)
+        assert self._wakeup is not None
+        self._wakeup.set()
+
+    def _add_progress(self, chat_id: int, key: str, text: str) -> None:
+        waiting = self._progress.get((chat_id, key))
+        if waiting is not None:
+            # Not sent yet: only the latest text matters.
+            waiting.text = text
+            return
+        item = _Outgoing(PROGRESS, next(self._seq), chat_id, text=text, key=key)
+        self._progress[(chat_id, key)] = item
+        self._add(item)
+
+    def _add_final(self, chat_id: int, text: str, key: str | None) -> None:
+        if key is not None:
+            stale = self._progress.pop((chat_id, key), None)
+            if stale is not None:
+                self._pending.remove(stale)
+        self._add(_Outgoing(FINAL, next(self._seq), chat_id, text=text, key=key))
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _next_ready(self) -> tuple[_Outgoing | None, float | None]:
+        # Returns the best sendable item, or how long to wait before one may become sendable.
+        if not self._pending:
+            return None, None
+        now = time.monotonic()
+        global_delay = self._global.delay(now)
+        if global_delay > 0:
+            return None, global_delay
+        shortest: float | None = None
+        for item in sorted(self._pending, key=lambda item: (item.priority, item.seq)):
+            bucket = self._chat_bucket(item.chat_id)
+            delay = bucket.delay(now)
+            if delay <= 0:
+                bucket.take(now)
+                self._global.take(now)
+                self._pending.remove(item)
+                if item.priority == PROGRESS and item.key is not None:
+                    self._progress.pop((item.chat_id, item.key), None)
+                return item, None
+            shortest = delay if shortest is None else min(shortest, delay)
+        return None, shortest
+
+    async def _run(self) -> None:
+        assert self._wakeup is not None
+        while True:
+            self._wakeup.clear()
+            item, delay = self._next_ready()
+            if item is not None:
+                await self._deliver(item)
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver(self, item: _Outgoing) -> None:
+        try:
+            if item.priority == PROGRESS:
+                await self._send_progress(item)
+            elif item.photo is not None:
+                await self.bot.send_photo(chat_id=item.chat_id, photo=item.photo, caption=item.text)
+            else:
+                await self.bot.send_message(chat_id=item.chat_id, text=item.text)
+                if item.key is not None:
+                    self._status_messages.pop((item.chat_id, item.key), None)
+        except RetryAfter as exc:
+            seconds = _retry_after_seconds(exc)
+            logger.warning("Telegram flood limit hit for chat {}; retrying in {}s", item.chat_id, seconds)
+            now = time.monotonic()
+            self._global.pause(seconds, now)
+            self._chat_bucket(item.chat_id).pause(seconds, now)
+            self._requeue(item)
+        except TelegramError:
+            logger.exception("Failed to deliver message to chat {}", item.chat_id)
+        except Exception:  # noqa: BLE001
+            # Anything else (a bad photo payload, a bug) drops this item but must not end the
+            # only sender task, or every later message would queue up unsent.
+            logger.exception("Unexpected error delivering message to chat {}; dropped", item.chat_id)
+
+    async def _send_progress(self, item: _Outgoing) -> None:
+        assert item.key is not None
+        status_key = (item.chat_id, item.key)
+        message_id = self._status_messages.get(status_key)
+        if message_id is not None:
+            try:
+                await self.bot.edit_message_text(text=item.text, chat_id=item.chat_id, message_id=message_id)
+                return
+            except BadRequest as exc:
+                if "not modified" in str(exc).lower():
+                    return
+                # The status message was deleted or is too old to edit: start a new one.
+        message = await self.bot.send_message(chat_id=item.chat_id, text=item.text)
+        self._status_messages[status_key] = message.message_id
+
+    def _requeue(self, item: _Outgoing) -> None:
+        if item.priority == PROGRESS and item.key is not None:
+            if (item.chat_id, item.key) in self._progress:
+                # A newer update arrived while this one was in flight.
+                return
+            self._progress[(item.chat_id, item.key)] = item
+        self._pending.append(item)
@@ -2,8 +2,11 @@ from __future__ import annotations
 
 import json
 import re
+import threading
+import time
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, Callable
 
 
 @dataclass
@@ -15,58 +18,184 @@ class Plan:
         return json.dumps({"task": self.task, "steps": self.steps}, ensure_ascii=False)
 
 
-def _parse_click(task: str) -> tuple[int, int] | None:
-    match = re.search(r"click\s+(\d+)\s+(\d+)", task, re.IGNORECASE)
-    if match:
-        return int(match.group(1)), int(match.group(2))
-    return None
+class PlanError(ValueError):
+    pass
 
 
-def _parse_type(task: str) -> str | None:
-    match = re.search(r"type\s+(.+)", task, re.IGNORECASE)
-    if match:
-        return match.group(1).strip()
-    return None
+@dataclass(frozen=True)
+class Action:
+    action: str
+    args: dict[str, Any]
 
 
-def _parse_click_text(task: str) -> tuple[str, str | None] | None:
-    match = re.search(r"click_text\s+(.+?)(?:\s+then\b|$)", task, re.IGNORECASE)
-    if not match:
-        return None
-    text = match.group(1).strip()
-    control_match = re.search(r"\bcontrol_type\s*=\s*([\\w ]+)$", text, re.IGNORECASE)
-    control_type = None
-    if control_match:
-        control_type = control_match.group(1).strip()
-        text = re.sub(r"\bcontrol_type\s*=\s*[\\w ]+$", "", text, flags=re.IGNORECASE).strip()
-    return text, control_type
+# One scan over the command: a bare "then" separates clauses, quoted strings are single tokens
+# (so text containing "then" can still be typed), key="quoted value" is one word with the quotes
+# removed from its value, anything else is a whitespace-delimited word.
+_TOKEN = re.compile(
+    r"""\s*(?:
+        (?P<then>then)(?=\s|$)
+      | (?P<key>[a-z_]+=)(?:"(?P<key_dquote>(?:[^"\\]|\\.)*)"|'(?P<key_squote>[^']*)')(?=\s|$)
+      | "(?P<dquote>(?:[^"\\]|\\.)*)"(?=\s|$)
+      | '(?P<squote>[^']*)'(?=\s|$)
+      | (?P<word>\S+)
+    )""",
+    re.IGNORECASE | re.VERBOSE,
+)
+_ESCAPE = re.compile(r"\\(.)")
+_OPTION = re.compile(r"(?P<key>[a-z_]+)=(?P<value>.*)", re.IGNORECASE)
 
 
-def _parse_click_uia(task: str) -> str | None:
-    match = re.search(r"click_uia\s+(.+?)(?:\s+then\b|$)", task, re.IGNORECASE)
-    if match:
-        return match.group(1).strip()
-    return None
+@dataclass(frozen=True)
+class _Token:
+    text: str
+    start: int
+    end: int
+    quoted: bool
 
 
-def _parse_click_path(task: str) -> str | None:
-    match = re.search(r"click_path\s+(.+?)(?:\s+then\b|$)", task, re.IGNORECASE)
-    if match:
-        return match.group(1).strip()
-    return None
+def _tokenize(command: str) -> list[list[_Token]]:
+    clauses: list[list[_Token]] = [[]]
+    position = 0
+    while True:
+        match = _TOKEN.match(command, position)
+        if match is None or match.end() == position:
+            return [clause for clause in clauses if clause]
+        position = match.end()
+        kind = match.lastgroup
+        if kind == "then":
+            clauses.append([])
+        elif kind == "word":
+            clauses[-1].append(_Token(match.group(kind), match.start(kind), position, False))
+        elif kind in ("key_dquote", "key_squote"):
+            value = match.group(kind)
+            if kind == "key_dquote":
+                value = _ESCAPE.sub(r"\1", value)
+            clauses[-1].append(_Token(match.group("key") + value, match.start("key"), position, False))
+        else:
+            text = match.group(kind)
+            if kind == "dquote":
+                text = _ESCAPE.sub(r"\1", text)
+            # Spans include the quotes, so a multi-token argument keeps them verbatim.
+            clauses[-1].append(_Token(text, match.start(kind) - 1, position, True))
+
+
+def _raw_text(command: str, tokens: list[_Token]) -> str:
+    # A single quoted token is taken literally; otherwise the original text, spacing included.
+    if len(tokens) == 1 and tokens[0].quoted:
+        return tokens[0].text
+    return command[tokens[0].start : tokens[-1].end]
+
+
+def _require(verb: str, tokens: list[_Token]) -> None:
+    if not tokens:
+        raise PlanError(f"{verb} needs an argument")
+
+
+def _int(verb: str, token: _Token) -> int:
+    try:
+        return int(token.text)
+    except ValueError:
+        raise PlanError(f"{verb} expects integers, got '{token.text}'") from None
+
+
+def _click_text(command: str, tokens: list[_Token]) -> Action:
+    # Trailing control_type=<type> / window=<title> options narrow the search.
+    options: dict[str, str] = {}
+    while tokens and not tokens[-1].quoted:
+        option = _OPTION.fullmatch(tokens[-1].text)
+        if option is None or option.group("key").lower() not in ("control_type", "window"):
+            break
+        options[option.group("key").lower()] = option.group("value")
+        tokens = tokens[:-1]
+    _require("click_text", tokens)
+    args: dict[str, Any] = {"text": _raw_text(command, tokens)}
+    if options.get("control_type"):
+        args["control_type"] = options["control_type"]
+    if options.get("window"):
+        args["window_title_substring"] = options["window"]
+    return Action("uia.click_text", args)
+
+
+def _click(command: str, tokens: list[_Token]) -> Action:
+    if len(tokens) != 2:
+        raise PlanError("click needs <x> <y>")
+    return Action("input.click", {"x": _int("click", tokens[0]), "y": _int("click", tokens[1])})
+
+
+def _text_action(verb: str, action: str, key: str) -> Callable[[str, list[_Token]], Action]:
+    def parse(command: str, tokens: list[_Token]) -> Action:
+        _require(verb, tokens)
+        return Action(action, {key: _raw_text(command, tokens)})
 
+    return parse
 
-def create_plan(task: str, observation: dict[str, Any] | None = None) -> Plan:
+
+def _hotkey(command: str, tokens: list[_Token]) -> Action:
+    _require("hotkey", tokens)
+    keys = "".join(token.text for token in tokens).lower()
+    if not all(keys.split("+")):
+        raise PlanError(f"Invalid hotkey '{keys}'")
+    return Action("input.hotkey", {"keys": keys})
+
+
+def _wait(command: str, tokens: list[_Token]) -> Action:
+    if len(tokens) != 1:
+        raise PlanError("wait needs <seconds>")
+    text = tokens[0].text.lower().removesuffix("s")
+    try:
+        seconds = float(text)
+    except ValueError:
+        raise PlanError(f"wait expects seconds, got '{tokens[0].text}'") from None
+    if not 0 <= seconds <= 30:
+        raise PlanError("wait must be between 0 and 30 seconds")
+    return Action("wait.sleep", {"seconds": seconds})
+
+
+_VERBS: dict[str, Callable[[str, list[_Token]], Action]] = {
+    "click_text": _click_text,
+    "click_uia": _text_action("click_uia", "uia.click_automation_id", "automation_id"),
+    "click_path": _text_action("click_path", "uia.click_path", "path"),
+    "click": _click,
+    "type": _text_action("type", "input.type", "text"),
+    "hotkey": _hotkey,
+    "wait": _wait,
+    "focus": _text_action("focus", "uia.focus_window", "title_substring"),
+}
+
+
+def parse_command(command: str) -> list[Action]:
+    # Each "then"-separated clause starts at its first known verb; words before it (e.g.
+    # "please") are ignored, and clauses without a verb produce no action.
+    actions = []
+    for clause in _tokenize(command):
+        for index, token in enumerate(clause):
+            parse = None if token.quoted else _VERBS.get(token.text.lower())
+            if parse is not None:
+                actions.append(parse(command, clause[index + 1 :]))
+                break
+    return actions
+
+
+_OBSERVATION_NOTE = "Observation summary"
+
+
+def create_plan(
+    task: str, observation: dict[str, Any] | None = None, actions: list[Action] | None = None
+) -> Plan:
+    # Every step lists its dependencies: the notes run alongside the "before" capture, input
+    # steps wait for that capture and for each other, and the "after" capture waits for all input.
     steps: list[dict[str, Any]] = [
         {
             "id": 1,
             "action": "screen.capture",
             "args": {"label": "before"},
+            "depends_on": [],
         },
         {
             "id": 2,
             "action": "log.note",
             "args": {"message": f"Requested task: {task}"},
+            "depends_on": [],
         },
     ]
     if observation:
@@ -74,69 +203,99 @@ def create_plan(task: str, observation: dict[str, Any] | None = None) -> Plan:
             {
                 "id": len(steps) + 1,
                 "action": "log.note",
-                "args": {"message": f"Observation summary: {json.dumps(observation, ensure_ascii=False)}"},
-            }
-        )
-
-    click_text = _parse_click_text(task)
-    if click_text:
-        args = {"text": click_text[0]}
-        if click_text[1]:
-            args["control_type"] = click_text[1]
-        steps.append(
-            {
-                "id": len(steps) + 1,
-                "action": "uia.click_text",
-                "args": args,
-            }
-        )
-    else:
-        click_uia = _parse_click_uia(task)
-        if click_uia:
-            steps.append(
-                {
-                    "id": len(steps) + 1,
-                    "action": "uia.click_automation_id",
-                    "args": {"automation_id": click_uia},
-                }
-            )
-        else:
-            click_path = _parse_click_path(task)
-            if click_path:
-                steps.append(
-                    {
-                        "id": len(steps) + 1,
-                        "action": "uia.click_path",
-                        "args": {"path": click_path},
-                    }
-                )
-            else:
-                click = _parse_click(task)
-                if click:
-                    steps.append(
-                        {
-                            "id": len(steps) + 1,
-                            "action": "input.click",
-                            "args": {"x": click[0], "y": click[1]},
-                        }
-                    )
-
-    text = _parse_type(task)
-    if text:
-        steps.append(
-            {
-                "id": len(steps) + 1,
-                "action": "input.type",
-                "args": {"text": text},
+                "args": {"message": f"{_OBSERVATION_NOTE}: {json.dumps(observation, ensure_ascii=False)}"},
+                "depends_on": [],
             }
         )
+    first_input_step = len(steps) + 1
+    for action in parse_command(task) if actions is None else actions:
+        steps.append({"id": len(steps) + 1, "action": action.action, "args": action.args})
 
+    previous_step = 1
+    for step in steps[first_input_step - 1 :]:
+        step["depends_on"] = [previous_step]
+        previous_step = step["id"]
     steps.append(
         {
             "id": len(steps) + 1,
             "action": "screen.capture",
             "args": {"label": "after"},
+            "depends_on": [previous_step],
         }
     )
 
     return Plan(task=task, steps=steps)
+
+
+@dataclass(frozen=True)
+class CachedPlan:
+    task_id: str
+    plan_json: str
+    lane: str
+    stored_at: float
+
+
+class PlanCache:
+    # Plans for recent commands, keyed by the command with whitespace collapsed and by the active
+    # window (process and title), so repeating a /do in the same window skips observation and
+    # planning. Entries expire after ttl_seconds; the oldest are dropped beyond max_entries.
+    def __init__(self, ttl_seconds: float = 300.0, max_entries: int = 128) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple[str, str], CachedPlan] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0
+
+    @staticmethod
+    def _key(command: str, window_context: str) -> tuple[str, str]:
+        return " ".join(command.split()), window_context
+
+    def has_command(self, command: str) -> bool:
+        # Lets callers skip probing the active window for commands that were never cached.
+        command = " ".join(command.split())
+        now = time.monotonic()
+        with self._lock:
+            return any(
+                key[0] == command and now - entry.stored_at <= self.ttl_seconds for key, entry in self._entries.items()
+            )
+
+    def get(self, command: str, window_context: str) -> CachedPlan | None:
+        key = self._key(command, window_context)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry.stored_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, command: str, window_context: str, task_id: str, plan_json: str, lane: str) -> None:
+        if not self.enabled:
+            return
+        key = self._key(command, window_context)
+        with self._lock:
+            self._entries[key] = CachedPlan(task_id, plan_json, lane, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def relabel_observation_note(plan_json: str, label: str) -> str:
+    # A stored plan's observation note describes the screen its source task saw; say where it came
+    # from, so a new task's log does not pass it off as its own observation. Notes that already
+    # carry a label name their source and are left alone.
+    plan = json.loads(plan_json)
+    for step in plan["steps"]:
+        message = step["args"].get("message", "") if step["action"] == "log.note" else ""
+        if message.startswith(f"{_OBSERVATION_NOTE}: "):
+            step["args"]["message"] = message.replace(_OBSERVATION_NOTE, f"{_OBSERVATION_NOTE} ({label})", 1)
+    return json.dumps(plan, ensure_ascii=False)
+
+
+def reused_plan_json(cached: CachedPlan) -> str:
+    return relabel_observation_note(cached.plan_json, f"reused from task {cached.task_id}")
@@ -1,12 +1,17 @@
 from __future__ import annotations
 
 import json
+import queue
 import sqlite3
+import threading
 import time
 import uuid
+import zlib
 from dataclasses import dataclass
 from typing import Any
 
+from loguru import logger
+
 
 @dataclass
 class Task:
@@ -22,16 +27,107 @@ class Task:
     result_json: str | None
 
 
+@dataclass
+class TaskSummary:
+    task_id: str
+    chat_id: int
+    user_id: int
+    command: str
+    status: str
+    created_at: float
+    updated_at: float
+
+
+@dataclass
+class StepRecord:
+    task_id: str
+    step_id: int
+    action: str
+    args_hash: str
+    started_at: float
+    duration_ms: float
+    ok: bool
+    output_ref: str | None
+
+
+@dataclass
+class Macro:
+    name: str
+    command: str
+    plan_json: str
+    source_task_id: str
+    created_by: int
+    created_at: float
+
+
+_STATEMENT_CACHE_SIZE = 128
+_STEP_BATCH_SIZE = 256
+
+_TASK_COLUMNS = (
+    "task_id, chat_id, user_id, command, plan_json, status, created_at, updated_at, timeout_seconds, result_json, "
+    "plan_offloaded, result_offloaded"
+)
+_SUMMARY_COLUMNS = "task_id, chat_id, user_id, command, status, created_at, updated_at"
+
+# Plans and results larger than this are zlib-compressed into task_payloads, keeping the hot table
+# small for scans like /status. The tasks row then has its plan_offloaded / result_offloaded flag
+# set and an empty column, so no payload value doubles as the marker.
+_INLINE_PAYLOAD_MAX_BYTES = 4096
+
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
+
 class TaskQueue:
     def __init__(self, db_path: str) -> None:
         self.db_path = db_path
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._closed = False
+        self._step_writer: _StepWriter | None = None
+        self._step_writer_lock = threading.Lock()
         self._init_db()
 
+    def __enter__(self) -> TaskQueue:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
     def _connect(self) -> sqlite3.Connection:
-        return sqlite3.connect(self.db_path, check_same_thread=False, timeout=10)
+        # One long-lived connection per thread: PRAGMAs run once and the statement cache survives between calls.
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+        with self._connections_lock:
+            if self._closed:
+                raise RuntimeError("TaskQueue is closed")
+            conn = sqlite3.connect(
+                self.db_path,
+                check_same_thread=False,
+                timeout=10,
+                cached_statements=_STATEMENT_CACHE_SIZE,
+            )
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._connections.append(conn)
+        self._local.conn = conn
+        return conn
+
+    def close(self) -> None:
+        with self._step_writer_lock:
+            writer, self._step_writer = self._step_writer, None
+        if writer is not None:
+            writer.close()
+        with self._connections_lock:
+            self._closed = True
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
 
     def _init_db(self) -> None:
         with self._connect() as conn:
+            # Only takes effect on a fresh database; lets retention give pages back incrementally.
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
             conn.execute(
                 """
                 CREATE TABLE IF NOT EXISTS tasks (
@@ -48,8 +144,63 @@ class TaskQueue:
                 )
                 """
             )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(tasks)")}
+            if "worker_id" not in columns:
+                conn.execute("ALTER TABLE tasks ADD COLUMN worker_id TEXT")
+            if "lease_until" not in columns:
+                conn.execute("ALTER TABLE tasks ADD COLUMN lease_until REAL")
+            if "attempts" not in columns:
+                conn.execute("ALTER TABLE tasks ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+            if "lane" not in columns:
+                conn.execute("ALTER TABLE tasks ADD COLUMN lane TEXT NOT NULL DEFAULT 'gui'")
+            if "plan_offloaded" not in columns:
+                conn.execute("ALTER TABLE tasks ADD COLUMN plan_offloaded INTEGER NOT NULL DEFAULT 0")
+            if "result_offloaded" not in columns:
+                conn.execute("ALTER TABLE tasks ADD COLUMN result_offloaded INTEGER NOT NULL DEFAULT 0")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS task_steps (
+                    task_id TEXT NOT NULL,
+                    step_id INTEGER NOT NULL,
+                    action TEXT NOT NULL,
+                    args_hash TEXT NOT NULL,
+                    started_at REAL NOT NULL,
+                    duration_ms REAL NOT NULL,
+                    ok INTEGER NOT NULL,
+                    output_ref TEXT,
+                    PRIMARY KEY (task_id, step_id)
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS task_payloads (
+                    task_id TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    codec TEXT NOT NULL,
+                    data BLOB NOT NULL,
+                    PRIMARY KEY (task_id, kind)
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS macros (
+                    name TEXT PRIMARY KEY,
+                    command TEXT NOT NULL,
+                    plan_json TEXT NOT NULL,
+                    source_task_id TEXT NOT NULL,
+                    created_by INTEGER NOT NULL,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_created ON tasks (created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_updated ON tasks (updated_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status_created ON tasks (status, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status_lane ON tasks (status, lane)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status_lease ON tasks (status, lease_until)")
             conn.execute("PRAGMA journal_mode=WAL")
-            conn.execute("PRAGMA synchronous=NORMAL")
 
     def create_task(
         self,
@@ -59,34 +210,46 @@ class TaskQueue:
         plan_json: str,
         timeout_seconds: int,
         task_id: str | None = None,
+        lane: str = "gui",
     ) -> str:
         task_id = task_id or str(uuid.uuid4())
         now = time.time()
         with self._connect() as conn:
+            plan_json, offloaded = self._store_payload(conn, task_id, "plan", plan_json)
             conn.execute(
                 """
-                INSERT INTO tasks (task_id, chat_id, user_id, command, plan_json, status, created_at, updated_at, timeout_seconds)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                INSERT INTO tasks (
+                    task_id, chat_id, user_id, command, plan_json, plan_offloaded, status, created_at, updated_at,
+                    timeout_seconds, lane
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """,
-                (task_id, chat_id, user_id, command, plan_json, "pending_approval", now, now, timeout_seconds),
+                (
+                    task_id, chat_id, user_id, command, plan_json, offloaded, "pending_approval", now, now,
+                    timeout_seconds, lane,
+                ),
             )
         return task_id
 
     def approve_task(self, task_id: str) -> bool:
         return self._update_status(task_id, "queued", expected="pending_approval")
 
-    def update_plan(self, task_id: str, plan_json: str) -> bool:
+    def update_plan(self, task_id: str, plan_json: str, lane: str | None = None) -> bool:
         now = time.time()
         with self._connect() as conn:
+            plan_json, offloaded = self._store_payload(conn, task_id, "plan", plan_json)
             cursor = conn.execute(
                 """
                 UPDATE tasks
-                SET plan_json = ?, updated_at = ?
+                SET plan_json = ?, plan_offloaded = ?, updated_at = ?, lane = COALESCE(?, lane)
                 WHERE task_id = ? AND status = 'pending_approval'
                 """,
-                (plan_json, now, task_id),
+                (plan_json, offloaded, now, lane, task_id),
             )
-        return cursor.rowcount > 0
+            if cursor.rowcount == 0:
+                conn.rollback()
+                return False
+        return True
 
     def cancel_task(self, task_id: str) -> bool:
         return self._update_status(task_id, "cancelled")
@@ -94,73 +257,316 @@ class TaskQueue:
     def mark_running(self, task_id: str) -> bool:
         return self._update_status(task_id, "running", expected="queued")
 
-    def mark_done(self, task_id: str, result: dict[str, Any]) -> None:
+    def claim_next(
+        self,
+        worker_id: str,
+        lease_seconds: float,
+        lane_limits: dict[str, int] | None = None,
+    ) -> Task | None:
+        # Pick and claim in one statement so concurrent workers can never claim the same task.
+        # Without lane limits nothing starts while any task is running; with them, the oldest
+        # queued task whose lane still has a free slot is claimed.
         now = time.time()
+        if lane_limits is None:
+            candidate_sql = """
+                SELECT task_id
+                FROM tasks
+                WHERE status = 'queued'
+                AND NOT EXISTS (SELECT 1 FROM tasks WHERE status = 'running')
+                ORDER BY created_at ASC
+                LIMIT 1
+            """
+            cte_sql = ""
+            cte_params: list[object] = []
+        else:
+            if not lane_limits:
+                return None
+            candidate_sql = """
+                SELECT t.task_id
+                FROM tasks AS t
+                JOIN lane_limits AS l ON l.lane = t.lane
+                WHERE t.status = 'queued'
+                AND (SELECT COUNT(*) FROM tasks AS r WHERE r.status = 'running' AND r.lane = t.lane) < l.max_running
+                ORDER BY t.created_at ASC
+                LIMIT 1
+            """
+            cte_sql = "WITH lane_limits (lane, max_running) AS (VALUES {})".format(
+                ", ".join("(?, ?)" for _ in lane_limits)
+            )
+            cte_params = [value for item in lane_limits.items() for value in item]
         with self._connect() as conn:
-            conn.execute(
+            rows = conn.execute(
+                f"""
+                {cte_sql}
+                UPDATE tasks
+                SET status = 'running', worker_id = ?, lease_until = ?, updated_at = ?, attempts = attempts + 1
+                WHERE task_id = ({candidate_sql})
+                AND status = 'queued'
+                RETURNING {_TASK_COLUMNS}
+                """,
+                (*cte_params, worker_id, now + lease_seconds, now),
+            ).fetchall()
+            if not rows:
+                return None
+            return self._task_from_row(conn, rows[0])
+
+    def renew_lease(self, task_id: str, worker_id: str, lease_seconds: float) -> bool:
+        # False means the task is no longer ours to run: cancelled, finished or reaped.
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
                 """
                 UPDATE tasks
-                SET status = ?, updated_at = ?, result_json = ?
-                WHERE task_id = ?
+                SET lease_until = ?
+                WHERE task_id = ? AND worker_id = ? AND status = 'running'
                 """,
-                ("completed", now, json.dumps(result, ensure_ascii=False), task_id),
+                (now + lease_seconds, task_id, worker_id),
             )
+        return cursor.rowcount > 0
+
+    def reap_expired(self, policy: str = "fail", max_attempts: int = 1) -> list[tuple[str, str]]:
+        # Running tasks whose lease ran out belong to a dead worker. They are requeued while they
+        # have attempts left under the "requeue" policy and failed otherwise. Rows without a lease
+        # predate leases and are treated as expired.
+        if policy not in ("fail", "requeue"):
+            raise ValueError(f"Unknown expired lease policy: {policy}")
+        now = time.time()
+        error = json.dumps({"error": "Worker lease expired"}, ensure_ascii=False)
+        with self._connect() as conn:
+            rows = conn.execute(
+                """
+                UPDATE tasks
+                SET status = CASE WHEN ? = 'requeue' AND attempts < ? THEN 'queued' ELSE 'failed' END,
+                    result_json = CASE WHEN ? = 'requeue' AND attempts < ? THEN result_json ELSE ? END,
+                    result_offloaded = CASE WHEN ? = 'requeue' AND attempts < ? THEN result_offloaded ELSE 0 END,
+                    worker_id = NULL,
+                    lease_until = NULL,
+                    updated_at = ?
+                WHERE status = 'running' AND (lease_until IS NULL OR lease_until < ?)
+                RETURNING task_id, status
+                """,
+                (policy, max_attempts, policy, max_attempts, error, policy, max_attempts, now, now),
+            ).fetchall()
+        return [(task_id, status) for task_id, status in rows]
+
+    def mark_done(self, task_id: str, result: dict[str, Any]) -> None:
+        self._finish(task_id, "completed", json.dumps(result, ensure_ascii=False))
 
     def mark_failed(self, task_id: str, message: str) -> None:
+        self._finish(task_id, "failed", json.dumps({"error": message}, ensure_ascii=False))
+
+    def _finish(self, task_id: str, status: str, result_json: str) -> None:
         now = time.time()
         with self._connect() as conn:
+            result_json, offloaded = self._store_payload(conn, task_id, "result", result_json)
             conn.execute(
                 """
                 UPDATE tasks
-                SET status = ?, updated_at = ?, result_json = ?
+                SET status = ?, updated_at = ?, result_json = ?, result_offloaded = ?, lease_until = NULL
                 WHERE task_id = ?
                 """,
-                ("failed", now, json.dumps({"error": message}, ensure_ascii=False), task_id),
+                (status, now, result_json, offloaded, task_id),
             )
 
     def get_task(self, task_id: str) -> Task | None:
         with self._connect() as conn:
             row = conn.execute(
-                "SELECT task_id, chat_id, user_id, command, plan_json, status, created_at, updated_at, timeout_seconds, result_json FROM tasks WHERE task_id = ?",
+                f"SELECT {_TASK_COLUMNS} FROM tasks WHERE task_id = ?",
                 (task_id,),
             ).fetchone()
+            if row is None:
+                return None
+            return self._task_from_row(conn, row)
+
+    def get_status(self, task_id: str) -> str | None:
+        with self._connect() as conn:
+            row = conn.execute("SELECT status FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def _store_payload(self, conn: sqlite3.Connection, task_id: str, kind: str, payload: str) -> tuple[str, bool]:
+        # The value for the tasks column and whether it was offloaded.
+        encoded = payload.encode("utf-8")
+        if len(encoded) <= _INLINE_PAYLOAD_MAX_BYTES:
+            conn.execute("DELETE FROM task_payloads WHERE task_id = ? AND kind = ?", (task_id, kind))
+            return payload, False
+        conn.execute(
+            "INSERT OR REPLACE INTO task_payloads (task_id, kind, codec, data) VALUES (?, ?, ?, ?)",
+            (task_id, kind, "zlib", zlib.compress(encoded)),
+        )
+        return "", True
+
+    def _load_payload(self, conn: sqlite3.Connection, task_id: str, kind: str) -> str | None:
+        row = conn.execute(
+            "SELECT codec, data FROM task_payloads WHERE task_id = ? AND kind = ?",
+            (task_id, kind),
+        ).fetchone()
         if row is None:
             return None
-        return Task(*row)
+        codec, data = row
+        if codec != "zlib":
+            raise ValueError(f"Unknown payload codec: {codec}")
+        return zlib.decompress(data).decode("utf-8")
 
-    def list_recent(self, limit: int = 5) -> list[Task]:
+    def _task_from_row(self, conn: sqlite3.Connection, row: tuple[Any, ...]) -> Task:
+        *fields, plan_offloaded, result_offloaded = row
+        task = Task(*fields)
+        if plan_offloaded:
+            task.plan_json = self._load_payload(conn, task.task_id, "plan") or ""
+        if result_offloaded:
+            task.result_json = self._load_payload(conn, task.task_id, "result")
+        return task
+
+    def list_finished(self, limit: int) -> list[Task]:
+        # Oldest finished tasks first, for retention.
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"""
+                SELECT {_TASK_COLUMNS}
+                FROM tasks
+                WHERE status IN ({", ".join("?" for _ in FINISHED_STATUSES)})
+                ORDER BY updated_at ASC
+                LIMIT ?
+                """,
+                (*FINISHED_STATUSES, limit),
+            ).fetchall()
+            return [self._task_from_row(conn, row) for row in rows]
+
+    def delete_tasks(self, task_ids: list[str]) -> int:
+        if not task_ids:
+            return 0
+        placeholders = ", ".join("?" for _ in task_ids)
+        with self._connect() as conn:
+            conn.execute(f"DELETE FROM task_steps WHERE task_id IN ({placeholders})", task_ids)
+            conn.execute(f"DELETE FROM task_payloads WHERE task_id IN ({placeholders})", task_ids)
+            cursor = conn.execute(f"DELETE FROM tasks WHERE task_id IN ({placeholders})", task_ids)
+        return cursor.rowcount
+
+    def compact(self, vacuum_pages: int) -> None:
+        conn = self._connect()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute(f"PRAGMA incremental_vacuum({int(vacuum_pages)})").fetchall()
+
+    def append_step(self, record: StepRecord) -> None:
+        # Never blocks on disk: records are group-committed by a background writer thread.
+        with self._step_writer_lock:
+            if self._step_writer is None:
+                if self._closed:
+                    raise RuntimeError("TaskQueue is closed")
+                self._step_writer = _StepWriter(self)
+            writer = self._step_writer
+        writer.put(record)
+
+    def flush_steps(self) -> None:
+        with self._step_writer_lock:
+            writer = self._step_writer
+        if writer is not None:
+            writer.flush()
+
+    def list_steps(self, task_id: str) -> list[StepRecord]:
         with self._connect() as conn:
             rows = conn.execute(
                 """
-                SELECT task_id, chat_id, user_id, command, plan_json, status, created_at, updated_at, timeout_seconds, result_json
+                SELECT task_id, step_id, action, args_hash, started_at, duration_ms, ok, output_ref
+                FROM task_steps
+                WHERE task_id = ?
+                ORDER BY step_id ASC
+                """,
+                (task_id,),
+            ).fetchall()
+        return [StepRecord(*row[:6], bool(row[6]), row[7]) for row in rows]
+
+    def _insert_steps(self, records: list[StepRecord]) -> None:
+        with self._connect() as conn:
+            conn.executemany(
+                """
+                INSERT OR REPLACE INTO task_steps (task_id, step_id, action, args_hash, started_at, duration_ms, ok, output_ref)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (
+                        record.task_id,
+                        record.step_id,
+                        record.action,
+                        record.args_hash,
+                        record.started_at,
+                        record.duration_ms,
+                        int(record.ok),
+                        record.output_ref,
+                    )
+                    for record in records
+                ],
+            )
+
+    def save_macro(self, name: str, task_id: str, user_id: int) -> Macro | None:
+        # Only completed tasks can become macros; saving under an existing name replaces it.
+        with self._connect() as conn:
+            row = conn.execute(f"SELECT {_TASK_COLUMNS} FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            if row is None:
+                return None
+            task = self._task_from_row(conn, row)
+            if task.status != "completed":
+                return None
+            macro = Macro(name, task.command, task.plan_json, task_id, user_id, time.time())
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO macros (name, command, plan_json, source_task_id, created_by, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (macro.name, macro.command, macro.plan_json, macro.source_task_id, macro.created_by, macro.created_at),
+            )
+        return macro
+
+    def get_macro(self, name: str) -> Macro | None:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT name, command, plan_json, source_task_id, created_by, created_at FROM macros WHERE name = ?",
+                (name,),
+            ).fetchone()
+        return None if row is None else Macro(*row)
+
+    def list_macros(self) -> list[str]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT name FROM macros ORDER BY name").fetchall()
+        return [row[0] for row in rows]
+
+    def delete_macro(self, name: str) -> bool:
+        with self._connect() as conn:
+            cursor = conn.execute("DELETE FROM macros WHERE name = ?", (name,))
+        return cursor.rowcount > 0
+
+    def list_recent(self, limit: int = 5) -> list[TaskSummary]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"""
+                SELECT {_SUMMARY_COLUMNS}
                 FROM tasks
                 ORDER BY created_at DESC
                 LIMIT ?
                 """,
                 (limit,),
             ).fetchall()
-        return [Task(*row) for row in rows]
+        return [TaskSummary(*row) for row in rows]
 
     def next_queued(self) -> Task | None:
         if self.has_running():
             return None
         with self._connect() as conn:
             row = conn.execute(
-                """
-                SELECT task_id, chat_id, user_id, command, plan_json, status, created_at, updated_at, timeout_seconds, result_json
+                f"""
+                SELECT {_TASK_COLUMNS}
                 FROM tasks
                 WHERE status = 'queued'
                 ORDER BY created_at ASC
                 LIMIT 1
                 """,
             ).fetchone()
-        if row is None:
-            return None
-        return Task(*row)
+            if row is None:
+                return None
+            return self._task_from_row(conn, row)
 
     def has_running(self) -> bool:
         with self._connect() as conn:
-            row = conn.execute(\"SELECT 1 FROM tasks WHERE status = 'running' LIMIT 1\").fetchone()
+            row = conn.execute("SELECT 1 FROM tasks WHERE status = 'running' LIMIT 1").fetchone()
         return row is not None
 
     def _update_status(self, task_id: str, status: str, expected: str | None = None) -> bool:
@@ -185,3 +591,46 @@ class TaskQueue:
                     (status, now, task_id),
                 )
         return cursor.rowcount > 0
+
+
+class _StepWriter:
+    # Collects step records from executor threads and writes them in batches, one transaction per batch.
+    _STOP = object()
+
+    def __init__(self, task_queue: TaskQueue) -> None:
+        self._task_queue = task_queue
+        self._pending: queue.Queue[object] = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="task-step-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, record: StepRecord) -> None:
+        self._pending.put(record)
+
+    def flush(self) -> None:
+        self._pending.join()
+
+    def close(self) -> None:
+        self._pending.put(self._STOP)
+        self._thread.join()
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            # Block for the first record, then take whatever else piled up while the previous
+            # batch was committing: one transaction (and one fsync) per batch.
+            items = [self._pending.get()]
+            while len(items) < _STEP_BATCH_SIZE:
+                try:
+                    items.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            batch = [item for item in items if isinstance(item, StepRecord)]
+            stopping = len(batch) != len(items)
+            try:
+                if batch:
+                    self._task_queue._insert_steps(batch)
+            except Exception:  # noqa: BLE001
+                logger.exception("Failed to write {} step records", len(batch))
+            finally:
+                for _ in items:
+                    self._pending.task_done()
@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import io
+import json
+import shutil
+import tarfile
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+
+from loguru import logger
+
+from telegram_agent.app.queue import Task, TaskQueue
+from telegram_agent.app.tools import shots
+
+
+# Audit subdirectory of the /shot command's captures.
+MANUAL_TASK_ID = "manual"
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    archive_dir: str
+    max_age_days: float = 30
+    max_audit_bytes: int = 2 * 1024**3
+    batch_size: int = 50
+    batch_pause_seconds: float = 0.05
+    vacuum_pages: int = 2000
+
+
+@dataclass
+class RetentionReport:
+    archived_tasks: int = 0
+    deleted_tasks: int = 0
+    archived_bytes: int = 0
+    reclaimed_bytes: int = 0
+    archives: list[str] = field(default_factory=list)
+
+
+def _path_size(path: Path) -> int:
+    if path.is_file():
+        return path.stat().st_size
+    if not path.is_dir():
+        return 0
+    # Screenshots are hard-linked between task directories and the shared store; each inode's
+    # bytes are on disk once.
+    sizes: dict[tuple[int, int], int] = {}
+    for child in path.rglob("*"):
+        if child.is_file():
+            stat = child.stat()
+            sizes[(stat.st_dev, stat.st_ino)] = stat.st_size
+    return sum(sizes.values())
+
+
+def _database_size(db_path: str) -> int:
+    return sum(_path_size(Path(f"{db_path}{suffix}")) for suffix in ("", "-wal", "-shm"))
+
+
+def _task_audit_paths(audit_dir: str, task_id: str) -> list[Path]:
+    # <task_id>.log is the per-task log written before the JSONL audit trail moved into the task directory.
+    return [Path(audit_dir) / task_id, Path(audit_dir) / f"{task_id}.log"]
+
+
+def _write_bundle(queue: TaskQueue, audit_dir: str, archive_dir: str, day: str, tasks: list[Task]) -> Path:
+    # One bundle per day and retention batch: archive/YYYY/MM/DD/tasks-<timestamp>-<first task>.tar.gz
+    bundle_dir = Path(archive_dir, *day.split("-"))
+    bundle_dir.mkdir(parents=True, exist_ok=True)
+    bundle_path = bundle_dir / f"tasks-{time.strftime('%Y%m%d_%H%M%S')}-{tasks[0].task_id[:8]}.tar.gz"
+
+    records = []
+    for task in tasks:
+        record = asdict(task)
+        record["steps"] = [asdict(step) for step in queue.list_steps(task.task_id)]
+        records.append(json.dumps(record, ensure_ascii=False))
+    manifest = ("\n".join(records) + "\n").encode("utf-8")
+
+    with tarfile.open(bundle_path, "w:gz") as bundle:
+        info = tarfile.TarInfo("tasks.jsonl")
+        info.size = len(manifest)
+        info.mtime = int(time.time())
+        bundle.addfile(info, io.BytesIO(manifest))
+        for task in tasks:
+            for path in _task_audit_paths(audit_dir, task.task_id):
+                if path.exists():
+                    bundle.add(path, arcname=f"audit/{path.name}")
+    return bundle_path
+
+
+def _remove_audit(audit_dir: str, task_id: str) -> None:
+    for path in _task_audit_paths(audit_dir, task_id):
+        if path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+        elif path.exists():
+            path.unlink()
+
+
+def _prune_manual(audit_dir: str, cutoff: float, excess_bytes: int) -> int:
+    # /shot captures live under AUDIT_DIR/manual without a task row. They are deleted once older
+    # than the cutoff, and oldest first ahead of any task while the directory is over budget.
+    # Returns what is left of the excess, counting only bytes that actually go away: a capture is
+    # usually a hard link to a shared blob, which is freed only if nothing else links to it.
+    store_inodes = set()
+    for blob in (Path(audit_dir) / "shots").rglob("*"):
+        if blob.is_file():
+            stat = blob.stat()
+            store_inodes.add((stat.st_dev, stat.st_ino))
+    files = []
+    for path in (Path(audit_dir) / MANUAL_TASK_ID).glob("*"):
+        if path.is_file():
+            files.append((path.stat(), path))
+    for stat, path in sorted(files, key=lambda item: item[0].st_mtime):
+        if stat.st_mtime >= cutoff and excess_bytes <= 0:
+            break
+        path.unlink(missing_ok=True)
+        # The only other link being the store's blob means the end-of-run store prune frees it.
+        if stat.st_nlink == 1 or (stat.st_nlink == 2 and (stat.st_dev, stat.st_ino) in store_inodes):
+            excess_bytes -= stat.st_size
+    return excess_bytes
+
+
+def run_retention(
+    queue: TaskQueue, audit_dir: str, policy: RetentionPolicy, stop: threading.Event | None = None
+) -> RetentionReport:
+    # Archives and deletes finished tasks that are older than max_age_days, or the oldest ones
+    # while the audit directory is above max_audit_bytes. Works in small batches with a pause
+    # in between so the bot's own queue writes are never held up for long. Setting stop ends the
+    # run after the current batch, before the queue is touched again.
+    report = RetentionReport()
+    size_before = _database_size(queue.db_path) + _path_size(Path(audit_dir))
+    cutoff = time.time() - policy.max_age_days * 86400
+    excess_bytes = _prune_manual(audit_dir, cutoff, _path_size(Path(audit_dir)) - policy.max_audit_bytes)
+
+    while stop is None or not stop.is_set():
+        selected: list[Task] = []
+        for task in queue.list_finished(policy.batch_size):
+            if task.updated_at >= cutoff and excess_bytes <= 0:
+                break
+            selected.append(task)
+            excess_bytes -= sum(_path_size(path) for path in _task_audit_paths(audit_dir, task.task_id))
+        if not selected:
+            break
+
+        by_day: dict[str, list[Task]] = {}
+        for task in selected:
+            day = datetime.fromtimestamp(task.created_at, tz=timezone.utc).strftime("%Y-%m-%d")
+            by_day.setdefault(day, []).append(task)
+        for day, tasks in by_day.items():
+            bundle_path = _write_bundle(queue, audit_dir, policy.archive_dir, day, tasks)
+            report.archives.append(str(bundle_path))
+            report.archived_bytes += bundle_path.stat().st_size
+            report.archived_tasks += len(tasks)
+
+        # Rows go first: a crash after this point only leaves orphaned audit files behind.
+        report.deleted_tasks += queue.delete_tasks([task.task_id for task in selected])
+        for task in selected:
+            _remove_audit(audit_dir, task.task_id)
+        time.sleep(policy.batch_pause_seconds)
+
+    if stop is not None and stop.is_set():
+        logger.info("Retention stopped after archiving {} tasks", report.archived_tasks)
+        return report
+    # Shared screenshots that no remaining task links to.
+    shots.store(audit_dir).prune()
+    queue.compact(policy.vacuum_pages)
+    size_after = _database_size(queue.db_path) + _path_size(Path(audit_dir))
+    report.reclaimed_bytes = max(0, size_before - size_after)
+    logger.info(
+        "Retention archived {} tasks into {} bundles and reclaimed {} bytes",
+        report.archived_tasks,
+        len(report.archives),
+        report.reclaimed_bytes,
+    )
+    return report
@@ -1,8 +1,12 @@
 from __future__ import annotations
 
+from typing import Literal
+
 from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+from telegram_agent.app.lanes import GUI_LANE, OBSERVE_LANE
+
 
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
@@ -13,7 +17,33 @@ class Settings(BaseSettings):
     sqlite_path: str = Field(default="telegram_agent/app/agent.sqlite", alias="SQLITE_PATH")
     audit_dir: str = Field(default="telegram_agent/app/audit", alias="AUDIT_DIR")
     task_timeout_seconds: int = Field(default=300, alias="TASK_TIMEOUT_SECONDS")
-    poll_interval_seconds: float = Field(default=2.0, alias="POLL_INTERVAL_SECONDS")
+    poll_interval_seconds: float = Field(default=30.0, alias="POLL_INTERVAL_SECONDS")
+    task_lease_seconds: float = Field(default=60.0, alias="TASK_LEASE_SECONDS")
+    expired_lease_policy: Literal["fail", "requeue"] = Field(default="fail", alias="EXPIRED_LEASE_POLICY")
+    max_task_attempts: int = Field(default=2, alias="MAX_TASK_ATTEMPTS")
+    archive_dir: str = Field(default="telegram_agent/app/archive", alias="ARCHIVE_DIR")
+    retention_days: float = Field(default=30.0, alias="RETENTION_DAYS")
+    audit_max_bytes: int = Field(default=2 * 1024**3, alias="AUDIT_MAX_BYTES")
+    retention_interval_seconds: float = Field(default=3600.0, alias="RETENTION_INTERVAL_SECONDS")
+    observation_cache_ttl_seconds: float = Field(default=30.0, alias="OBSERVATION_CACHE_TTL_SECONDS")
+    plan_cache_ttl_seconds: float = Field(default=300.0, alias="PLAN_CACHE_TTL_SECONDS")
+    screenshot_format: Literal["png", "jpeg", "webp"] = Field(default="jpeg", alias="SCREENSHOT_FORMAT")
+    screenshot_quality: int = Field(default=80, alias="SCREENSHOT_QUALITY")
+    screenshot_max_edge: int = Field(default=1920, alias="SCREENSHOT_MAX_EDGE")
+    screenshot_grayscale: bool = Field(default=False, alias="SCREENSHOT_GRAYSCALE")
+    screenshot_crop_active_window: bool = Field(default=False, alias="SCREENSHOT_CROP_ACTIVE_WINDOW")
+    screenshot_max_bytes: int = Field(default=1024**2, alias="SCREENSHOT_MAX_BYTES")
+    screenshot_dedup_distance: int = Field(default=4, alias="SCREENSHOT_DEDUP_DISTANCE")
+    audit_keep_lossless: bool = Field(default=False, alias="AUDIT_KEEP_LOSSLESS")
+    outbox_chat_rate: float = Field(default=1.0, alias="OUTBOX_CHAT_RATE")
+    outbox_global_rate: float = Field(default=25.0, alias="OUTBOX_GLOBAL_RATE")
+    tool_warmup: bool = Field(default=True, alias="TOOL_WARMUP")
+    max_concurrent_tasks: int = Field(default=3, alias="MAX_CONCURRENT_TASKS")
+    gui_lane_limit: int = Field(default=1, alias="GUI_LANE_LIMIT")
+    observe_lane_limit: int = Field(default=2, alias="OBSERVE_LANE_LIMIT")
+
+    def lane_limits(self) -> dict[str, int]:
+        return {GUI_LANE: self.gui_lane_limit, OBSERVE_LANE: self.observe_lane_limit}
 
     def allowed_users(self) -> set[int]:
         return {int(value.strip()) for value in self.allowed_user_ids.split(",") if value.strip()}
@@ -32,10 +32,3 @@ def hotkey(keys: str) -> None:
     pyautogui.hotkey(*parts)
     time.sleep(0.2)
 
-
-def sleep(seconds: float) -> None:
-    if seconds < 0:
-        raise ValueError("seconds must be non-negative")
-    if seconds > 30:
-        raise ValueError("seconds must be <= 30")
-    time.sleep(seconds)
@@ -1,11 +1,256 @@
 from __future__ import annotations
 
+import ctypes
+import hashlib
+import io
 import os
+import threading
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Any, Callable, Hashable, Literal
 
 import mss
-import mss.tools
+import numpy as np
+from PIL import Image
+
+from telegram_agent.app.tools import shots
+
+ImageFormat = Literal["png", "jpeg", "webp"]
+
+_EXTENSIONS = {"png": "png", "jpeg": "jpg", "webp": "webp"}
+_MIN_QUALITY = 40
+_BUDGET_ATTEMPTS = 4
+
+
+@dataclass(frozen=True)
+class EncodeOptions:
+    format: ImageFormat = "png"
+    quality: int = 80
+    # Longest side in pixels after downscaling; 0 keeps the captured resolution.
+    max_edge: int = 0
+    grayscale: bool = False
+    crop_active_window: bool = False
+    # Upload budget in bytes; 0 disables it. Lossy formats trade quality first, then resolution.
+    max_bytes: int = 0
+    # Also write the untouched frame as PNG next to the encoded file, for audit.
+    keep_lossless: bool = False
+    # Identical captures are stored once and linked into each task directory, and a frame whose
+    # perceptual hash is within this many bits of the last one sent to a chat is not uploaded
+    # again; negative disables both.
+    dedup_distance: int = -1
+
+    @property
+    def lossless(self) -> bool:
+        return (
+            self.format == "png"
+            and not (self.grayscale or self.crop_active_window or self.max_edge or self.max_bytes)
+        )
+
+
+@dataclass(frozen=True)
+class Frame:
+    # BGRA pixels as a read-only (height, width, 4) view over the grabbed buffer. Encoders, hashers
+    # and OCR can all share it; slicing it (crops, sampling grids) does not copy either.
+    pixels: np.ndarray
+    left: int
+    top: int
+
+    @property
+    def width(self) -> int:
+        return self.pixels.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self.pixels.shape[0]
+
+    @property
+    def size(self) -> tuple[int, int]:
+        return self.width, self.height
+
+
+# SM_XVIRTUALSCREEN, SM_YVIRTUALSCREEN, SM_CXVIRTUALSCREEN, SM_CYVIRTUALSCREEN, SM_CMONITORS
+_LAYOUT_METRICS = (76, 77, 78, 79, 80)
+
+
+def _virtual_screen_signature() -> Hashable:
+    # A handful of GetSystemMetrics calls, cheap enough for every grab. None where unavailable,
+    # which leaves only the TTL and grab errors to notice layout changes.
+    try:
+        user32 = ctypes.windll.user32  # type: ignore[attr-defined]
+    except AttributeError:
+        return None
+    return tuple(user32.GetSystemMetrics(metric) for metric in _LAYOUT_METRICS)
+
+
+class ScreenGrabber:
+    # Keeps one mss handle per thread (mss handles must stay on the thread that opened them) and a
+    # shared monitor layout that is re-enumerated after layout_ttl_seconds, on invalidate(), when
+    # the virtual screen's bounds or monitor count change, when a requested monitor no longer
+    # exists, or after a failed grab.
+    def __init__(
+        self,
+        layout_ttl_seconds: float = 30.0,
+        layout_signature: Callable[[], Hashable] = _virtual_screen_signature,
+    ) -> None:
+        self.layout_ttl_seconds = layout_ttl_seconds
+        self.layout_signature = layout_signature
+        self._local = threading.local()
+        self._handles: list[Any] = []
+        self._layout: list[dict[str, int]] | None = None
+        self._layout_at = 0.0
+        self._signature: Hashable = None
+        self._lock = threading.Lock()
+
+    def _handle(self) -> Any:
+        sct = getattr(self._local, "sct", None)
+        if sct is None:
+            sct = mss.mss()
+            self._local.sct = sct
+            with self._lock:
+                self._handles.append(sct)
+        return sct
+
+    def monitors(self) -> list[dict[str, int]]:
+        # Index 0 is the virtual screen spanning every monitor, as in mss.
+        signature = self.layout_signature()
+        with self._lock:
+            layout = self._layout
+            if (
+                layout is not None
+                and signature == self._signature
+                and time.monotonic() - self._layout_at <= self.layout_ttl_seconds
+            ):
+                return layout
+        # A short-lived handle: mss caches the layout inside each handle for its lifetime.
+        with mss.mss() as sct:
+            layout = [dict(monitor) for monitor in sct.monitors]
+        with self._lock:
+            self._layout, self._layout_at, self._signature = layout, time.monotonic(), signature
+        return layout
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._layout = None
+
+    def grab(self, monitor_index: int = 0) -> Frame:
+        monitors = self.monitors()
+        if monitor_index >= len(monitors):
+            self.invalidate()
+            monitors = self.monitors()
+        monitor = monitors[monitor_index]
+        try:
+            screenshot = self._handle().grab(monitor)
+        except Exception:  # noqa: BLE001
+            # Usually a monitor that went away; retry once with a fresh handle and layout.
+            self._drop_handle()
+            self.invalidate()
+            monitors = self.monitors()
+            if monitor_index >= len(monitors):
+                raise
+            monitor = monitors[monitor_index]
+            screenshot = self._handle().grab(monitor)
+        width, height = screenshot.size
+        pixels = np.frombuffer(screenshot.raw, dtype=np.uint8).reshape(height, width, 4)
+        pixels.flags.writeable = False
+        return Frame(pixels, monitor["left"], monitor["top"])
+
+    def _drop_handle(self) -> None:
+        sct = getattr(self._local, "sct", None)
+        if sct is None:
+            return
+        self._local.sct = None
+        with self._lock:
+            if sct in self._handles:
+                self._handles.remove(sct)
+        try:
+            sct.close()
+        except Exception:  # noqa: BLE001
+            pass
+
+    def close(self) -> None:
+        with self._lock:
+            handles, self._handles = self._handles, []
+        for sct in handles:
+            sct.close()
+        self._local = threading.local()
+
+
+_grabber = ScreenGrabber()
+
+
+def grabber() -> ScreenGrabber:
+    return _grabber
+
+
+_options = EncodeOptions()
+# Sent frames are encoded on the calling (task) thread, which waits for them anyway; only the
+# lossless copies nobody waits for go to a background thread of their own.
+_lossless_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="screen-lossless")
+
+
+def configure(options: EncodeOptions) -> None:
+    global _options
+    _options = options
+
+
+def _active_window_box(frame: Frame) -> tuple[int, int, int, int] | None:
+    from telegram_agent.app.tools.system import active_window
+
+    rect = active_window().get("rect") or {}
+    if not rect:
+        return None
+    left = max(rect["left"] - frame.left, 0)
+    top = max(rect["top"] - frame.top, 0)
+    right = min(rect["right"] - frame.left, frame.width)
+    bottom = min(rect["bottom"] - frame.top, frame.height)
+    if right <= left or bottom <= top:
+        return None
+    return left, top, right, bottom
+
+
+def _save(image: Image.Image, options: EncodeOptions, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    if options.format == "jpeg":
+        image.save(buffer, "JPEG", quality=quality)
+    elif options.format == "webp":
+        image.save(buffer, "WEBP", quality=quality, method=4)
+    else:
+        image.save(buffer, "PNG", compress_level=3)
+    return buffer.getvalue()
+
+
+def encode_frame(
+    bgra: Any,
+    size: tuple[int, int],
+    options: EncodeOptions,
+    box: tuple[int, int, int, int] | None = None,
+) -> bytes:
+    image = Image.frombuffer("RGB", size, bgra, "raw", "BGRX", 0, 1)
+    if box is not None:
+        image = image.crop(box)
+    if options.grayscale:
+        image = image.convert("L")
+    if options.max_edge and max(image.size) > options.max_edge:
+        image.thumbnail((options.max_edge, options.max_edge), Image.Resampling.BILINEAR)
+
+    quality = options.quality
+    data = _save(image, options, quality)
+    for _ in range(_BUDGET_ATTEMPTS):
+        if not options.max_bytes or len(data) <= options.max_bytes:
+            break
+        if options.format != "png" and quality > _MIN_QUALITY:
+            quality = max(_MIN_QUALITY, quality - 20)
+        else:
+            image = image.resize((max(1, image.width // 2), max(1, image.height // 2)), Image.Resampling.BILINEAR)
+        data = _save(image, options, quality)
+    return data
+
+
+def _write_lossless(frame: Frame, path: str) -> None:
+    Image.frombuffer("RGB", frame.size, frame.pixels, "raw", "BGRX", 0, 1).save(path, "PNG")
 
 
 def capture_screen(
@@ -14,15 +259,60 @@ def capture_screen(
     label: str = "step",
     monitor_index: int = 0,
 ) -> str:
+    options = _options
     task_dir = Path(audit_dir) / task_id
     task_dir.mkdir(parents=True, exist_ok=True)
-    timestamp = time.strftime("%Y%m%d_%H%M%S")
-    filename = f"{task_id}_{label}_{timestamp}.png"
-    path = os.path.join(task_dir, filename)
+    now = time.time()
+    # Milliseconds plus a random suffix: two captures in the same task and second, e.g. back-to-back
+    # /shot commands, must never share a file name.
+    timestamp = f"{time.strftime('%Y%m%d_%H%M%S', time.localtime(now))}_{int(now * 1000) % 1000:03d}"
+    stem = f"{task_id}_{label}_{timestamp}_{uuid.uuid4().hex[:6]}"
+    path = os.path.join(task_dir, f"{stem}.{_EXTENSIONS[options.format]}")
 
-    with mss.mss() as sct:
-        monitor = sct.monitors[monitor_index]
-        screenshot = sct.grab(monitor)
-        mss.tools.to_png(screenshot.rgb, screenshot.size, output=path)
+    frame = _grabber.grab(monitor_index)
+    box = _active_window_box(frame) if options.crop_active_window else None
 
+    if options.keep_lossless and not options.lossless:
+        # Nobody waits for the lossless copy; it only has to land on disk eventually.
+        _lossless_pool.submit(_write_lossless, frame, os.path.join(task_dir, f"{stem}_lossless.png"))
+    if options.dedup_distance < 0:
+        Path(path).write_bytes(encode_frame(frame.pixels, frame.size, options, box))
+        return path
+
+    pixels = frame.pixels if box is None else frame.pixels[box[1] : box[3], box[0] : box[2]]
+    phash = shots.dhash(pixels)
+    key = _content_key(frame, options, box)
+    store = shots.store(audit_dir)
+    blob = store.find(key)
+    if blob is None:
+        data = encode_frame(frame.pixels, frame.size, options, box)
+        blob = store.add(key, data, _EXTENSIONS[options.format])
+    path = os.path.join(task_dir, f"{stem}{blob.suffix}")
+    try:
+        store.link(blob, Path(path), phash)
+    except FileNotFoundError:
+        # Retention pruned the blob between the lookup and the link.
+        data = encode_frame(frame.pixels, frame.size, options, box)
+        store.link(store.add(key, data, blob.suffix[1:]), Path(path), phash)
     return path
+
+
+def _content_key(frame: Frame, options: EncodeOptions, box: tuple[int, int, int, int] | None) -> str:
+    # Exact identity of what would be encoded: every pixel of the grabbed frame plus the settings
+    # and crop box that shape the output, so a stored blob is only reused for the same image.
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(repr((frame.size, box, options.format, options.quality, options.max_edge)).encode("ascii"))
+    digest.update(repr((options.grayscale, options.max_bytes)).encode("ascii"))
+    digest.update(np.ascontiguousarray(frame.pixels).data)
+    return digest.hexdigest()
+
+
+def screen_fingerprint(monitor_index: int = 0, step: int = 8) -> str:
+    # Hashes every ``step``-th pixel of every ``step``-th row: cheap enough to run before each
+    # /do, and blind to changes smaller than the sampling grid (e.g. a blinking caret).
+    frame = _grabber.grab(monitor_index)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{frame.width}x{frame.height}".encode("ascii"))
+    # Only the sampled grid is copied, to make it contiguous for hashing.
+    digest.update(np.ascontiguousarray(frame.pixels[::step, ::step]).data)
+    return digest.hexdigest()
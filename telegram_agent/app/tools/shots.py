@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import errno
+import json
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+_HASH_COLUMNS = 9
+_HASH_ROWS = 8
+# Stride used to thin the frame before averaging; the hash only needs a 9x8 grid.
+_SAMPLE_STEP = 4
+_REMEMBERED_PATHS = 1024
+# os.link failures that mean the filesystem cannot hard-link this pair, not that something is wrong.
+_NO_HARD_LINKS = {errno.EXDEV, errno.EPERM, errno.ENOTSUP}
+
+
+def dhash(pixels: np.ndarray) -> int:
+    # Difference hash of a (height, width, 4) BGRA frame: mean brightness of a 9x8 grid of blocks,
+    # one bit per horizontally adjacent pair. The green channel stands in for luminance.
+    gray = pixels[::_SAMPLE_STEP, ::_SAMPLE_STEP, 1]
+    if gray.shape[0] < _HASH_ROWS or gray.shape[1] < _HASH_COLUMNS:
+        # Too small to thin out: pick the grid's pixels directly (repeating them if need be).
+        rows = np.linspace(0, pixels.shape[0] - 1, _HASH_ROWS).round().astype(int)
+        columns = np.linspace(0, pixels.shape[1] - 1, _HASH_COLUMNS).round().astype(int)
+        grid = pixels[rows][:, columns, 1].astype(np.float32)
+    else:
+        block_h = gray.shape[0] // _HASH_ROWS
+        block_w = gray.shape[1] // _HASH_COLUMNS
+        gray = gray[: block_h * _HASH_ROWS, : block_w * _HASH_COLUMNS].astype(np.float32)
+        grid = gray.reshape(_HASH_ROWS, block_h, _HASH_COLUMNS, block_w).mean(axis=(1, 3))
+    bits = (grid[:, 1:] > grid[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(left: int, right: int) -> int:
+    return bin(left ^ right).count("1")
+
+
+class ShotStore:
+    # Content-addressed screenshots under <audit_dir>/shots: a blob is only shared between tasks
+    # when the captured content is identical (the key is a digest of pixels and encode settings).
+    # Task directories hold hard links to the stored files, so a blob whose link count drops back
+    # to 1 is referenced by no task any more and can be pruned. The perceptual hash of each linked
+    # path is remembered for SentFrames only; it never decides what is stored.
+    def __init__(self, audit_dir: str) -> None:
+        self.root = Path(audit_dir) / "shots"
+        self.index_path = self.root / "index.jsonl"
+        self._entries: dict[str, Path] = {}
+        self._paths: OrderedDict[str, int] = OrderedDict()
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        if not self.index_path.exists():
+            return
+        for line in self.index_path.read_text(encoding="utf-8").splitlines():
+            try:
+                entry = json.loads(line)
+                key, blob = entry["key"], self.root / entry["file"]
+            except (json.JSONDecodeError, KeyError, TypeError):
+                continue
+            if blob.exists():
+                self._entries[key] = blob
+
+    def find(self, key: str) -> Path | None:
+        with self._lock:
+            return self._entries.get(key)
+
+    def add(self, key: str, data: bytes, extension: str) -> Path:
+        blob = self.root / key[:2] / f"{key}.{extension}"
+        with self._lock:
+            if blob.exists():
+                return blob
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            blob.write_bytes(data)
+            known = key in self._entries
+            self._entries[key] = blob
+            if known:
+                return blob
+            with self.index_path.open("a", encoding="utf-8") as index:
+                index.write(json.dumps({"key": key, "file": blob.relative_to(self.root).as_posix()}) + "\n")
+        return blob
+
+    def link(self, blob: Path, target: Path, phash: int) -> None:
+        # Linked under a temporary name and moved into place, so an existing target is replaced
+        # rather than written through: writing into it would rewrite the blob it may be linked to.
+        temporary = target.with_name(f".{target.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            os.link(blob, temporary)
+        except OSError as exc:
+            if exc.errno not in _NO_HARD_LINKS:
+                raise
+            shutil.copyfile(blob, temporary)
+        try:
+            os.replace(temporary, target)
+        except OSError:
+            temporary.unlink(missing_ok=True)
+            raise
+        with self._lock:
+            self._paths[str(target)] = phash
+            while len(self._paths) > _REMEMBERED_PATHS:
+                self._paths.popitem(last=False)
+
+    def hash_for(self, path: str) -> int | None:
+        with self._lock:
+            return self._paths.get(str(path))
+
+    def prune(self) -> int:
+        # Removes blobs no task links to any more and rewrites the index; returns bytes freed.
+        freed = 0
+        with self._lock:
+            for key, blob in list(self._entries.items()):
+                try:
+                    stat = blob.stat()
+                except FileNotFoundError:
+                    del self._entries[key]
+                    continue
+                if stat.st_nlink <= 1:
+                    blob.unlink()
+                    freed += stat.st_size
+                    del self._entries[key]
+            if not self.root.exists():
+                return freed
+            lines = [
+                json.dumps({"key": key, "file": blob.relative_to(self.root).as_posix()}) + "\n"
+                for key, blob in self._entries.items()
+            ]
+            self.index_path.write_text("".join(lines), encoding="utf-8")
+        return freed
+
+
+_stores: dict[str, ShotStore] = {}
+_stores_lock = threading.Lock()
+
+
+def store(audit_dir: str) -> ShotStore:
+    key = os.path.abspath(audit_dir)
+    with _stores_lock:
+        shot_store = _stores.get(key)
+        if shot_store is None:
+            shot_store = ShotStore(audit_dir)
+            _stores[key] = shot_store
+        return shot_store
+
+
+class SentFrames:
+    # Remembers the hash of the last screenshot sent to each chat so a repeat can be skipped.
+    def __init__(self, distance: int) -> None:
+        self.distance = distance
+        self._last: dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def is_repeat(self, chat_id: int, phash: int) -> bool:
+        with self._lock:
+            last = self._last.get(chat_id)
+            if last is not None and hamming(last, phash) <= self.distance:
+                # Keep the sent frame as reference so slow drift still ends up being sent.
+                return True
+            self._last[chat_id] = phash
+            return False
@@ -3,16 +3,17 @@ from __future__ import annotations
 import ctypes
 from typing import Any
 
-import mss
 import psutil
 from pywinauto import Desktop
 
+from telegram_agent.app.tools import screen as screen_tools
+
 
 def active_window() -> dict[str, Any]:
     try:
         window = Desktop(backend="uia").get_active()
     except Exception:
-        return {"title": "", "process": {}, "rect": {}}
+        return {"title": "", "handle": None, "process": {}, "rect": {}}
 
     title = window.window_text()
     pid = window.process_id()
@@ -32,7 +33,12 @@ def active_window() -> dict[str, Any]:
         "height": rect.height(),
     }
 
-    return {"title": title, "process": {"pid": pid, "name": process_name}, "rect": rect_payload}
+    return {
+        "title": title,
+        "handle": window.handle,
+        "process": {"pid": pid, "name": process_name},
+        "rect": rect_payload,
+    }
 
 
 def _system_dpi_scale() -> float:
@@ -45,8 +51,7 @@ def _system_dpi_scale() -> float:
 
 
 def display_info() -> dict[str, Any]:
-    with mss.mss() as sct:
-        monitors = sct.monitors
+    monitors = screen_tools.grabber().monitors()
 
     monitor_payloads = []
     for monitor in monitors[1:]:
@@ -1,12 +1,19 @@
 from __future__ import annotations
 
 import time
-from difflib import SequenceMatcher
+from itertools import islice
+from typing import Callable, Hashable, Iterable, Iterator
 
 from pywinauto import Desktop
 from pywinauto.base_wrapper import BaseWrapper
 
+from telegram_agent.app import cancellation
+from telegram_agent.app.tools import uia_index, windows
+from telegram_agent.app.tools.uia_index import Element, SnapshotCache
+from telegram_agent.app.tools.windows import WindowInfo, WindowRegistry
+
 DEFAULT_MAX_DUMP_NODES = 200
+DUMP_FIELDS = ("name", "control_type", "automation_id", "rect", "enabled", "visible")
 
 
 def _rect_payload(wrapper: BaseWrapper) -> dict[str, int]:
@@ -21,82 +28,123 @@ def _rect_payload(wrapper: BaseWrapper) -> dict[str, int]:
     }
 
 
-def _node_payload(wrapper: BaseWrapper) -> dict[str, object]:
-    return {
-        "name": wrapper.window_text(),
-        "control_type": wrapper.element_info.control_type,
-        "automation_id": wrapper.element_info.automation_id,
-        "rect": _rect_payload(wrapper),
-        "enabled": wrapper.is_enabled(),
-        "visible": wrapper.is_visible(),
-    }
+# One cross-process call each; a dump only pays for the fields it asks for.
+_PROPERTIES: dict[str, Callable[[BaseWrapper], object]] = {
+    "name": lambda wrapper: wrapper.window_text(),
+    "control_type": lambda wrapper: wrapper.element_info.control_type,
+    "automation_id": lambda wrapper: wrapper.element_info.automation_id,
+    "rect": _rect_payload,
+    "enabled": lambda wrapper: wrapper.is_enabled(),
+    "visible": lambda wrapper: wrapper.is_visible(),
+}
 
 
-def _resolve_window(window_title_substring: str | None) -> BaseWrapper:
-    desktop = Desktop(backend="uia")
-    if window_title_substring:
-        target = window_title_substring.lower()
-        for window in desktop.windows():
-            if target in window.window_text().lower():
-                return window
-        raise RuntimeError(f"Unable to find window with title containing '{window_title_substring}'")
-    return desktop.get_active()
+def _node_payload(wrapper: BaseWrapper, fields: Iterable[str] = DUMP_FIELDS) -> dict[str, object]:
+    return {field: _PROPERTIES[field](wrapper) for field in fields}
 
 
-def dump(window_title_substring: str | None = None, max_items: int = DEFAULT_MAX_DUMP_NODES) -> list[dict[str, object]]:
-    window = _resolve_window(window_title_substring)
-    results: list[dict[str, object]] = []
+class _PywinautoWindows:
+    def scan(self) -> Iterator[tuple[WindowInfo, BaseWrapper]]:
+        for window in Desktop(backend="uia").windows():
+            try:
+                yield WindowInfo(window.handle, window.window_text(), window.process_id()), window
+            except Exception:  # noqa: BLE001
+                # Closed between enumeration and the property reads.
+                continue
+
+    def title(self, window: BaseWrapper) -> str:
+        return window.window_text()
 
-    def walk(wrapper: BaseWrapper) -> None:
-        if len(results) >= max_items:
-            return
-        results.append(_node_payload(wrapper))
-        for child in wrapper.children():
-            walk(child)
-            if len(results) >= max_items:
-                return
 
-    walk(window)
-    return results
+_windows = WindowRegistry(_PywinautoWindows())
+
+
+def _resolve_window(window_title_substring: str | None) -> BaseWrapper:
+    if window_title_substring:
+        window = _windows.find(window_title_substring)
+        if window is None:
+            raise RuntimeError(f"Unable to find window with title containing '{window_title_substring}'")
+        return window
+    return Desktop(backend="uia").get_active()
+
+
+def iter_nodes(
+    window: BaseWrapper,
+    fields: Iterable[str] = DUMP_FIELDS,
+    max_depth: int | None = None,
+    control_types: Iterable[str] | None = None,
+) -> Iterator[dict[str, object]]:
+    # Breadth-first; "depth" and "path" (usable with click_path) cost no UIA calls. With a role
+    # filter, other nodes are still descended into but not reported.
+    fields = tuple(fields)
+    unknown = [field for field in fields if field not in _PROPERTIES and field not in ("depth", "path")]
+    if unknown:
+        raise ValueError(f"Unknown UIA dump fields: {', '.join(unknown)}")
+    wanted = {control_type.lower() for control_type in control_types} if control_types else None
+    for wrapper, depth, path in uia_index.walk(window, lambda node: node.children(), max_depth):
+        payload: dict[str, object] = {}
+        if wanted is not None:
+            control_type = wrapper.element_info.control_type
+            if (control_type or "").lower() not in wanted:
+                continue
+            payload["control_type"] = control_type
+        for field in fields:
+            if field == "depth":
+                payload[field] = depth
+            elif field == "path":
+                payload[field] = path
+            elif field not in payload:
+                payload[field] = _PROPERTIES[field](wrapper)
+        yield {field: payload[field] for field in fields}
+
+
+def _compact_rect(rect: dict[str, int]) -> list[int]:
+    return [rect["left"], rect["top"], rect["right"], rect["bottom"]]
+
+
+def dump(
+    window_title_substring: str | None = None,
+    max_items: int = DEFAULT_MAX_DUMP_NODES,
+    max_depth: int | None = None,
+    control_types: list[str] | None = None,
+    fields: list[str] | None = None,
+    compact: bool = False,
+) -> list[dict[str, object]] | dict[str, object]:
+    window = _resolve_window(window_title_substring)
+    fields = list(fields or DUMP_FIELDS)
+    nodes = islice(iter_nodes(window, fields, max_depth, control_types), max_items)
+    if not compact:
+        return list(nodes)
+    if "rect" in fields:
+        nodes = ({**node, "rect": _compact_rect(node["rect"])} for node in nodes)
+    return uia_index.columnar(nodes, fields)
 
 
 def focus_window(title_substring: str) -> bool:
-    desktop = Desktop(backend="uia")
-    for window in desktop.windows():
-        if title_substring.lower() in window.window_text().lower():
-            window.set_focus()
-            return True
-    return False
+    window = _windows.find(title_substring)
+    if window is None:
+        return False
+    window.set_focus()
+    windows.focus_changed()
+    return True
 
 
-def _find_candidates(window: BaseWrapper, control_type: str | None = None) -> list[BaseWrapper]:
-    if control_type:
-        return window.descendants(control_type=control_type)
-    return window.descendants()
+class _PywinautoTree:
+    def window_key(self, window: BaseWrapper) -> Hashable:
+        # The top-level child count catches dialogs and panes appearing inside the same window.
+        return (window.handle, window.window_text(), len(window.children()))
 
+    def elements(self, window: BaseWrapper) -> Iterator[Element]:
+        for wrapper in window.descendants():
+            yield Element(wrapper.window_text() or "", wrapper.element_info.control_type, wrapper)
 
-def _best_text_match(window: BaseWrapper, text: str, control_type: str | None) -> BaseWrapper | None:
-    text_lower = text.lower()
-    best_score = 0.0
-    best = None
 
-    for candidate in _find_candidates(window, control_type):
-        name = candidate.window_text() or ""
-        if not name:
-            continue
-        name_lower = name.lower()
-        score = 0.0
-        if text_lower in name_lower:
-            score = 1.0
-        else:
-            score = SequenceMatcher(None, text_lower, name_lower).ratio()
-        if score > best_score:
-            best_score = score
-            best = candidate
+_snapshots = SnapshotCache(_PywinautoTree())
 
-    if best_score < 0.4:
-        return None
-    return best
+
+def _best_text_match(window: BaseWrapper, text: str, control_type: str | None) -> BaseWrapper | None:
+    match = _snapshots.get(window).best_match(text, control_type)
+    return None if match is None else match.ref
 
 
 def click_text(
@@ -108,15 +156,16 @@ def click_text(
     deadline = time.monotonic() + timeout_seconds
     candidate = None
     while time.monotonic() <= deadline:
+        cancellation.check()
         try:
             window = _resolve_window(window_title_substring)
         except RuntimeError:
-            time.sleep(0.2)
+            cancellation.sleep(0.2)
             continue
         candidate = _best_text_match(window, text, control_type)
         if candidate is not None:
             break
-        time.sleep(0.2)
+        cancellation.sleep(0.2)
 
     if candidate is None:
         message = f"Unable to find UIA element matching text '{text}'"
@@ -126,6 +175,7 @@ def click_text(
             message += f" in window containing '{window_title_substring}'"
         raise RuntimeError(message)
     candidate.click_input()
+    _snapshots.invalidate()
     return _node_payload(candidate)
 
 
@@ -135,6 +185,7 @@ def click_automation_id(automation_id: str) -> None:
     if not matches:
         raise RuntimeError(f"Unable to find UIA element with automation_id '{automation_id}'")
     matches[0].click_input()
+    _snapshots.invalidate()
 
 
 def click_path(path: str) -> None:
@@ -151,3 +202,4 @@ def click_path(path: str) -> None:
             raise RuntimeError(f"UIA path '{path}' is out of range at segment '{part}'")
         node = children[index]
     node.click_input()
+    _snapshots.invalidate()
@@ -0,0 +1,238 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import Counter, deque
+from dataclasses import dataclass
+from difflib import SequenceMatcher
+from typing import Any, Callable, Hashable, Iterable, Iterator, Protocol
+
+import numpy as np
+
+MIN_TEXT_SCORE = 0.4
+# Trigram candidates scored with SequenceMatcher before the exhaustive pass, to raise its bar early.
+_RERANK = 16
+
+
+@dataclass(frozen=True)
+class Element:
+    name: str
+    control_type: str
+    # Whatever the provider needs to act on the element later (a pywinauto wrapper, a test node).
+    ref: Any = None
+
+
+class TreeProvider(Protocol):
+    def window_key(self, window: Any) -> Hashable:
+        # Cheap identity of the window's current state; a new key invalidates its snapshot.
+        ...
+
+    def elements(self, window: Any) -> Iterable[Element]:
+        ...
+
+
+def _trigrams(text: str) -> set[str]:
+    padded = f"  {text} "
+    return {padded[index : index + 3] for index in range(len(padded) - 2)}
+
+
+class Snapshot:
+    # Immutable name index over one walk of a window's tree: trigram postings as numpy arrays, so a
+    # query touches only the postings of its own trigrams instead of every element.
+    def __init__(self, elements: list[Element]) -> None:
+        self.elements = elements
+        self.created_at = time.monotonic()
+        self._names = [element.name.lower() for element in elements]
+        control_types = sorted({element.control_type for element in elements})
+        self._control_type_ids = {control_type: index for index, control_type in enumerate(control_types)}
+        self._control_types = np.array(
+            [self._control_type_ids[element.control_type] for element in elements], dtype=np.int32
+        )
+        self._named = np.array([bool(name) for name in self._names], dtype=bool)
+        self._lengths = np.array([len(name) for name in self._names], dtype=np.float64)
+
+        postings: dict[str, list[int]] = {}
+        char_postings: dict[str, tuple[list[int], list[int]]] = {}
+        gram_counts = np.zeros(len(elements), dtype=np.float32)
+        for index, name in enumerate(self._names):
+            if not name:
+                continue
+            grams = _trigrams(name)
+            gram_counts[index] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(index)
+            for char, count in Counter(name).items():
+                ids, counts = char_postings.setdefault(char, ([], []))
+                ids.append(index)
+                counts.append(count)
+        self._postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+        self._gram_counts = gram_counts
+        # Per-character (element ids, counts), enough to compute quick_ratio for every name at once.
+        self._char_postings = {
+            char: (np.array(ids, dtype=np.int32), np.array(counts, dtype=np.float64))
+            for char, (ids, counts) in char_postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.elements)
+
+    def search(
+        self, text: str, control_type: str | None = None, limit: int = 1, min_score: float = 0.0
+    ) -> list[tuple[float, Element]]:
+        # Same results as scoring every element the way the old linear scan did (1.0 when the query
+        # is a substring of the name, otherwise the SequenceMatcher ratio), ties going to the
+        # earlier element. Trigram candidates are scored first to get a good bar early; the rest
+        # are only scored when their length bound and quick_ratio can still reach that bar.
+        # Results below min_score are not wanted, which lets the bar start there.
+        query = text.lower()
+        grams = _trigrams(query)
+        shared = np.zeros(len(self.elements), dtype=np.float32)
+        for gram in grams:
+            ids = self._postings.get(gram)
+            if ids is not None:
+                shared[ids] += 1
+        mask = self._named.copy()
+        if control_type is not None:
+            type_id = self._control_type_ids.get(control_type)
+            if type_id is None:
+                return []
+            mask &= self._control_types == type_id
+
+        scored: dict[int, float] = {}
+        # A name containing the query has all of its unpadded trigrams; queries shorter than a
+        # trigram have none, so every element of the right type stays a substring candidate.
+        interior = len({query[index : index + 3] for index in range(len(query) - 2)})
+        substring_candidates = np.flatnonzero(mask & (shared >= interior)) if interior else np.flatnonzero(mask)
+        for index in substring_candidates.tolist():
+            if query in self._names[index]:
+                scored[index] = 1.0
+
+        if len(scored) < limit:
+            candidates = np.flatnonzero(mask & (shared > 0))
+            # Dice coefficient on trigram sets as the vectorised pre-score.
+            dice = 2 * shared[candidates] / (len(grams) + self._gram_counts[candidates])
+            for index in candidates[np.argsort(-dice, kind="stable")[:_RERANK]].tolist():
+                if index not in scored:
+                    scored[index] = SequenceMatcher(None, query, self._names[index]).ratio()
+            self._complete(query, mask, scored, limit, min_score)
+
+        ranked = sorted(
+            ((index, score) for index, score in scored.items() if score >= min_score),
+            key=lambda item: (-item[1], item[0]),
+        )[:limit]
+        return [(score, self.elements[index]) for index, score in ranked]
+
+    def _complete(self, query: str, mask: np.ndarray, scored: dict[int, float], limit: int, min_score: float) -> None:
+        # Scores every remaining element that could still make the top ``limit``. The ratio is
+        # 2 * matches / (len(a) + len(b)), and matches cannot exceed the shared character counts,
+        # which is SequenceMatcher.quick_ratio() computed here for all names at once.
+        best = sorted(scored.values(), reverse=True)
+        bar = max(min_score, best[limit - 1] if len(best) >= limit else 0.0)
+        shared = np.zeros(len(self.elements), dtype=np.float64)
+        for char, count in Counter(query).items():
+            postings = self._char_postings.get(char)
+            if postings is not None:
+                ids, counts = postings
+                shared[ids] += np.minimum(counts, count)
+        bound = 2 * shared / (self._lengths + len(query))
+        remaining = mask & (bound >= bar)
+        if scored:
+            remaining[list(scored)] = False
+        candidates = np.flatnonzero(remaining)
+        # Most promising first, so the bar rises quickly; ties keep index order.
+        candidates = candidates[np.argsort(-bound[candidates], kind="stable")]
+        # ratio() depends on argument order; the query stays first, as in the scan it replaces.
+        matcher = SequenceMatcher(None, query, "")
+        for index in candidates.tolist():
+            if bound[index] < bar:
+                break
+            matcher.set_seq2(self._names[index])
+            score = matcher.ratio()
+            scored[index] = score
+            if score >= bar:
+                best.append(score)
+                best.sort(reverse=True)
+                bar = max(min_score, best[limit - 1] if len(best) >= limit else 0.0)
+
+    def best_match(self, text: str, control_type: str | None = None) -> Element | None:
+        results = self.search(text, control_type, limit=1, min_score=MIN_TEXT_SCORE)
+        if not results or results[0][0] < MIN_TEXT_SCORE:
+            return None
+        return results[0][1]
+
+
+class SnapshotCache:
+    # Keeps the latest snapshot per window key. A snapshot is rebuilt when the provider reports a
+    # different key, after max_age_seconds, or after invalidate() (e.g. once something was clicked).
+    def __init__(self, provider: TreeProvider, max_age_seconds: float = 1.0, max_windows: int = 8) -> None:
+        self.provider = provider
+        self.max_age_seconds = max_age_seconds
+        self.max_windows = max_windows
+        self._snapshots: dict[Hashable, Snapshot] = {}
+        self._lock = threading.Lock()
+
+    def get(self, window: Any) -> Snapshot:
+        key = self.provider.window_key(window)
+        with self._lock:
+            snapshot = self._snapshots.get(key)
+        if snapshot is not None and time.monotonic() - snapshot.created_at <= self.max_age_seconds:
+            return snapshot
+        snapshot = Snapshot(list(self.provider.elements(window)))
+        with self._lock:
+            self._snapshots[key] = snapshot
+            while len(self._snapshots) > self.max_windows:
+                self._snapshots.pop(next(iter(self._snapshots)))
+        return snapshot
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._snapshots.clear()
+
+
+def walk(
+    root: Any, children: Callable[[Any], Iterable[Any]], max_depth: int | None = None
+) -> Iterator[tuple[Any, int, str]]:
+    # Breadth-first (node, depth, path) triples; path is the click_path form ("root", "0/2", ...).
+    # A node's children are only fetched once it is reached, so a consumer that stops early never
+    # pays for the subtrees it did not look at.
+    pending: deque[tuple[Any, int, str]] = deque([(root, 0, "root")])
+    while pending:
+        node, depth, path = pending.popleft()
+        yield node, depth, path
+        if max_depth is not None and depth >= max_depth:
+            continue
+        prefix = "" if depth == 0 else f"{path}/"
+        for index, child in enumerate(children(node)):
+            pending.append((child, depth + 1, f"{prefix}{index}"))
+
+
+def columnar(nodes: Iterable[dict[str, Any]], fields: Iterable[str]) -> dict[str, Any]:
+    # Parallel arrays instead of one dict per node; control types are interned into a lookup table.
+    fields = list(fields)
+    columns: dict[str, list[Any]] = {field: [] for field in fields}
+    control_types: dict[str, int] = {}
+    count = 0
+    for row in nodes:
+        count += 1
+        for field in fields:
+            value = row.get(field)
+            if field == "control_type":
+                value = control_types.setdefault(value, len(control_types))
+            columns[field].append(value)
+    encoded: dict[str, Any] = {"format": "columnar", "count": count, "columns": columns}
+    if "control_type" in columns:
+        encoded["control_types"] = list(control_types)
+    return encoded
+
+
+def rows(encoded: dict[str, Any]) -> list[dict[str, Any]]:
+    # Inverse of columnar(), for readers that want one dict per node back.
+    columns = encoded["columns"]
+    control_types = encoded.get("control_types", [])
+    decoded = []
+    for index in range(encoded["count"]):
+        row = {field: values[index] for field, values in columns.items()}
+        if "control_type" in row:
+            row["control_type"] = control_types[row["control_type"]]
+        decoded.append(row)
+    return decoded
@@ -0,0 +1,12 @@
+from __future__ import annotations
+
+import asyncio
+
+
+async def sleep(seconds: float) -> None:
+    # Runs on the event loop; /cancel and the task timeout interrupt it by cancelling the step.
+    if seconds < 0:
+        raise ValueError("seconds must be non-negative")
+    if seconds > 30:
+        raise ValueError("seconds must be <= 30")
+    await asyncio.sleep(seconds)
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Iterable, Protocol
+
+# Bumped whenever keyboard/mouse input may have changed focus; every registry rescans after it.
+_generation = 0
+
+
+def focus_changed(*_: object) -> None:
+    global _generation
+    _generation += 1
+
+
+@dataclass(frozen=True)
+class WindowInfo:
+    handle: int
+    title: str
+    pid: int
+
+
+class WindowProvider(Protocol):
+    def scan(self) -> Iterable[tuple[WindowInfo, Any]]:
+        # Full enumeration of the top-level windows.
+        ...
+
+    def title(self, window: Any) -> str:
+        # Current title of one window; raises if the window no longer exists.
+        ...
+
+
+class WindowRegistry:
+    # Caches the top-level window list so repeated title lookups within a plan skip enumerating
+    # the desktop. A hit is confirmed with one title read; a window that is gone or renamed, an
+    # expired list, or a focus change since the last scan falls back to a fresh scan.
+    def __init__(self, provider: WindowProvider, ttl_seconds: float = 2.0) -> None:
+        self.provider = provider
+        self.ttl_seconds = ttl_seconds
+        self._windows: list[tuple[WindowInfo, Any]] = []
+        self._scanned_at = 0.0
+        self._scanned_generation = -1
+        self._lock = threading.Lock()
+
+    def find(self, title_substring: str) -> Any | None:
+        target = title_substring.lower()
+        window = self._find_cached(target)
+        if window is not None:
+            return window
+        for info, window in self._scan():
+            if target in info.title.lower():
+                return window
+        return None
+
+    def _fresh(self) -> bool:
+        return self._scanned_generation == _generation and time.monotonic() - self._scanned_at <= self.ttl_seconds
+
+    def _find_cached(self, target: str) -> Any | None:
+        with self._lock:
+            if not self._fresh():
+                return None
+            candidates = [window for info, window in self._windows if target in info.title.lower()]
+        for window in candidates:
+            try:
+                title = self.provider.title(window)
+            except Exception:  # noqa: BLE001
+                continue
+            if target in title.lower():
+                return window
+        return None
+
+    def _scan(self) -> list[tuple[WindowInfo, Any]]:
+        generation = _generation
+        windows = list(self.provider.scan())
+        with self._lock:
+            self._windows = windows
+            self._scanned_at = time.monotonic()
+            self._scanned_generation = generation
+        return windows
@@ -0,0 +1,63 @@
+"""Import-time benchmark for the bot and its tool backends.
+
+Each scenario runs in a fresh interpreter and reports the median wall time and
+which GUI backends ended up in ``sys.modules``. Run with:
+
+    python -m telegram_agent.tests.bench_imports
+"""
+
+from __future__ import annotations
+
+import json
+import statistics
+import subprocess
+import sys
+
+GUI_BACKENDS = ("mss", "psutil", "pyautogui", "pywinauto")
+
+SCENARIOS = {
+    "bot module (lazy registry)": "import telegram_agent.app.bot",
+    "--list-tools": "from telegram_agent.app.bot import _list_tools; _list_tools()",
+    "screen backend only": "import telegram_agent.app.bot\nfrom telegram_agent.app.tools import screen",
+    # What importing executor.py used to cost before its tools were registered lazily.
+    "every tool backend (eager)": (
+        "import telegram_agent.app.bot\n"
+        "from telegram_agent.app.tools import input, screen, system, uia"
+    ),
+}
+
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - started
+backends = [name for name in {backends!r} if name in sys.modules]
+print("@@" + json.dumps({{"ms": elapsed * 1000, "backends": backends}}))
+"""
+
+
+def run(code: str) -> dict[str, object]:
+    probe = _PROBE.format(code=code, backends=GUI_BACKENDS)
+    completed = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True)
+    if completed.returncode != 0:
+        return {"error": completed.stderr.strip().splitlines()[-1]}
+    for line in completed.stdout.splitlines():
+        if line.startswith("@@"):
+            return json.loads(line[2:])
+    return {"error": "no output"}
+
+
+def main(repeats: int = 5) -> None:
+    for name, code in SCENARIOS.items():
+        samples = [run(code) for _ in range(repeats)]
+        errors = [sample["error"] for sample in samples if "error" in sample]
+        if errors:
+            print(f"{name:30s} failed: {errors[0]}")
+            continue
+        median = statistics.median(float(sample["ms"]) for sample in samples)
+        backends = ", ".join(samples[0]["backends"]) or "none"
+        print(f"{name:30s} {median:8.1f} ms   GUI backends loaded: {backends}")
+
+
+if __name__ == "__main__":
+    main()
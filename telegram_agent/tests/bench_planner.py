@@ -0,0 +1,59 @@
+"""Planning throughput for chained /do commands.
+
+Times ``create_plan`` on commands with a growing number of ``then`` clauses and
+on random fuzz input. Run with:
+
+    python -m telegram_agent.tests.bench_planner
+"""
+
+from __future__ import annotations
+
+import random
+import statistics
+import time
+
+from telegram_agent.app.planner import PlanError, create_plan
+
+CLAUSES = [
+    "click_text Save As control_type=Button",
+    "type hello world",
+    "hotkey ctrl+s",
+    "wait 0.5",
+    "click 640 360",
+    'type "quoted then text"',
+    "click_path 0/2/1",
+]
+FUZZ_WORDS = ["then", "click", "type", "hotkey", "wait", "'", '"', "12", "ctrl+s", "地址栏", "x"]
+
+
+def _median_us(func, repeats: int = 200) -> float:
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1_000_000)
+    return statistics.median(samples)
+
+
+def main() -> None:
+    rng = random.Random(5)
+    print(f"{'clauses':>8s} {'chars':>6s} {'create_plan':>13s}")
+    for count in (1, 5, 20, 50):
+        command = " then ".join(rng.choice(CLAUSES) for _ in range(count))
+        elapsed = _median_us(lambda: create_plan(command))
+        print(f"{count:8d} {len(command):6d} {elapsed:10.1f} us")
+
+    commands = [" ".join(rng.choice(FUZZ_WORDS) for _ in range(rng.randint(1, 40))) for _ in range(10_000)]
+    rejected = 0
+    started = time.perf_counter()
+    for command in commands:
+        try:
+            create_plan(command)
+        except PlanError:
+            rejected += 1
+    elapsed = time.perf_counter() - started
+    print(f"\nfuzz: {len(commands)} commands in {elapsed * 1000:.1f} ms ({rejected} rejected)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Micro-benchmark for TaskQueue connection handling.
+
+Compares the pooled per-thread connections against opening a fresh connection
+per call (the previous behaviour). Run with:
+
+    python -m telegram_agent.tests.bench_queue
+"""
+
+from __future__ import annotations
+
+import sqlite3
+import tempfile
+import time
+from typing import Callable
+
+from telegram_agent.app.queue import TaskQueue
+
+
+class UnpooledTaskQueue(TaskQueue):
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+
+def _ops_per_second(operation: Callable[[int], object], iterations: int) -> float:
+    started = time.perf_counter()
+    for index in range(iterations):
+        operation(index)
+    return iterations / (time.perf_counter() - started)
+
+
+def run(queue_cls: type[TaskQueue], iterations: int) -> dict[str, float]:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with queue_cls(f"{tmpdir}/bench.sqlite") as queue:
+            task_ids: list[str] = []
+            results = {
+                "create": _ops_per_second(
+                    lambda index: task_ids.append(queue.create_task(1, 2, f"task {index}", "{}", 10)),
+                    iterations,
+                ),
+            }
+            results["approve"] = _ops_per_second(lambda index: queue.approve_task(task_ids[index]), iterations)
+            results["get"] = _ops_per_second(lambda index: queue.get_task(task_ids[index]), iterations)
+            results["list"] = _ops_per_second(lambda index: queue.list_recent(), iterations)
+    return results
+
+
+def main(iterations: int = 2000) -> None:
+    before = run(UnpooledTaskQueue, iterations)
+    after = run(TaskQueue, iterations)
+    print(f"{'op':<8} {'before ops/s':>14} {'after ops/s':>14} {'speedup':>8}")
+    for name in before:
+        print(f"{name:<8} {before[name]:>14.0f} {after[name]:>14.0f} {after[name] / before[name]:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
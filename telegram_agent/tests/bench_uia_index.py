@@ -0,0 +1,145 @@
+"""Benchmarks for UI-tree snapshots and dumps.
+
+Builds synthetic trees of increasing size, then times the old linear
+SequenceMatcher scan against building and querying a ``Snapshot``, and compares
+the old recursive dump with the breadth-first columnar one by property calls
+and JSON bytes. Run with:
+
+    python -m telegram_agent.tests.bench_uia_index
+"""
+
+from __future__ import annotations
+
+import json
+import random
+import statistics
+import time
+from difflib import SequenceMatcher
+from itertools import islice
+
+from telegram_agent.app.tools.uia_index import Element, Snapshot, columnar, walk
+
+WORDS = (
+    "file edit view insert format tools window help save open close print export import settings "
+    "options cancel apply ok next back finish search replace find zoom layout page table chart"
+).split()
+CONTROL_TYPES = ("Button", "MenuItem", "Text", "Edit", "ListItem", "TreeItem", "Pane")
+
+
+def synthetic_tree(size: int, seed: int = 7) -> list[Element]:
+    rng = random.Random(seed)
+    elements = []
+    for index in range(size):
+        name = " ".join(rng.choice(WORDS) for _ in range(rng.randint(0, 4))).title()
+        elements.append(Element(name, rng.choice(CONTROL_TYPES), index))
+    return elements
+
+
+def linear_best(elements: list[Element], text: str) -> Element | None:
+    query = text.lower()
+    best_score, best = 0.0, None
+    for element in elements:
+        name = element.name.lower()
+        if not name:
+            continue
+        score = 1.0 if query in name else SequenceMatcher(None, query, name).ratio()
+        if score > best_score:
+            best_score, best = score, element
+    return best if best_score >= 0.4 else None
+
+
+def _median_ms(func, repeats: int) -> float:
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+class FakeNode:
+    # Stands in for a pywinauto wrapper; every property read counts as one cross-process call.
+    calls = 0
+
+    def __init__(self, rng: random.Random, depth: int) -> None:
+        self.name = " ".join(rng.choice(WORDS) for _ in range(rng.randint(0, 3))).title()
+        self.control_type = rng.choice(CONTROL_TYPES)
+        self._children = [FakeNode(rng, depth + 1) for _ in range(rng.randint(2, 6))] if depth < 5 else []
+
+    def prop(self, value: object) -> object:
+        FakeNode.calls += 1
+        return value
+
+    def children(self) -> list[FakeNode]:
+        return self._children
+
+    def legacy_payload(self) -> dict[str, object]:
+        rect = self.prop({"left": 0, "top": 0, "right": 100, "bottom": 20, "width": 100, "height": 20})
+        return {
+            "name": self.prop(self.name),
+            "control_type": self.prop(self.control_type),
+            "automation_id": self.prop(""),
+            "rect": rect,
+            "enabled": self.prop(True),
+            "visible": self.prop(True),
+        }
+
+
+def legacy_dump(root: FakeNode, max_items: int) -> list[dict[str, object]]:
+    results: list[dict[str, object]] = []
+
+    def visit(node: FakeNode) -> None:
+        if len(results) >= max_items:
+            return
+        results.append(node.legacy_payload())
+        for child in node.children():
+            visit(child)
+            if len(results) >= max_items:
+                return
+
+    visit(root)
+    return results
+
+
+def compact_dump(root: FakeNode, max_items: int) -> dict[str, object]:
+    nodes = (
+        {
+            "name": node.prop(node.name),
+            "control_type": node.prop(node.control_type),
+            "automation_id": node.prop(""),
+            "rect": node.prop([0, 0, 100, 20]),
+            "path": path,
+        }
+        for node, _, path in walk(root, FakeNode.children)
+    )
+    return columnar(islice(nodes, max_items), ["name", "control_type", "automation_id", "rect", "path"])
+
+
+def bench_dump() -> None:
+    root = FakeNode(random.Random(3), 0)
+    print(f"\n{'dump':>24s} {'items':>6s} {'prop calls':>11s} {'json bytes':>11s} {'time':>10s}")
+    for max_items in (200, 2_000):
+        for name, dump in (("recursive, list of dicts", legacy_dump), ("bfs, columnar", compact_dump)):
+            FakeNode.calls = 0
+            started = time.perf_counter()
+            result = dump(root, max_items)
+            elapsed = (time.perf_counter() - started) * 1000
+            size = len(json.dumps(result, ensure_ascii=False))
+            print(f"{name:>24s} {max_items:6d} {FakeNode.calls:11d} {size:11d} {elapsed:7.2f} ms")
+
+
+def main() -> None:
+    queries = ["save", "Export Table", "setings", "zoom layot", "missing control"]
+    print(f"{'elements':>8s} {'linear/query':>14s} {'build':>10s} {'index/query':>13s}")
+    for size in (200, 2_000, 20_000):
+        elements = synthetic_tree(size)
+        linear = _median_ms(lambda: [linear_best(elements, query) for query in queries], 3) / len(queries)
+        build = _median_ms(lambda: Snapshot(elements), 3)
+        snapshot = Snapshot(elements)
+        indexed = _median_ms(lambda: [snapshot.best_match(query) for query in queries], 5) / len(queries)
+        print(f"{size:8d} {linear:11.2f} ms {build:7.2f} ms {indexed:10.3f} ms")
+    bench_dump()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+import asyncio
+import sqlite3
+import tempfile
+import threading
+
+from telegram_agent.app.async_queue import AsyncTaskQueue
+from telegram_agent.app.queue import TaskQueue
+
+
+def test_round_trips_run_on_the_db_thread() -> None:
+    async def scenario(queue: AsyncTaskQueue) -> tuple[str | None, set[str]]:
+        task_id = await queue.create_task(1, 2, "do something", "{}", 10)
+        assert await queue.approve_task(task_id)
+        threads = set(await asyncio.gather(*(queue._call(lambda: threading.current_thread().name) for _ in range(5))))
+        return await queue.get_status(task_id), threads
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with TaskQueue(f"{tmpdir}/tasks.sqlite") as task_queue:
+            queue = AsyncTaskQueue(task_queue)
+            status, threads = asyncio.run(scenario(queue))
+            queue.close()
+    assert status == "queued"
+    assert len(threads) == 1
+    assert threads.pop().startswith("task-queue-db")
+
+
+def test_event_loop_keeps_running_while_database_is_locked() -> None:
+    async def scenario(queue: AsyncTaskQueue, db_path: str) -> int:
+        task_id = await queue.create_task(1, 2, "do something", "{}", 10)
+        blocker = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+        blocker.execute("BEGIN EXCLUSIVE")
+        threading.Timer(0.3, blocker.rollback).start()
+
+        ticks = 0
+        approve = asyncio.create_task(queue.approve_task(task_id))
+        while not approve.done():
+            ticks += 1
+            await asyncio.sleep(0.01)
+        assert approve.result()
+        blocker.close()
+        return ticks
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = f"{tmpdir}/tasks.sqlite"
+        with TaskQueue(db_path) as task_queue:
+            queue = AsyncTaskQueue(task_queue)
+            ticks = asyncio.run(scenario(queue, db_path))
+            queue.close()
+    assert ticks > 5
@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+
+from telegram_agent.app.audit import AuditWriter
+from telegram_agent.app.cancellation import CancellationToken
+from telegram_agent.app.executor import TaskExecutor, ToolRegistry, log_note
+
+
+def _events(writer: AuditWriter, task_id: str) -> list[dict]:
+    return [json.loads(line) for line in writer.path(task_id).read_text(encoding="utf-8").splitlines()]
+
+
+def test_concurrent_tasks_write_separate_files(tmp_path) -> None:
+    writer = AuditWriter(str(tmp_path))
+
+    def write(task_id: str) -> None:
+        for index in range(200):
+            writer.record(task_id, "tick", index=index)
+        writer.close_task(task_id)
+
+    threads = [threading.Thread(target=write, args=(f"task-{n}",)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writer.close()
+
+    for n in range(4):
+        events = _events(writer, f"task-{n}")
+        assert [event["index"] for event in events] == list(range(200))
+        assert {event["task_id"] for event in events} == {f"task-{n}"}
+
+
+def test_executor_records_steps_and_notes(tmp_path) -> None:
+    writer = AuditWriter(str(tmp_path))
+    registry = ToolRegistry()
+    registry.register("log.note", log_note)
+    executor = TaskExecutor(str(tmp_path), registry, audit_writer=writer)
+    plan = json.dumps({"task": "demo", "steps": [{"id": 1, "action": "log.note", "args": {"message": "hello"}}]})
+
+    asyncio.run(executor.execute_plan("task", plan, lambda _: None, lambda _: None, CancellationToken(), 10))
+    writer.flush()
+
+    events = _events(writer, "task")
+    assert [event["event"] for event in events] == ["task_start", "step_start", "note", "step_end", "task_end"]
+    assert events[2]["message"] == "hello"
+    assert events[3]["ok"] is True
+    assert events[-1]["status"] == "completed"
+    writer.close()
+
+
+def test_unwritable_task_does_not_block_others_or_close(tmp_path) -> None:
+    # A plain file where the task directory should be makes every write for that task fail.
+    (tmp_path / "broken").write_text("", encoding="utf-8")
+    writer = AuditWriter(str(tmp_path))
+    writer.record("broken", "tick")
+    writer.record("ok", "tick")
+    writer.close_task("ok")
+
+    closer = threading.Thread(target=writer.close)
+    closer.start()
+    closer.join(5)
+
+    assert not closer.is_alive()
+    assert [event["event"] for event in _events(writer, "ok")] == ["tick"]
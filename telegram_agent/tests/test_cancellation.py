@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import threading
+import time
+
+import pytest
+
+from telegram_agent.app import cancellation
+from telegram_agent.app.cancellation import CancellationRegistry, TaskCancelled
+
+
+def test_cancel_interrupts_sleep_immediately() -> None:
+    registry = CancellationRegistry()
+    token = registry.token("task")
+    threading.Timer(0.05, registry.cancel, args=("task",)).start()
+
+    started = time.monotonic()
+    with cancellation.use_token(token), pytest.raises(TaskCancelled):
+        cancellation.sleep(5)
+    assert time.monotonic() - started < 1
+
+
+def test_cancel_unknown_task_is_noop() -> None:
+    registry = CancellationRegistry()
+    assert not registry.cancel("missing")
+    token = registry.token("task")
+    registry.discard("task")
+    assert registry.token("task") is not token
+
+
+def test_sleep_without_token_just_sleeps() -> None:
+    cancellation.check()
+    cancellation.sleep(0)
+
+
+def test_callbacks_run_once_on_cancel() -> None:
+    token = cancellation.CancellationToken()
+    calls = []
+    token.add_callback(lambda: calls.append("first"))
+    token.cancel()
+    token.cancel()
+    token.add_callback(lambda: calls.append("late"))
+    assert calls == ["first", "late"]
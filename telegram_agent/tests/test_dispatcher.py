@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import asyncio
+import tempfile
+
+from telegram_agent.app.async_queue import AsyncTaskQueue
+from telegram_agent.app.dispatcher import TaskDispatcher
+from telegram_agent.app.queue import Task, TaskQueue
+
+
+def test_notify_dispatches_without_waiting_for_sweep() -> None:
+    async def scenario(queue: TaskQueue) -> list[str]:
+        started: list[str] = []
+        done = asyncio.Event()
+
+        async def run_task(task: Task) -> None:
+            started.append(task.task_id)
+            queue.mark_done(task.task_id, {})
+            done.set()
+
+        dispatcher = TaskDispatcher(AsyncTaskQueue(queue), "worker", run_task, lease_seconds=30, sweep_interval_seconds=3600)
+        await dispatcher.start()
+        await asyncio.sleep(0)
+
+        task_id = queue.create_task(1, 2, "do something", "{}", 10)
+        queue.approve_task(task_id)
+        dispatcher.notify()
+        await asyncio.wait_for(done.wait(), timeout=1)
+        await dispatcher.stop()
+        return started
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with TaskQueue(f"{tmpdir}/tasks.sqlite") as queue:
+            started = asyncio.run(scenario(queue))
+    assert len(started) == 1
+
+
+def test_sweep_picks_up_tasks_without_notify() -> None:
+    async def scenario(queue: TaskQueue) -> list[str]:
+        started: list[str] = []
+        done = asyncio.Event()
+
+        async def run_task(task: Task) -> None:
+            started.append(task.task_id)
+            queue.mark_done(task.task_id, {})
+            done.set()
+
+        dispatcher = TaskDispatcher(AsyncTaskQueue(queue), "worker", run_task, lease_seconds=30, sweep_interval_seconds=0.05)
+        await dispatcher.start()
+        await asyncio.sleep(0)
+
+        task_id = queue.create_task(1, 2, "do something", "{}", 10)
+        queue.approve_task(task_id)
+        await asyncio.wait_for(done.wait(), timeout=1)
+        await dispatcher.stop()
+        return started
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with TaskQueue(f"{tmpdir}/tasks.sqlite") as queue:
+            started = asyncio.run(scenario(queue))
+    assert len(started) == 1
+
+
+def test_runs_tasks_from_different_lanes_concurrently() -> None:
+    async def scenario(queue: TaskQueue) -> tuple[set[str], int]:
+        started: set[str] = set()
+        release = asyncio.Event()
+
+        async def run_task(task: Task) -> None:
+            started.add(task.command)
+            await release.wait()
+            queue.mark_done(task.task_id, {})
+
+        for command, lane in (("gui 1", "gui"), ("gui 2", "gui"), ("observe", "observe")):
+            queue.approve_task(queue.create_task(1, 2, command, "{}", 10, lane=lane))
+
+        dispatcher = TaskDispatcher(
+            AsyncTaskQueue(queue),
+            "worker",
+            run_task,
+            lease_seconds=30,
+            sweep_interval_seconds=3600,
+            max_workers=3,
+            lane_limits={"gui": 1, "observe": 2},
+        )
+        await dispatcher.start()
+        await asyncio.sleep(0.05)
+        concurrent = set(started)
+        release.set()
+        await asyncio.sleep(0.05)
+        await dispatcher.stop()
+        return concurrent, len(started)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with TaskQueue(f"{tmpdir}/tasks.sqlite") as queue:
+            concurrent, total = asyncio.run(scenario(queue))
+    assert concurrent == {"gui 1", "observe"}
+    assert total == 3
@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+from telegram_agent.app.cancellation import CancellationToken, TaskCancelled
+from telegram_agent.app.executor import TaskExecutor, ToolRegistry, validate_plan
+
+
+def _plan(*steps: dict) -> str:
+    return json.dumps({"task": "test", "steps": list(steps)})
+
+
+def _executor(tmp_path, registry: ToolRegistry) -> TaskExecutor:
+    return TaskExecutor(str(tmp_path), registry)
+
+
+def _run(executor: TaskExecutor, plan_json: str, token: CancellationToken | None = None, timeout: float = 30) -> dict:
+    coroutine = executor.execute_plan(
+        "task", plan_json, lambda _: None, lambda _: None, token or CancellationToken(), timeout
+    )
+    return asyncio.run(coroutine)
+
+
+def test_independent_steps_overlap_and_report_in_plan_order(tmp_path) -> None:
+    barrier = threading.Barrier(2, timeout=5)
+    registry = ToolRegistry()
+    registry.register("uia.dump", lambda name: (barrier.wait(), name)[1])
+
+    result = _run(
+        _executor(tmp_path, registry),
+        _plan(
+            {"id": 1, "action": "uia.dump", "args": {"name": "a"}, "depends_on": []},
+            {"id": 2, "action": "uia.dump", "args": {"name": "b"}, "depends_on": []},
+        ),
+    )
+
+    # Both dumps had to be in flight at once to get past the barrier.
+    assert [step["output"] for step in result["steps"]] == ["a", "b"]
+
+
+def test_gui_steps_never_overlap(tmp_path) -> None:
+    active = []
+    overlaps = []
+    registry = ToolRegistry()
+
+    def click(x: int) -> None:
+        active.append(x)
+        overlaps.append(len(active) > 1)
+        time.sleep(0.05)
+        active.remove(x)
+
+    registry.register("input.click", click)
+    steps = [{"id": i, "action": "input.click", "args": {"x": i}, "depends_on": []} for i in range(1, 4)]
+    result = _run(_executor(tmp_path, registry), _plan(*steps))
+
+    assert [step["step"] for step in result["steps"]] == [1, 2, 3]
+    assert not any(overlaps)
+
+
+def test_steps_without_depends_on_run_in_order(tmp_path) -> None:
+    calls = []
+    registry = ToolRegistry()
+    registry.register("log.note", lambda message: calls.append(message))
+
+    _run(
+        _executor(tmp_path, registry),
+        _plan(*({"id": i, "action": "log.note", "args": {"message": str(i)}} for i in range(1, 6))),
+    )
+
+    assert calls == ["1", "2", "3", "4", "5"]
+
+
+def test_failure_skips_dependents(tmp_path) -> None:
+    calls = []
+    registry = ToolRegistry()
+
+    def boom() -> None:
+        raise ValueError("boom")
+
+    registry.register("uia.dump", boom)
+    registry.register("log.note", lambda message: calls.append(message))
+
+    with pytest.raises(RuntimeError, match="uia.dump failed: boom"):
+        _run(
+            _executor(tmp_path, registry),
+            _plan(
+                {"id": 1, "action": "uia.dump", "args": {}, "depends_on": []},
+                {"id": 2, "action": "log.note", "args": {"message": "after"}, "depends_on": [1]},
+            ),
+        )
+    assert calls == []
+
+
+def test_dependency_on_later_step_is_rejected(tmp_path) -> None:
+    registry = ToolRegistry()
+    registry.register("log.note", lambda message: None)
+
+    with pytest.raises(RuntimeError, match="Invalid plan"):
+        _run(
+            _executor(tmp_path, registry),
+            _plan(
+                {"id": 1, "action": "log.note", "args": {"message": "a"}, "depends_on": [2]},
+                {"id": 2, "action": "log.note", "args": {"message": "b"}, "depends_on": []},
+            ),
+        )
+
+
+def test_async_tools_run_on_the_loop(tmp_path) -> None:
+    registry = ToolRegistry()
+
+    async def note(message: str) -> str:
+        await asyncio.sleep(0)
+        return threading.current_thread().name
+
+    registry.register("log.note", note)
+    result = _run(_executor(tmp_path, registry), _plan({"id": 1, "action": "log.note", "args": {"message": "hi"}}))
+
+    assert result["steps"][0]["output"] == threading.current_thread().name
+
+
+def test_cancel_interrupts_async_wait(tmp_path) -> None:
+    registry = ToolRegistry()
+
+    async def sleep(seconds: float) -> None:
+        await asyncio.sleep(seconds)
+
+    registry.register("wait.sleep", sleep)
+    token = CancellationToken()
+    threading.Timer(0.1, token.cancel).start()
+
+    started = time.monotonic()
+    with pytest.raises(TaskCancelled):
+        _run(_executor(tmp_path, registry), _plan({"id": 1, "action": "wait.sleep", "args": {"seconds": 10}}), token)
+    assert time.monotonic() - started < 2
+
+
+def test_timeout_cancels_running_steps(tmp_path) -> None:
+    registry = ToolRegistry()
+
+    async def sleep(seconds: float) -> None:
+        await asyncio.sleep(seconds)
+
+    registry.register("wait.sleep", sleep)
+    with pytest.raises(RuntimeError, match="Task timeout reached"):
+        _run(
+            _executor(tmp_path, registry),
+            _plan({"id": 1, "action": "wait.sleep", "args": {"seconds": 10}}),
+            timeout=0.1,
+        )
+
+
+def test_validate_plan_checks_tools_against_registry() -> None:
+    registry = ToolRegistry()
+    registry.register_lazy("input.type", "telegram_agent.app.tools.input:type_text")
+
+    assert [step.action for step in validate_plan(_plan({"id": 1, "action": "input.type"}), registry)] == [
+        "input.type"
+    ]
+    with pytest.raises(RuntimeError, match="unknown tools input.scroll"):
+        validate_plan(_plan({"id": 1, "action": "input.scroll"}), registry)
+    with pytest.raises(RuntimeError, match="Invalid plan"):
+        validate_plan("{}", registry)
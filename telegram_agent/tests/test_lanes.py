@@ -0,0 +1,24 @@
+from __future__ import annotations
+
+from telegram_agent.app.lanes import GUI_LANE, OBSERVE_LANE, classify_steps
+
+
+def test_read_only_plan_uses_observe_lane() -> None:
+    steps = [
+        {"id": 1, "action": "screen.capture", "args": {}},
+        {"id": 2, "action": "log.note", "args": {"message": "hi"}},
+        {"id": 3, "action": "uia.dump", "args": {}},
+    ]
+    assert classify_steps(steps) == OBSERVE_LANE
+
+
+def test_input_step_uses_gui_lane() -> None:
+    steps = [
+        {"id": 1, "action": "screen.capture", "args": {}},
+        {"id": 2, "action": "uia.click_text", "args": {"text": "Save"}},
+    ]
+    assert classify_steps(steps) == GUI_LANE
+
+
+def test_unknown_tool_is_treated_as_gui() -> None:
+    assert classify_steps([{"id": 1, "action": "custom.tool", "args": {}}]) == GUI_LANE
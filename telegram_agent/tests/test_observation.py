@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+
+from telegram_agent.app import observation
+from telegram_agent.app.observation import ObservationCache, Probe
+
+
+def _probes(calls: list[str]) -> tuple[Probe, ...]:
+    def window(_: str, __: str) -> dict:
+        calls.append("window")
+        return {"title": "Editor"}
+
+    def slow(_: str, __: str) -> list:
+        time.sleep(1)
+        return ["late"]
+
+    return (
+        Probe("active_window", "active_window", "active_window_error", 1.0, window),
+        Probe("uia_dump", "uia_dump", "uia_dump_error", 0.1, slow, fallback=[]),
+    )
+
+
+def test_slow_probe_times_out_with_fallback(monkeypatch, tmp_path) -> None:
+    monkeypatch.setattr(observation, "PROBES", _probes([]))
+
+    result = asyncio.run(observation.collect_observation(str(tmp_path), "task"))
+
+    assert result["active_window"] == {"title": "Editor"}
+    assert result["uia_dump"] == []
+    assert "timed out" in result["uia_dump_error"]
+    assert set(result["probe_timings_ms"]) == {"active_window", "uia_dump"}
+
+
+def test_unchanged_screen_reuses_cached_observation(monkeypatch, tmp_path) -> None:
+    calls: list[str] = []
+    probes = _probes(calls)[:1]
+    monkeypatch.setattr(observation, "PROBES", probes)
+    monkeypatch.setattr(observation, "observation_fingerprint", lambda: "screen-1")
+    cache = ObservationCache(ttl_seconds=60)
+    audit_dir = str(tmp_path)
+
+    first = asyncio.run(observation.collect_observation(audit_dir, "task-1", cache=cache))
+    observation.write_observation(audit_dir, "task-1", first)
+    second = asyncio.run(observation.collect_observation(audit_dir, "task-2", cache=cache))
+    path = observation.write_observation(audit_dir, "task-2", second)
+
+    assert calls == ["window"]
+    assert second["cached_from"] == "task-1"
+    assert os.stat(path).st_nlink == 2
+    assert json.loads(open(path, encoding="utf-8").read())["active_window"] == {"title": "Editor"}
+
+    cache.invalidate("input.click")
+    asyncio.run(observation.collect_observation(audit_dir, "task-3", cache=cache))
+    assert calls == ["window", "window"]
+
+
+def test_partial_observation_is_not_cached(monkeypatch, tmp_path) -> None:
+    monkeypatch.setattr(observation, "PROBES", _probes([]))
+    monkeypatch.setattr(observation, "observation_fingerprint", lambda: "screen-1")
+    cache = ObservationCache(ttl_seconds=60)
+
+    asyncio.run(observation.collect_observation(str(tmp_path), "task-1", cache=cache))
+
+    assert cache.get("screen-1") is None
+
+
+def test_failing_probe_reports_error_and_timeouts_can_be_overridden(monkeypatch, tmp_path) -> None:
+    def broken(_: str, __: str) -> dict:
+        raise RuntimeError("no desktop")
+
+    probes = (
+        Probe("active_window", "active_window", "active_window_error", 1.0, broken),
+        *_probes([])[1:],
+    )
+    monkeypatch.setattr(observation, "PROBES", probes)
+
+    started = time.perf_counter()
+    result = asyncio.run(observation.collect_observation(str(tmp_path), "task", timeouts={"uia_dump": 2.0}))
+
+    # The error is recorded without a fallback value; the slow probe had time to finish.
+    assert result["active_window_error"] == "no desktop"
+    assert "active_window" not in result
+    assert result["uia_dump"] == ["late"]
+    assert "uia_dump_error" not in result
+    assert time.perf_counter() - started < 2.0
+
+
+def test_cache_misses_on_new_fingerprint_expiry_and_failed_fingerprint(monkeypatch, tmp_path) -> None:
+    calls: list[str] = []
+    monkeypatch.setattr(observation, "PROBES", _probes(calls)[:1])
+    fingerprints = ["screen-1"]
+
+    def fingerprint() -> str:
+        value = fingerprints[0]
+        if value is None:
+            raise RuntimeError("no screen")
+        return value
+
+    monkeypatch.setattr(observation, "observation_fingerprint", fingerprint)
+    cache = ObservationCache(ttl_seconds=60)
+    audit_dir = str(tmp_path)
+
+    asyncio.run(observation.collect_observation(audit_dir, "task-1", cache=cache))
+    fingerprints[0] = "screen-2"
+    changed = asyncio.run(observation.collect_observation(audit_dir, "task-2", cache=cache))
+    assert "cached_from" not in changed
+    assert calls == ["window", "window"]
+
+    cache.ttl_seconds = 0.05
+    time.sleep(0.1)
+    expired = asyncio.run(observation.collect_observation(audit_dir, "task-3", cache=cache))
+    assert "cached_from" not in expired
+    assert calls == ["window", "window", "window"]
+
+    # Without a fingerprint nothing is looked up or stored.
+    cache.ttl_seconds = 60
+    fingerprints[0] = None
+    asyncio.run(observation.collect_observation(audit_dir, "task-4", cache=cache))
+    asyncio.run(observation.collect_observation(audit_dir, "task-5", cache=cache))
+    assert calls == ["window"] * 5
+    assert cache.get("screen-2") is not None
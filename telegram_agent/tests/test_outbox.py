@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+from telegram.error import RetryAfter
+
+from telegram_agent.app.outbox import Outbox, TokenBucket
+
+
+class FakeBot:
+    def __init__(self, fail_with: list[Exception] | None = None) -> None:
+        self.calls: list[tuple[str, int, str | None]] = []
+        self.fail_with = fail_with or []
+        self._message_ids = iter(range(1, 1000))
+
+    def _maybe_fail(self) -> None:
+        if self.fail_with:
+            raise self.fail_with.pop(0)
+
+    async def send_message(self, chat_id: int, text: str) -> SimpleNamespace:
+        self._maybe_fail()
+        self.calls.append(("send", chat_id, text))
+        return SimpleNamespace(message_id=next(self._message_ids))
+
+    async def edit_message_text(self, text: str, chat_id: int, message_id: int) -> None:
+        self._maybe_fail()
+        self.calls.append(("edit", chat_id, text))
+
+    async def send_photo(self, chat_id: int, photo: bytes, caption: str | None = None) -> None:
+        self._maybe_fail()
+        self.calls.append(("photo", chat_id, caption))
+
+
+async def _drain(outbox: Outbox, timeout: float = 3.0) -> None:
+    deadline = time.monotonic() + timeout
+    await asyncio.sleep(0)
+    while outbox.pending_count and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.05)
+
+
+def test_token_bucket_delays_after_burst() -> None:
+    bucket = TokenBucket(rate=2.0, capacity=2)
+    now = time.monotonic()
+    bucket.take(now)
+    bucket.take(now)
+    assert 0.4 < bucket.delay(now) <= 0.5
+    bucket.pause(3.0, now)
+    assert bucket.delay(now) >= 3.0
+
+
+def test_progress_updates_coalesce_into_one_status_message() -> None:
+    async def scenario() -> list[tuple[str, int, str | None]]:
+        bot = FakeBot()
+        outbox = Outbox(bot, chat_rate=100.0)
+        await outbox.start()
+        for step in range(5):
+            outbox.progress(1, "task", f"step {step}")
+        await _drain(outbox)
+        outbox.progress(1, "task", "step 5")
+        await _drain(outbox)
+        await outbox.stop()
+        return bot.calls
+
+    assert asyncio.run(scenario()) == [("send", 1, "step 4"), ("edit", 1, "step 5")]
+
+
+def test_final_result_overtakes_queued_progress_and_photos() -> None:
+    async def scenario() -> list[tuple[str, int, str | None]]:
+        bot = FakeBot()
+        # One token per chat: everything after the first message has to queue.
+        outbox = Outbox(bot, chat_rate=20.0, chat_burst=1)
+        await outbox.start()
+        outbox.progress(1, "other", "working")
+        outbox.photo(1, b"png", caption="shot")
+        outbox.progress(1, "task", "step 1")
+        outbox.final(1, "Task done", key="task")
+        await _drain(outbox)
+        await outbox.stop()
+        return bot.calls
+
+    assert asyncio.run(scenario()) == [("send", 1, "Task done"), ("photo", 1, "shot"), ("send", 1, "working")]
+
+
+def test_retry_after_pauses_and_retries() -> None:
+    async def scenario() -> tuple[list[tuple[str, int, str | None]], float]:
+        bot = FakeBot(fail_with=[RetryAfter(1)])
+        outbox = Outbox(bot, chat_rate=100.0)
+        await outbox.start()
+        started = time.monotonic()
+        outbox.final(1, "Task done")
+        await _drain(outbox)
+        elapsed = time.monotonic() - started
+        await outbox.stop()
+        return bot.calls, elapsed
+
+    calls, elapsed = asyncio.run(scenario())
+    assert calls == [("send", 1, "Task done")]
+    assert elapsed >= 1.0
+
+
+def test_unexpected_error_drops_only_that_message() -> None:
+    async def scenario() -> list[tuple[str, int, str | None]]:
+        bot = FakeBot(fail_with=[OSError("bad photo payload")])
+        outbox = Outbox(bot, chat_rate=100.0)
+        await outbox.start()
+        outbox.photo(1, b"not-an-image", "before")
+        await _drain(outbox)
+        outbox.final(1, "Task done")
+        await _drain(outbox)
+        await outbox.stop()
+        return bot.calls
+
+    assert asyncio.run(scenario()) == [("send", 1, "Task done")]
+
+
+def test_submission_is_thread_safe() -> None:
+    async def scenario() -> list[tuple[str, int, str | None]]:
+        bot = FakeBot()
+        outbox = Outbox(bot, chat_rate=100.0)
+        await outbox.start()
+        await asyncio.to_thread(outbox.final, 2, "from a worker thread")
+        await _drain(outbox)
+        await outbox.stop()
+        return bot.calls
+
+    assert asyncio.run(scenario()) == [("send", 2, "from a worker thread")]
@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import json
+import random
+
+import pytest
+
+from telegram_agent.app.planner import (
+    Action,
+    CachedPlan,
+    PlanCache,
+    PlanError,
+    create_plan,
+    parse_command,
+    relabel_observation_note,
+    reused_plan_json,
+)
+
+
+def test_chained_command_keeps_every_action_in_order() -> None:
+    plan = create_plan("click_text Save then type foo then hotkey ctrl+s")
+
+    actions = [(step["action"], step["args"]) for step in plan.steps]
+    assert actions[2:] == [
+        ("uia.click_text", {"text": "Save"}),
+        ("input.type", {"text": "foo"}),
+        ("input.hotkey", {"keys": "ctrl+s"}),
+        ("screen.capture", {"label": "after"}),
+    ]
+    assert [step["depends_on"] for step in plan.steps[2:]] == [[1], [3], [4], [5]]
+
+
+def test_typed_arguments_and_options() -> None:
+    command = (
+        "please click_text Save As control_type=Button window=Notepad "
+        'then type "a then  b" then wait 1.5 then click 10 20'
+    )
+
+    assert parse_command(command) == [
+        Action("uia.click_text", {"text": "Save As", "control_type": "Button", "window_title_substring": "Notepad"}),
+        Action("input.type", {"text": "a then  b"}),
+        Action("wait.sleep", {"seconds": 1.5}),
+        Action("input.click", {"x": 10, "y": 20}),
+    ]
+    assert parse_command("no verbs here") == []
+
+
+def test_quoted_option_values() -> None:
+    command = "click_text Save control_type='Split Button' window=\"Untitled - Notepad\" then type a window=\"b c\""
+
+    assert parse_command(command) == [
+        Action(
+            "uia.click_text",
+            {"text": "Save", "control_type": "Split Button", "window_title_substring": "Untitled - Notepad"},
+        ),
+        # Outside click_text options the original text is kept, quotes included.
+        Action("input.type", {"text": 'a window="b c"'}),
+    ]
+
+
+@pytest.mark.parametrize(
+    "command", ["click 10 abc", "click 10", "wait 60", "type", "hotkey ctrl+", "click_text then type x"]
+)
+def test_bad_arguments_are_rejected(command: str) -> None:
+    with pytest.raises(PlanError):
+        parse_command(command)
+
+
+WORDS = [
+    "then", "click", "click_text", "type", "hotkey", "wait", "focus", "click_uia", "click_path",
+    "'", '"', "1", "-3", "2.5s", "ctrl+s", "control_type=Edit", "window=", "地址栏", "\\", 'then"', "''", "x y",
+]
+
+
+def test_fuzzed_commands_only_raise_plan_errors() -> None:
+    rng = random.Random(1234)
+    for _ in range(3000):
+        command = " " * rng.randint(0, 2) + rng.choice(["", " ", "  "]).join(
+            rng.choice(WORDS) for _ in range(rng.randint(0, 12))
+        )
+        try:
+            actions = parse_command(command)
+        except PlanError:
+            continue
+        assert all(isinstance(action, Action) for action in actions)
+
+
+def test_fuzzed_chains_round_trip() -> None:
+    rng = random.Random(99)
+    clauses = [
+        (
+            lambda: f"type {rng.choice(['hello', 'two words', '地址'])}",
+            lambda text: ("input.type", {"text": text[5:]}),
+        ),
+        (lambda: f"click {rng.randint(0, 2000)} {rng.randint(0, 2000)}", None),
+        (
+            lambda: f"hotkey {rng.choice(['enter', 'ctrl+s', 'alt+f4'])}",
+            lambda text: ("input.hotkey", {"keys": text[7:]}),
+        ),
+        (lambda: f"click_text {rng.choice(['OK', 'Save As'])}", lambda text: ("uia.click_text", {"text": text[11:]})),
+    ]
+    for _ in range(500):
+        chosen = [rng.choice(clauses) for _ in range(rng.randint(1, 20))]
+        texts = [make() for make, _ in chosen]
+        expected = []
+        for text, (_, model) in zip(texts, chosen):
+            if model is None:
+                _, x, y = text.split()
+                expected.append(("input.click", {"x": int(x), "y": int(y)}))
+            else:
+                expected.append(model(text))
+        actions = parse_command(" then ".join(texts))
+        assert [(action.action, action.args) for action in actions] == expected
+
+
+def test_plan_cache_keys_on_command_and_window() -> None:
+    cache = PlanCache(ttl_seconds=60, max_entries=2)
+    cache.put("type  hello", "notepad.exe|Untitled", "task-1", "{}", "gui")
+
+    assert cache.get("type hello ", "notepad.exe|Untitled").task_id == "task-1"
+    assert cache.get("type hello", "notepad.exe|notes.txt") is None
+    assert cache.get("type Hello", "notepad.exe|Untitled") is None
+
+    cache.put("wait 1", "a|b", "task-2", "{}", "observe")
+    cache.put("wait 2", "a|b", "task-3", "{}", "observe")
+    assert cache.get("wait 1", "a|b") is not None
+    assert cache.get("type hello", "notepad.exe|Untitled") is None
+
+
+def test_plan_cache_lookup_by_command_alone() -> None:
+    cache = PlanCache(ttl_seconds=60)
+    cache.put("type  hello", "notepad.exe|Untitled", "task-1", "{}", "gui")
+
+    assert cache.has_command("type hello")
+    assert not cache.has_command("type bye")
+    assert not PlanCache(ttl_seconds=0).has_command("type hello")
+
+
+def test_reused_plan_names_the_source_of_its_observation() -> None:
+    plan_json = create_plan("wait 1", {"active_window_title": "Notepad"}).to_json()
+    reused = json.loads(reused_plan_json(CachedPlan("task-1", plan_json, "observe", 0.0)))
+
+    notes = [step["args"]["message"] for step in reused["steps"] if step["action"] == "log.note"]
+    assert notes[0] == "Requested task: wait 1"
+    assert notes[1].startswith("Observation summary (reused from task task-1): ")
+    assert [step["action"] for step in reused["steps"]] == [step["action"] for step in json.loads(plan_json)["steps"]]
+
+
+def test_macro_plan_names_the_macro_and_its_source_task() -> None:
+    plan_json = create_plan("wait 1", {"active_window_title": "Notepad"}).to_json()
+    replayed = json.loads(relabel_observation_note(plan_json, "from macro nightly, saved from task task-1"))
+
+    notes = [step["args"]["message"] for step in replayed["steps"] if step["action"] == "log.note"]
+    assert notes[1].startswith("Observation summary (from macro nightly, saved from task task-1): ")
+
+    # A note that already names its source keeps it.
+    reused = reused_plan_json(CachedPlan("task-1", plan_json, "observe", 0.0))
+    again = json.loads(relabel_observation_note(reused, "from macro nightly, saved from task task-2"))
+    assert [step["args"].get("message") for step in again["steps"]] == [
+        step["args"].get("message") for step in json.loads(reused)["steps"]
+    ]
@@ -1,8 +1,13 @@
 from __future__ import annotations
 
+import json
+import sqlite3
 import tempfile
+import threading
 
-from telegram_agent.app.queue import TaskQueue
+import pytest
+
+from telegram_agent.app.queue import StepRecord, TaskQueue
 
 
 def test_task_lifecycle() -> None:
@@ -29,3 +34,203 @@ def test_task_lifecycle() -> None:
         assert queue.cancel_task(task_id)
         task = queue.get_task(task_id)
         assert task.status == "cancelled"
+
+
+def test_claim_next_claims_oldest_queued_task() -> None:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        queue = TaskQueue(f"{tmpdir}/tasks.sqlite")
+        first = queue.create_task(1, 2, "first", "{}", 10)
+        second = queue.create_task(1, 2, "second", "{}", 10)
+        assert queue.claim_next("worker-a", 30) is None
+
+        queue.approve_task(second)
+        queue.approve_task(first)
+        claimed = queue.claim_next("worker-a", 30)
+        assert claimed is not None
+        assert claimed.task_id == first
+        assert claimed.status == "running"
+
+        # Nothing else starts while a task is running.
+        assert queue.claim_next("worker-b", 30) is None
+        queue.mark_done(first, {"ok": True})
+        claimed = queue.claim_next("worker-b", 30)
+        assert claimed is not None
+        assert claimed.task_id == second
+
+
+def test_claim_next_never_double_claims() -> None:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = f"{tmpdir}/tasks.sqlite"
+        queue = TaskQueue(db_path)
+        task_ids = [queue.create_task(1, 2, f"task {index}", "{}", 10) for index in range(20)]
+        for task_id in task_ids:
+            queue.approve_task(task_id)
+
+        claimed: list[str] = []
+        lock = threading.Lock()
+
+        def worker(name: str) -> None:
+            worker_queue = TaskQueue(db_path)
+            while True:
+                task = worker_queue.claim_next(name, 30)
+                if task is None:
+                    with lock:
+                        if len(claimed) == len(task_ids):
+                            return
+                    continue
+                with lock:
+                    claimed.append(task.task_id)
+                worker_queue.mark_done(task.task_id, {})
+
+        threads = [threading.Thread(target=worker, args=(f"worker-{index}",)) for index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=30)
+
+        assert sorted(claimed) == sorted(task_ids)
+
+
+def test_connections_are_reused_per_thread_and_closed() -> None:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        queue = TaskQueue(f"{tmpdir}/tasks.sqlite")
+        assert queue._connect() is queue._connect()
+
+        other: list[object] = []
+        thread = threading.Thread(target=lambda: other.append(queue._connect()))
+        thread.start()
+        thread.join()
+        assert other[0] is not queue._connect()
+
+        queue.close()
+        with pytest.raises(sqlite3.ProgrammingError):
+            queue.get_task("missing")
+
+
+def test_claim_next_respects_lane_limits() -> None:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        queue = TaskQueue(f"{tmpdir}/tasks.sqlite")
+        gui_first = queue.create_task(1, 2, "gui 1", "{}", 10, lane="gui")
+        gui_second = queue.create_task(1, 2, "gui 2", "{}", 10, lane="gui")
+        observe = queue.create_task(1, 2, "observe", "{}", 10, lane="observe")
+        for task_id in (gui_first, gui_second, observe):
+            queue.approve_task(task_id)
+
+        limits = {"gui": 1, "observe": 2}
+        assert queue.claim_next("worker", 30, limits).task_id == gui_first
+        # The second GUI task waits for the lane, but the read-only task runs alongside.
+        assert queue.claim_next("worker", 30, limits).task_id == observe
+        assert queue.claim_next("worker", 30, limits) is None
+
+        queue.mark_done(gui_first, {})
+        assert queue.claim_next("worker", 30, limits).task_id == gui_second
+
+
+def test_step_records_are_written_in_background() -> None:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with TaskQueue(f"{tmpdir}/tasks.sqlite") as queue:
+            task_id = queue.create_task(1, 2, "do something", "{}", 10)
+            for step_id in (1, 2, 3):
+                queue.append_step(
+                    StepRecord(task_id, step_id, "log.note", "abc", 1.0, 2.5, step_id != 3, f"out {step_id}")
+                )
+            queue.flush_steps()
+
+            steps = queue.list_steps(task_id)
+            assert [step.step_id for step in steps] == [1, 2, 3]
+            assert [step.ok for step in steps] == [True, True, False]
+            assert steps[0].output_ref == "out 1"
+
+
+def test_close_flushes_pending_step_records() -> None:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = f"{tmpdir}/tasks.sqlite"
+        queue = TaskQueue(db_path)
+        queue.append_step(StepRecord("task", 1, "log.note", "abc", 1.0, 2.5, True, None))
+        queue.close()
+
+        with TaskQueue(db_path) as reopened:
+            assert len(reopened.list_steps("task")) == 1
+
+
+def test_expired_leases_are_reaped_by_policy() -> None:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with TaskQueue(f"{tmpdir}/tasks.sqlite") as queue:
+            task_id = queue.create_task(1, 2, "do something", "{}", 10)
+            queue.approve_task(task_id)
+            assert queue.claim_next("worker-a", 30) is not None
+            assert queue.renew_lease(task_id, "worker-a", 30)
+            assert not queue.renew_lease(task_id, "worker-b", 30)
+            assert queue.reap_expired("requeue", max_attempts=2) == []
+
+            # Let the lease lapse: the first expiry requeues, the second exhausts the attempts.
+            assert queue.renew_lease(task_id, "worker-a", -1)
+            assert queue.reap_expired("requeue", max_attempts=2) == [(task_id, "queued")]
+            assert queue.claim_next("worker-b", -1) is not None
+            assert queue.reap_expired("requeue", max_attempts=2) == [(task_id, "failed")]
+            assert "lease expired" in queue.get_task(task_id).result_json
+
+            # A cancelled task can no longer be renewed by its worker.
+            other = queue.create_task(1, 2, "other", "{}", 10)
+            queue.approve_task(other)
+            queue.claim_next("worker-a", 30)
+            queue.cancel_task(other)
+            assert not queue.renew_lease(other, "worker-a", 30)
+
+
+def test_large_payloads_are_offloaded_and_loaded_on_demand() -> None:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with TaskQueue(f"{tmpdir}/tasks.sqlite") as queue:
+            plan_json = json.dumps({"task": "big", "steps": [{"id": 1, "action": "log.note", "args": {"message": "x" * 10000}}]})
+            task_id = queue.create_task(1, 2, "big", plan_json, 10)
+            inline = queue._connect().execute(
+                "SELECT plan_json, plan_offloaded FROM tasks WHERE task_id = ?", (task_id,)
+            ).fetchone()
+            assert inline == ("", 1)
+            assert queue.get_task(task_id).plan_json == plan_json
+
+            # Replacing it with a small plan moves the payload back inline.
+            assert queue.update_plan(task_id, "{}")
+            assert queue.get_task(task_id).plan_json == "{}"
+
+            queue.approve_task(task_id)
+            assert queue.claim_next("worker", 30).plan_json == "{}"
+            result = {"steps": [{"output": "y" * 10000}]}
+            queue.mark_done(task_id, result)
+            assert json.loads(queue.get_task(task_id).result_json) == result
+
+            summaries = queue.list_recent()
+            assert [summary.task_id for summary in summaries] == [task_id]
+            assert not hasattr(summaries[0], "plan_json")
+
+
+def test_empty_payloads_stay_inline(tmp_path) -> None:
+    with TaskQueue(str(tmp_path / "tasks.sqlite")) as queue:
+        task_id = queue.create_task(1, 2, "empty", "", 10)
+        # A stray payload row must not be mistaken for this task's plan.
+        queue._connect().execute(
+            "INSERT INTO task_payloads (task_id, kind, codec, data) VALUES (?, 'plan', 'zlib', ?)",
+            (task_id, b"not zlib"),
+        )
+
+        assert queue.get_task(task_id).plan_json == ""
+        queue._finish(task_id, "completed", "")
+        assert queue.get_task(task_id).result_json == ""
+
+
+def test_macros_are_saved_from_completed_tasks(tmp_path) -> None:
+    with TaskQueue(str(tmp_path / "tasks.sqlite")) as queue:
+        plan_json = json.dumps({"task": "type hi", "steps": [{"id": 1, "action": "input.type", "args": {}}]})
+        task_id = queue.create_task(1, 2, "type hi", plan_json, 10)
+        assert queue.save_macro("greet", task_id, 2) is None
+
+        queue.mark_done(task_id, {"ok": True})
+        queue.save_macro("greet", task_id, 2)
+        queue.delete_tasks([task_id])
+
+        macro = queue.get_macro("greet")
+        assert macro is not None
+        assert (macro.command, macro.plan_json, macro.source_task_id) == ("type hi", plan_json, task_id)
+        assert queue.list_macros() == ["greet"]
+        assert queue.delete_macro("greet")
+        assert queue.get_macro("greet") is None
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import json
+import os
+import tarfile
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from telegram_agent.app.queue import StepRecord, TaskQueue
+from telegram_agent.app.retention import MANUAL_TASK_ID, RetentionPolicy, _path_size, _prune_manual, run_retention
+
+
+def _finished_task(queue: TaskQueue, audit_dir: Path, command: str, age_days: float) -> str:
+    task_id = queue.create_task(1, 2, command, "{}", 10)
+    queue.mark_done(task_id, {"ok": True})
+    queue.append_step(StepRecord(task_id, 1, "log.note", "abc", 1.0, 2.0, True, None))
+    timestamp = time.time() - age_days * 86400
+    with queue._connect() as conn:
+        conn.execute("UPDATE tasks SET created_at = ?, updated_at = ? WHERE task_id = ?", (timestamp, timestamp, task_id))
+    task_dir = audit_dir / task_id
+    task_dir.mkdir(parents=True)
+    (task_dir / "observation.json").write_text("x" * 5000, encoding="utf-8")
+    return task_id
+
+
+def test_archives_and_deletes_expired_tasks() -> None:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        audit_dir = Path(tmpdir) / "audit"
+        with TaskQueue(f"{tmpdir}/tasks.sqlite") as queue:
+            old = _finished_task(queue, audit_dir, "old", age_days=40)
+            recent = _finished_task(queue, audit_dir, "recent", age_days=1)
+            queue.flush_steps()
+
+            policy = RetentionPolicy(archive_dir=f"{tmpdir}/archive", max_age_days=30, batch_pause_seconds=0)
+            report = run_retention(queue, str(audit_dir), policy)
+
+            assert report.archived_tasks == 1
+            assert report.deleted_tasks == 1
+            assert report.reclaimed_bytes >= 5000
+            assert queue.get_task(old) is None
+            assert queue.list_steps(old) == []
+            assert queue.get_task(recent) is not None
+            assert not (audit_dir / old).exists()
+            assert (audit_dir / recent).exists()
+
+            (bundle_path,) = report.archives
+            assert "/archive/" in bundle_path
+            with tarfile.open(bundle_path) as bundle:
+                manifest = bundle.extractfile("tasks.jsonl").read().decode("utf-8")
+                assert f"audit/{old}/observation.json" in bundle.getnames()
+            record = json.loads(manifest)
+            assert record["task_id"] == old
+            assert record["steps"][0]["action"] == "log.note"
+
+
+def test_audit_size_limit_evicts_oldest_finished_tasks() -> None:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        audit_dir = Path(tmpdir) / "audit"
+        with TaskQueue(f"{tmpdir}/tasks.sqlite") as queue:
+            oldest = _finished_task(queue, audit_dir, "oldest", age_days=3)
+            middle = _finished_task(queue, audit_dir, "middle", age_days=2)
+            newest = _finished_task(queue, audit_dir, "newest", age_days=1)
+
+            policy = RetentionPolicy(
+                archive_dir=f"{tmpdir}/archive",
+                max_age_days=30,
+                max_audit_bytes=10000,
+                batch_pause_seconds=0,
+            )
+            report = run_retention(queue, str(audit_dir), policy)
+
+            assert report.deleted_tasks == 1
+            assert queue.get_task(oldest) is None
+            assert queue.get_task(middle) is not None
+            assert queue.get_task(newest) is not None
+
+
+def test_hard_linked_files_count_once(tmp_path) -> None:
+    blob = tmp_path / "shots" / "blob.jpg"
+    blob.parent.mkdir()
+    blob.write_bytes(b"x" * 1000)
+    for task_id in ("task-1", "task-2"):
+        (tmp_path / task_id).mkdir()
+        os.link(blob, tmp_path / task_id / "before.jpg")
+
+    assert _path_size(tmp_path) == 1000
+
+
+def test_manual_shots_expire_by_age(tmp_path) -> None:
+    manual_dir = tmp_path / "audit" / MANUAL_TASK_ID
+    manual_dir.mkdir(parents=True)
+    old_shot, new_shot = manual_dir / "old.png", manual_dir / "new.png"
+    old_shot.write_bytes(b"x" * 100)
+    new_shot.write_bytes(b"x" * 100)
+    old = time.time() - 40 * 86400
+    os.utime(old_shot, (old, old))
+
+    with TaskQueue(str(tmp_path / "tasks.sqlite")) as queue:
+        policy = RetentionPolicy(archive_dir=str(tmp_path / "archive"), max_age_days=30, batch_pause_seconds=0)
+        run_retention(queue, str(tmp_path / "audit"), policy)
+
+    assert not old_shot.exists()
+    assert new_shot.exists()
+
+
+def test_stop_flag_ends_run_before_touching_the_queue(tmp_path) -> None:
+    audit_dir = tmp_path / "audit"
+    with TaskQueue(str(tmp_path / "tasks.sqlite")) as queue:
+        old = _finished_task(queue, audit_dir, "old", age_days=40)
+        stop = threading.Event()
+        stop.set()
+        policy = RetentionPolicy(archive_dir=str(tmp_path / "archive"), max_age_days=30, batch_pause_seconds=0)
+        report = run_retention(queue, str(audit_dir), policy, stop)
+
+        assert report.deleted_tasks == 0
+        assert queue.get_task(old) is not None
+
+
+def test_manual_pruning_counts_only_bytes_it_frees(tmp_path) -> None:
+    shots_dir, manual_dir, task_dir = tmp_path / "shots", tmp_path / MANUAL_TASK_ID, tmp_path / "task-1"
+    for directory in (shots_dir, manual_dir, task_dir):
+        directory.mkdir()
+    shared, alone = shots_dir / "shared.png", shots_dir / "alone.png"
+    shared.write_bytes(b"x" * 1000)
+    alone.write_bytes(b"x" * 300)
+    os.link(shared, manual_dir / "a.png")
+    os.link(shared, task_dir / "a.png")  # still needed by a task after the capture goes
+    os.link(alone, manual_dir / "b.png")
+    (manual_dir / "c.png").write_bytes(b"x" * 50)
+
+    left = _prune_manual(str(tmp_path), cutoff=0, excess_bytes=10_000)
+
+    assert list(manual_dir.iterdir()) == []
+    assert left == 10_000 - 300 - 50
@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import io
+import os
+
+from PIL import Image
+
+from telegram_agent.app.tools import screen
+from telegram_agent.app.tools.screen import EncodeOptions, encode_frame
+
+SIZE = (400, 300)
+
+
+def _frame() -> bytearray:
+    # Noise does not compress, which makes the size budget actually bite.
+    return bytearray(os.urandom(SIZE[0] * SIZE[1] * 4))
+
+
+def _decode(data: bytes) -> Image.Image:
+    return Image.open(io.BytesIO(data))
+
+
+def test_default_options_keep_a_full_size_png() -> None:
+    image = _decode(encode_frame(_frame(), SIZE, EncodeOptions()))
+    assert image.format == "PNG"
+    assert image.size == SIZE
+    assert EncodeOptions().lossless
+
+
+def test_downscale_grayscale_and_crop() -> None:
+    options = EncodeOptions(format="jpeg", max_edge=100, grayscale=True)
+    image = _decode(encode_frame(_frame(), SIZE, options, box=(0, 0, 200, 100)))
+    assert image.format == "JPEG"
+    assert image.mode == "L"
+    assert image.size == (100, 50)
+
+
+def test_size_budget_lowers_quality_then_resolution() -> None:
+    options = EncodeOptions(format="webp", quality=90, max_bytes=20_000)
+    data = encode_frame(_frame(), SIZE, options)
+    assert len(data) <= 20_000
+    assert _decode(data).size[0] < SIZE[0]
+
+
+class FakeScreenshot:
+    def __init__(self, monitor: dict[str, int]) -> None:
+        self.size = (monitor["width"], monitor["height"])
+        self.raw = bytearray(monitor["width"] * monitor["height"] * 4)
+
+
+class FakeMss:
+    opened = 0
+
+    def __init__(self) -> None:
+        FakeMss.opened += 1
+        self.monitors = [{"left": 0, "top": 0, "width": 8, "height": 4}] * 2
+
+    def __enter__(self) -> "FakeMss":
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.close()
+
+    def grab(self, monitor: dict[str, int]) -> FakeScreenshot:
+        return FakeScreenshot(monitor)
+
+    def close(self) -> None:
+        pass
+
+
+def test_grabber_reuses_handle_and_layout(monkeypatch) -> None:
+    monkeypatch.setattr(screen.mss, "mss", FakeMss)
+    FakeMss.opened = 0
+    grabber = screen.ScreenGrabber(layout_ttl_seconds=60)
+
+    frames = [grabber.grab(1) for _ in range(5)]
+    # One handle for grabbing, one short-lived handle to enumerate the layout.
+    assert FakeMss.opened == 2
+    assert frames[0].size == (8, 4)
+    assert frames[0].pixels.shape == (4, 8, 4)
+    assert not frames[0].pixels.flags.writeable
+    assert frames[0].pixels.base is not None
+
+    grabber.invalidate()
+    grabber.grab(1)
+    assert FakeMss.opened == 3
+    grabber.close()
+
+
+def test_grabber_notices_layout_changes(monkeypatch) -> None:
+    monkeypatch.setattr(screen.mss, "mss", FakeMss)
+    FakeMss.opened = 0
+    signature = [(0, 0, 8, 4, 1)]
+    grabber = screen.ScreenGrabber(layout_ttl_seconds=60, layout_signature=lambda: signature[0])
+
+    grabber.grab(1)
+    grabber.grab(1)
+    assert FakeMss.opened == 2
+
+    signature[0] = (0, 0, 16, 4, 2)  # a second monitor was plugged in
+    grabber.grab(1)
+    assert FakeMss.opened == 3
+    grabber.close()
+
+
+def test_failed_grab_retries_with_fresh_layout(monkeypatch) -> None:
+    monkeypatch.setattr(screen.mss, "mss", FakeMss)
+    FakeMss.opened = 0
+    grabber = screen.ScreenGrabber(layout_ttl_seconds=60, layout_signature=lambda: None)
+    grabber.grab(1)
+
+    failures = [OSError("monitor gone")]
+    original = FakeMss.grab
+
+    def flaky_grab(self: FakeMss, monitor: dict[str, int]) -> FakeScreenshot:
+        if failures:
+            raise failures.pop()
+        return original(self, monitor)
+
+    monkeypatch.setattr(FakeMss, "grab", flaky_grab)
+    frame = grabber.grab(1)
+
+    assert frame.size == (8, 4)
+    # A new grabbing handle plus a new enumeration.
+    assert FakeMss.opened == 4
+    grabber.close()
+
+
+def test_capture_only_shares_identical_frames(monkeypatch, tmp_path) -> None:
+    import numpy as np
+
+    pixels = np.zeros((60, 80, 4), dtype=np.uint8)
+    pixels[:, :, :3] = np.linspace(0, 255, 80, dtype=np.uint8)[None, :, None]
+    frames = [pixels, pixels.copy(), pixels.copy()]
+    frames[2][30, 40, :3] = 0  # a one-pixel change leaves the perceptual hash alone
+    grabbed = iter(frames)
+    monkeypatch.setattr(screen._grabber, "grab", lambda _: screen.Frame(next(grabbed), 0, 0))
+    monkeypatch.setattr(screen, "_options", EncodeOptions(dedup_distance=4))
+
+    paths = [screen.capture_screen(str(tmp_path), f"task-{i}", "before") for i in range(3)]
+
+    inodes = [os.stat(path).st_ino for path in paths]
+    assert inodes[0] == inodes[1]
+    assert inodes[2] != inodes[0]
+
+
+def test_capture_encodes_on_calling_thread(monkeypatch, tmp_path) -> None:
+    import threading
+
+    import numpy as np
+
+    threads = []
+    encode = screen.encode_frame
+
+    def recording_encode(*args, **kwargs) -> bytes:
+        threads.append(threading.current_thread())
+        return encode(*args, **kwargs)
+
+    monkeypatch.setattr(screen, "encode_frame", recording_encode)
+    monkeypatch.setattr(screen._grabber, "grab", lambda _: screen.Frame(np.zeros((20, 30, 4), dtype=np.uint8), 0, 0))
+    monkeypatch.setattr(screen, "_options", EncodeOptions(format="jpeg", keep_lossless=True, dedup_distance=-1))
+
+    path = screen.capture_screen(str(tmp_path), "task-1", "before")
+
+    assert threads == [threading.current_thread()]
+    assert os.path.exists(path)
+    # The lossless copy is written in the background; wait for it by queueing behind it.
+    screen._lossless_pool.submit(lambda: None).result()
+    assert list(tmp_path.glob("task-1/*_lossless.png"))
+
+
+def test_captures_in_the_same_second_get_their_own_files(monkeypatch, tmp_path) -> None:
+    import numpy as np
+
+    frames = [np.zeros((20, 30, 4), dtype=np.uint8), np.full((20, 30, 4), 255, dtype=np.uint8)]
+    grabbed = iter(frames)
+    monkeypatch.setattr(screen._grabber, "grab", lambda _: screen.Frame(next(grabbed), 0, 0))
+    monkeypatch.setattr(screen, "_options", EncodeOptions(format="png", dedup_distance=4))
+    monkeypatch.setattr(screen.time, "time", lambda: 1_700_000_000.0)
+
+    first = screen.capture_screen(str(tmp_path), "manual", "shot")
+    first_bytes = open(first, "rb").read()
+    second = screen.capture_screen(str(tmp_path), "manual", "shot")
+
+    assert first != second
+    assert open(first, "rb").read() == first_bytes
+    assert open(second, "rb").read() != first_bytes
+    assert all(os.stat(blob).st_nlink == 2 for blob in (tmp_path / "shots").rglob("*.png"))
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import errno
+import os
+
+import numpy as np
+
+from telegram_agent.app.tools.shots import SentFrames, ShotStore, dhash, hamming
+
+
+def _gradient(width: int = 320, height: int = 200) -> np.ndarray:
+    row = np.linspace(0, 255, width, dtype=np.uint8)
+    pixels = np.zeros((height, width, 4), dtype=np.uint8)
+    pixels[:, :, :3] = row[None, :, None]
+    return pixels
+
+
+def test_dhash_tolerates_small_changes() -> None:
+    frame = _gradient()
+    nudged = frame.copy()
+    nudged[10:14, 10:40, :3] = 255  # a caret-sized blip
+    flipped = frame[:, ::-1].copy()
+
+    assert hamming(dhash(frame), dhash(nudged)) <= 2
+    assert hamming(dhash(frame), dhash(flipped)) > 32
+
+
+def test_tiny_frames_get_distinct_hashes() -> None:
+    dark = np.zeros((4, 6, 4), dtype=np.uint8)
+    ramp = _gradient(6, 4)
+
+    assert dhash(ramp) != dhash(dark)
+
+
+def test_store_shares_identical_content_and_prunes_unlinked(tmp_path) -> None:
+    store = ShotStore(str(tmp_path))
+    phash = dhash(_gradient())
+    blob = store.add("ab" * 20, b"jpeg-bytes", "jpg")
+    assert store.find("ab" * 20) == blob
+    assert store.find("ab" * 19 + "ac") is None
+
+    first = tmp_path / "task-1" / "before.jpg"
+    second = tmp_path / "task-2" / "before.jpg"
+    for target in (first, second):
+        target.parent.mkdir()
+        store.link(blob, target, phash)
+    assert os.stat(blob).st_nlink == 3
+    assert store.hash_for(str(second)) == phash
+
+    # Reloading from the index finds the blob again.
+    assert ShotStore(str(tmp_path)).find("ab" * 20) == blob
+
+    first.unlink()
+    assert store.prune() == 0
+    second.unlink()
+    assert store.prune() == len(b"jpeg-bytes")
+    assert not blob.exists()
+    assert ShotStore(str(tmp_path)).find("ab" * 20) is None
+
+
+def test_relinking_a_target_never_rewrites_its_old_blob(tmp_path, monkeypatch) -> None:
+    store = ShotStore(str(tmp_path))
+    first = store.add("aa" * 20, b"frame-a", "png")
+    second = store.add("bb" * 20, b"frame-b", "png")
+    target = tmp_path / "manual" / "shot.png"
+    target.parent.mkdir()
+
+    store.link(first, target, 0)
+    store.link(second, target, 0)
+    assert first.read_bytes() == b"frame-a"
+    assert target.read_bytes() == b"frame-b"
+
+    # Without hard links the copy goes through a temporary file as well.
+    def no_links(*_: object) -> None:
+        raise OSError(errno.EXDEV, "cross-device link")
+
+    monkeypatch.setattr(os, "link", no_links)
+    store.link(first, target, 0)
+    assert second.read_bytes() == b"frame-b"
+    assert target.read_bytes() == b"frame-a"
+    assert [path.name for path in target.parent.iterdir()] == ["shot.png"]
+
+
+def test_sent_frames_skips_repeats_per_chat() -> None:
+    sent = SentFrames(distance=2)
+    assert not sent.is_repeat(1, 0b1111)
+    assert sent.is_repeat(1, 0b1110)
+    assert not sent.is_repeat(2, 0b1110)
+    assert not sent.is_repeat(1, 0b0000)
@@ -12,3 +12,41 @@ def test_tool_registry_allows_registered_tool() -> None:
     registry.register("dummy", dummy)
     assert registry.get("dummy") is dummy
     assert registry.get("missing") is None
+
+
+def test_lazy_tool_is_imported_on_first_use() -> None:
+    registry = ToolRegistry()
+    registry.register_lazy("json.dumps", "json:dumps")
+    assert registry.names() == ["json.dumps"]
+    assert "json.dumps" not in registry.tools
+
+    import json
+
+    assert registry.get("json.dumps") is json.dumps
+    assert registry.tools["json.dumps"] is json.dumps
+
+
+def test_default_registry_imports_no_gui_backend() -> None:
+    import subprocess
+    import sys
+
+    code = (
+        "import sys\n"
+        "from telegram_agent.app.executor import default_tool_registry\n"
+        "names = default_tool_registry().names()\n"
+        "assert 'uia.click_text' in names\n"
+        "print(sorted(m for m in ('mss', 'psutil', 'pyautogui', 'pywinauto') if m in sys.modules))"
+    )
+    completed = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert completed.stdout.strip() == "[]"
+
+
+def test_warmup_resolves_in_background() -> None:
+    registry = ToolRegistry()
+    registry.register_lazy("json.loads", "json:loads")
+    registry.register_lazy("broken", "telegram_agent.missing_module:tool")
+
+    registry.warmup().join(timeout=5)
+
+    assert "json.loads" in registry.tools
+    assert "broken" not in registry.tools
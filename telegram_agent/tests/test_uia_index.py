@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import random
+from difflib import SequenceMatcher
+from itertools import islice
+
+from telegram_agent.app.tools.uia_index import Element, Snapshot, SnapshotCache, columnar, rows, walk
+
+
+def _linear_best(elements: list[Element], text: str, control_type: str | None) -> Element | None:
+    # The scan uia.click_text used before the index; the index must agree with it.
+    query = text.lower()
+    best_score, best = 0.0, None
+    for element in elements:
+        name = element.name.lower()
+        if not name or (control_type and element.control_type != control_type):
+            continue
+        score = 1.0 if query in name else SequenceMatcher(None, query, name).ratio()
+        if score > best_score:
+            best_score, best = score, element
+    return best if best_score >= 0.4 else None
+
+
+class _Tree:
+    def __init__(self, elements: list[Element]) -> None:
+        self.items = elements
+        self.walks = 0
+        self.title = "Editor"
+
+    def window_key(self, window: object) -> tuple:
+        return (window, self.title)
+
+    def elements(self, window: object) -> list[Element]:
+        self.walks += 1
+        return self.items
+
+
+ELEMENTS = [
+    Element("File", "MenuItem", 1),
+    Element("Save As...", "Button", 2),
+    Element("Save", "MenuItem", 3),
+    Element("", "Pane", 4),
+    Element("Cancel", "Button", 5),
+    Element("Open recent", "MenuItem", 6),
+    Element("Toolbox", "Button", 7),
+]
+
+
+def test_index_matches_linear_scan() -> None:
+    snapshot = Snapshot(ELEMENTS)
+    queries = ["save", "Save As", "cancle", "open", "x", "ox", "recent files", "nothing here", "FILE"]
+    for text in queries:
+        for control_type in (None, "Button", "MenuItem", "Slider"):
+            assert snapshot.best_match(text, control_type) == _linear_best(ELEMENTS, text, control_type), (
+                text,
+                control_type,
+            )
+
+
+def test_index_matches_linear_scan_on_random_queries() -> None:
+    # Short queries, typos and near misses are where a pure trigram pre-filter used to disagree.
+    rng = random.Random(11)
+    words = "file edit view save open close print export cancel apply ok next back find zoom page".split()
+    control_types = ("Button", "MenuItem", "Text", "Edit")
+    elements = [
+        Element(" ".join(rng.choice(words) for _ in range(rng.randint(0, 3))).title(), rng.choice(control_types), index)
+        for index in range(400)
+    ]
+    snapshot = Snapshot(elements)
+    alphabet = "abcdefghiklnoprstvwxz "
+    for _ in range(300):
+        if rng.random() < 0.5:
+            text = "".join(rng.choice(alphabet) for _ in range(rng.randint(1, 12)))
+        else:
+            text = list(" ".join(rng.choice(words) for _ in range(rng.randint(1, 2))))
+            for _ in range(rng.randint(0, 3)):
+                text[rng.randrange(len(text))] = rng.choice(alphabet)
+            text = "".join(text)
+        control_type = rng.choice((None, *control_types))
+        assert snapshot.best_match(text, control_type) == _linear_best(elements, text, control_type), (
+            text,
+            control_type,
+        )
+
+
+def test_cache_reuses_snapshot_until_window_changes() -> None:
+    tree = _Tree(ELEMENTS)
+    cache = SnapshotCache(tree, max_age_seconds=60)
+
+    assert cache.get(100) is cache.get(100)
+    assert tree.walks == 1
+
+    tree.title = "Editor - saved"
+    cache.get(100)
+    assert tree.walks == 2
+
+    cache.invalidate()
+    cache.get(100)
+    assert tree.walks == 3
+
+
+def test_walk_is_breadth_first_and_lazy() -> None:
+    # Every node has three children, down to depth 6 (over a thousand nodes).
+    expanded: list[str] = []
+
+    def children(node: str) -> list[str]:
+        expanded.append(node)
+        return [] if len(node) >= 6 else [f"{node}{index}" for index in range(3)]
+
+    first = list(islice(walk("", children), 5))
+
+    assert first == [("", 0, "root"), ("0", 1, "0"), ("1", 1, "1"), ("2", 1, "2"), ("00", 2, "0/0")]
+    assert expanded == ["", "0", "1", "2"]
+    assert [depth for _, depth, _ in walk("", children, max_depth=1)] == [0, 1, 1, 1]
+
+
+def test_columnar_interns_control_types() -> None:
+    nodes = [
+        {"name": "OK", "control_type": "Button"},
+        {"name": "Name", "control_type": "Edit"},
+        {"name": "Cancel", "control_type": "Button"},
+    ]
+
+    encoded = columnar(nodes, ["name", "control_type"])
+
+    assert encoded["control_types"] == ["Button", "Edit"]
+    assert encoded["columns"]["control_type"] == [0, 1, 0]
+    assert rows(encoded) == nodes
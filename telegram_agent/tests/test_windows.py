@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+from telegram_agent.app.tools import windows
+from telegram_agent.app.tools.windows import WindowInfo, WindowRegistry
+
+
+class _Desktop:
+    def __init__(self) -> None:
+        self.titles = {1: "Notepad", 2: "Calculator"}
+        self.scans = 0
+
+    def scan(self) -> list[tuple[WindowInfo, int]]:
+        self.scans += 1
+        return [(WindowInfo(handle, title, 100 + handle), handle) for handle, title in self.titles.items()]
+
+    def title(self, handle: int) -> str:
+        return self.titles[handle]
+
+
+def test_repeated_lookups_reuse_the_window_list() -> None:
+    desktop = _Desktop()
+    registry = WindowRegistry(desktop, ttl_seconds=60)
+
+    assert registry.find("note") == 1
+    assert registry.find("calc") == 2
+    assert registry.find("NOTEPAD") == 1
+    assert desktop.scans == 1
+
+
+def test_closed_or_renamed_window_falls_back_to_a_scan() -> None:
+    desktop = _Desktop()
+    registry = WindowRegistry(desktop, ttl_seconds=60)
+    registry.find("note")
+
+    del desktop.titles[1]
+    desktop.titles[3] = "Notepad - new"
+    assert registry.find("notepad") == 3
+    assert desktop.scans == 2
+
+    assert registry.find("missing") is None
+    assert desktop.scans == 3
+
+
+def test_focus_change_forces_a_scan() -> None:
+    desktop = _Desktop()
+    registry = WindowRegistry(desktop, ttl_seconds=60)
+    registry.find("note")
+
+    windows.focus_changed("input.hotkey")
+    registry.find("note")
+
+    assert desktop.scans == 2